@@ -1,3 +1,7 @@
 from .video_writer import VideoWriter, CV2VideoWriter
+from .video_capture import VideoCapture, FFMPEGVideoCapture
+from .async_writer import AsyncVideoWriter
+from .roi_writer import ROIVideoWriter
+from .raw_writer import RawVideoWriter
 
-__all__ = ["VideoWriter"]
\ No newline at end of file
+__all__ = ["VideoWriter", "VideoCapture", "AsyncVideoWriter", "ROIVideoWriter", "RawVideoWriter"]
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+A VideoWriter for asyncio programs. ffmpeg runs in a subprocess started with asyncio.create_subprocess_exec
+and write() waits for the pipe to drain instead of blocking a thread,
+so many cameras can be recorded from one event loop
+"""
+
+import asyncio
+import logging
+
+import cv2
+
+from cv2cuda.ffmpeg_process import FFMPEG, PIX_FMT_CHANNELS, CHANNELS_PIX_FMT
+from cv2cuda.video_writer import FFMPEGVideoWriter, PYTHON_CONVERSIONS
+from cv2cuda.utils.affinity import apply_process_affinity
+from cv2cuda.rate_control import build_rate_control
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncVideoWriter:
+    """
+    An FFMPEGVideoWriter whose methods are coroutines
+
+        async with AsyncVideoWriter("video.mp4", "h264_nvenc", 30, (1280, 1024)) as writer:
+            await writer.write(frame)
+
+    ffmpeg is started by the first write, with the pixel format of the first frame
+    unless pix_fmt is passed. Frames are written to the pipe right away; whatever ffmpeg
+    did not take yet is buffered by the event loop, and write waits (without blocking the loop)
+    once more than buffer_frames frames are buffered
+
+    Arguments:
+        * filename (str): Path to the video
+        * fourcc (str): ffmpeg encoder, like h264_nvenc or mpeg4
+        * fps (int): Framerate of the video
+        * frameSize (tuple): Width and height of the video. Larger frames are cropped
+        * isColor (bool): If False, the video is encoded in gray
+        * device (str): gpu or cpu
+        * pix_fmt (str): Pixel format of the frames, one of cv2cuda.ffmpeg_process.PIX_FMT_CHANNELS
+        * affinity (tuple): Cores ffmpeg may run on. See cv2cuda.utils.affinity
+        * buffer_frames (int): Frames ffmpeg may be behind before write waits for it
+        * kwargs: Passed to FFMPEG, like preset or gop_duration
+    """
+
+    def __init__(self, filename, fourcc, fps, frameSize, isColor=False, device="gpu", pix_fmt=None, affinity=None, buffer_frames=2, **kwargs):
+        self._filename = filename
+        self._fourcc = fourcc
+        self._fps = fps
+        self._frameSize = frameSize
+        self._width, self._height = frameSize
+        self._isColor = isColor
+        self._device = device
+        self._fixed_pix_fmt = pix_fmt is not None
+        self._pix_fmt = pix_fmt or ("bgr24" if isColor else "gray")
+        self._affinity = affinity
+        self._buffer_frames = buffer_frames
+        # an auto preset is tuned when ffmpeg starts, off the event loop (see _start)
+        self._rate_control = build_rate_control(
+            fps, device=device, rate_control=kwargs.pop("rate_control", None), preset=kwargs.pop("preset", "default"),
+            min_bitrate=kwargs.pop("min_bitrate", None), max_bitrate=kwargs.pop("max_bitrate", None),
+            gop_duration=kwargs.pop("gop_duration", None)
+        )
+        self._kwargs = kwargs
+
+        self._process = None
+        self._command = None
+        self._count = 0
+        self._already_warned = False
+        self._defunct = False
+        self._is_released = False
+
+    def __str__(self):
+        return self._filename
+
+    @property
+    def frames_written(self):
+        """
+        Number of frames passed to ffmpeg
+        """
+        return self._count
+
+    @property
+    def returncode(self):
+        if self._process is None:
+            return None
+        return self._process.returncode
+
+    def _build_command(self):
+        ffmpeg_kwargs = FFMPEGVideoWriter.ffmpeg_kwargs(
+            self._frameSize, self._fps, self._fourcc, isColor=self._isColor, pix_fmt=self._pix_fmt,
+            device=self._device, rate_control=self._rate_control, **self._kwargs
+        )
+        return FFMPEG.build_command(output=self._filename, progress=None, **ffmpeg_kwargs)
+
+    async def _start(self):
+        # tuning runs test encodes for seconds, which would block every other writer of the loop
+        loop = asyncio.get_running_loop()
+        self._rate_control = await loop.run_in_executor(
+            None, self._rate_control.resolve, self._fourcc, self._width, self._height, self._fps
+        )
+        self._command = self._build_command()
+        logger.debug(self._command)
+
+        self._process = await asyncio.create_subprocess_exec(*self._command, stdin=asyncio.subprocess.PIPE)
+        if self._affinity is not None:
+            apply_process_affinity(self._process.pid, self._affinity)
+        frame_bytes = self._width * self._height * PIX_FMT_CHANNELS[self._pix_fmt]
+        self._process.stdin.transport.set_write_buffer_limits(high=self._buffer_frames * frame_bytes)
+
+    def _match_pix_fmt(self, image):
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        if channels == PIX_FMT_CHANNELS[self._pix_fmt]:
+            return image
+
+        if self._process is None and not self._fixed_pix_fmt and channels in CHANNELS_PIX_FMT:
+            # ffmpeg is not running yet, start it with the format of the frames and let it do the conversion
+            self._pix_fmt = CHANNELS_PIX_FMT[channels]
+            return image
+
+        if not self._already_warned:
+            logger.warning(
+                f"Frames with {channels} channels do not match the pixel format of the video ({self._pix_fmt})."
+                " They will be converted in Python"
+            )
+            self._already_warned = True
+
+        code = PYTHON_CONVERSIONS.get((channels, self._pix_fmt))
+        if code is None:
+            raise Exception(f"Cannot convert frames with {channels} channels to {self._pix_fmt}")
+        return cv2.cvtColor(image, code)
+
+    async def write(self, image):
+        """
+        Pipe a frame to ffmpeg. The frame can be reused as soon as this returns
+        """
+        if self._is_released:
+            raise Exception(f"{self._filename} is already released")
+        if self._defunct:
+            return
+
+        image = self._match_pix_fmt(image[:self._height, :self._width])
+        if self._process is None:
+            await self._start()
+
+        if not image.flags.c_contiguous:
+            image = image.copy(order="C")
+
+        stdin = self._process.stdin
+        try:
+            # the event loop copies the part the pipe did not take
+            stdin.write(memoryview(image).cast("B"))
+            await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning(f"The FFMPEG process\n{' '.join(self._command)}\nis defunct")
+            self._defunct = True
+            return
+
+        self._count += 1
+
+    async def aclose(self):
+        """
+        Close the pipe and wait for ffmpeg to finish the video. Returns the exit code of ffmpeg
+        (None if no frame was written)
+        """
+        if self._is_released:
+            return self.returncode
+        self._is_released = True
+
+        if self._process is None:
+            return None
+
+        stdin = self._process.stdin
+        stdin.close()
+        try:
+            await stdin.wait_closed()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        return await self._process.wait()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
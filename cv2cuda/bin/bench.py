@@ -0,0 +1,199 @@
+"""
+cv2cuda bench: run the virtual camera and a video writer over a matrix of
+resolutions, framerates, numbers of parallel jobs, backends and codecs,
+and write a JSON and a CSV report with the throughput of every configuration
+
+It runs on CPU-only hosts with the libx264 / mpeg4 encoders,
+so hardware can be sized before deployment
+"""
+
+import itertools
+import json
+import csv
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import logging
+
+import numpy as np
+import psutil
+import cv2
+
+import cv2cuda
+from cv2cuda import probe
+from cv2cuda.utils.components import get_camera
+
+from .parser import get_bench_parser
+
+logger = logging.getLogger(__name__)
+
+REPORT_FIELDS = [
+    "width", "height", "fps", "jobs", "backend", "codec", "device", "batch", "duration", "status",
+    "frames", "achieved_fps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "dropped",
+    "cpu_percent", "loadavg",
+]
+
+
+def is_supported(backend, codec, device, batch=1):
+    if backend == "cv2":
+        # cv2.VideoWriter has no write_many
+        return len(codec) == 4 and batch == 1
+    return probe.encoder_works(codec, preset=None) and (device == "gpu" or not codec.endswith("nvenc"))
+
+
+def get_bench_writer(folder, idx, backend, codec, fps, frameSize, device):
+    if backend == "cv2":
+        return cv2cuda.CV2VideoWriter(
+            filename=os.path.join(folder, f"bench_{idx}.avi"),
+            apiPreference=cv2.CAP_FFMPEG,
+            fourcc=cv2.VideoWriter_fourcc(*codec),
+            fps=fps,
+            frameSize=frameSize,
+            isColor=False
+        )
+    else:
+        return cv2cuda.VideoWriter(
+            filename=os.path.join(folder, f"bench_{idx}.mp4"),
+            apiPreference="FFMPEG",
+            fourcc=codec,
+            fps=fps,
+            frameSize=frameSize,
+            isColor=False,
+            device=device,
+            preset=None,
+        )
+
+
+def run_job(idx, folder, width, height, fps, backend, codec, device, duration, results, camera=None, batch=1):
+    """
+    Record the virtual camera for duration seconds and store the write latencies in results[idx]
+
+    camera is a dictionary of keyword arguments of cv2cuda.VideoCapture (pattern, source, jitter, drop_rate)
+    If batch is more than 1, frames are collected in a stack of batch frames, written with write_many,
+    and the latency of every frame is that of its stack divided by batch
+    """
+    cap = get_camera("virtual", width, height, fps, idx=idx, **(camera or {}))
+    video_writer = get_bench_writer(folder, idx, backend, codec, fps, (width, height), device)
+    latencies = []
+    stack = None
+    queued = 0
+
+    start_time = time.time()
+    while (time.time() - start_time) < duration:
+        (ret, frame), _ = cap.read()
+        if not ret:
+            break
+        if batch == 1:
+            _, write_msec = video_writer.write(frame)
+            latencies.append(write_msec)
+            continue
+
+        if stack is None:
+            stack = np.empty((batch, ) + frame.shape, frame.dtype)
+        stack[queued] = frame
+        queued += 1
+        if queued == batch:
+            _, write_msec = video_writer.write_many(stack)
+            latencies.extend([write_msec / batch] * batch)
+            queued = 0
+
+    if queued:
+        _, write_msec = video_writer.write_many(stack[:queued])
+        latencies.extend([write_msec / queued] * queued)
+
+    elapsed = time.time() - start_time
+    video_writer.release()
+    cap.release()
+
+    dropped = max(0, int(elapsed * fps) - len(latencies)) + getattr(video_writer, "frames_dropped", 0)
+    results[idx] = {"latencies": latencies, "elapsed": elapsed, "dropped": dropped}
+
+
+def run_cell(width, height, fps, jobs, backend, codec, device, duration, output=None, camera=None, batch=1):
+    """
+    Run one configuration of the matrix and return its row of the report
+    """
+    row = {
+        "width": width, "height": height, "fps": fps, "jobs": jobs, "backend": backend,
+        "codec": codec, "device": device, "batch": batch, "duration": duration,
+    }
+
+    if not is_supported(backend, codec, device, batch):
+        row["status"] = "skipped"
+        return row
+
+    folder = output or tempfile.mkdtemp(prefix="cv2cuda_bench_")
+    os.makedirs(folder, exist_ok=True)
+    results = [None, ] * jobs
+    threads = [
+        threading.Thread(target=run_job, args=(i, folder, width, height, fps, backend, codec, device, duration, results, camera, batch))
+        for i in range(jobs)
+    ]
+
+    psutil.cpu_percent(interval=None)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu_percent = psutil.cpu_percent(interval=None)
+
+    if output is None:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if any(result is None for result in results):
+        row["status"] = "failed"
+        return row
+
+    latencies = np.concatenate([result["latencies"] for result in results])
+    frames = len(latencies)
+    row.update({
+        "status": "ok",
+        "frames": frames,
+        "achieved_fps": round(float(np.mean([len(result["latencies"]) / result["elapsed"] for result in results])), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if frames else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3) if frames else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3) if frames else None,
+        "max_ms": round(float(latencies.max()), 3) if frames else None,
+        "dropped": sum(result["dropped"] for result in results),
+        "cpu_percent": cpu_percent,
+        "loadavg": psutil.getloadavg()[0],
+    })
+    return row
+
+
+def write_report(rows, prefix):
+    with open(prefix + ".json", "w") as filehandle:
+        json.dump(rows, filehandle, indent=2)
+
+    with open(prefix + ".csv", "w", newline="") as filehandle:
+        writer = csv.DictWriter(filehandle, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main(argv=None):
+
+    ap = get_bench_parser()
+    args = ap.parse_args(argv)
+
+    resolutions = [tuple(int(value) for value in resolution.split("x")) for resolution in args.resolutions]
+    matrix = itertools.product(resolutions, args.fps, args.jobs, args.backends, args.codecs, args.batches)
+
+    camera = {"pattern": args.pattern, "source": args.source, "jitter": args.jitter, "drop_rate": args.drop_rate}
+
+    rows = []
+    for (width, height), fps, jobs, backend, codec, batch in matrix:
+        row = run_cell(width, height, fps, jobs, backend, codec, args.device, args.duration, output=args.output, camera=camera, batch=batch)
+        print(row)
+        rows.append(row)
+        # save after every configuration, so a long sweep can be stopped at any point
+        write_report(rows, args.report)
+
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,15 @@ and benchmark your hardware
 """
 
 import signal
+import sys
+import logging
 import time
 import os
 import os.path
 
 from cv2cuda.utils.components import Process, Thread, get_queue
+from cv2cuda.shared_ring import SharedFrameRing
+from cv2cuda.utils.affinity import plan_affinity
 
 from .parser import get_parser
 
@@ -16,13 +20,31 @@ signal_count = 0
 
 def main():
 
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        from .bench import main as bench_main
+        bench_main(sys.argv[2:])
+        return
+
     ap = get_parser()
     args = ap.parse_args()
     kwargs = vars(args)
     njobs = kwargs.pop("jobs")
+    split = kwargs.pop("split")
+    ring_slots = kwargs.pop("ring_slots")
+    affinity = kwargs.pop("affinity")
+    capture_cores = kwargs.pop("capture_cores")
+
+    if affinity:
+        plan = plan_affinity(njobs, capture_cores=capture_cores)
+        for placement in plan:
+            logging.info(placement)
+    else:
+        plan = [None, ] * njobs
 
     processes = [None, ] * njobs
     stop_queues = [None, ] * njobs
+    rings = [None, ] * njobs
+    encoders = [None, ] * njobs
 
     if njobs == 1:
         ProgramClass = Thread
@@ -33,7 +55,13 @@ def main():
         stop_queues[i] = get_queue(1)
         process_kwargs = kwargs.copy()
         process_kwargs["stop_queue"] = stop_queues[i]
+        process_kwargs["affinity"] = plan[i]
+        if split:
+            rings[i] = SharedFrameRing(ring_slots, (kwargs["height"], kwargs["width"]))
+            process_kwargs["ring"] = rings[i]
         processes[i] = ProgramClass(idx=i, **process_kwargs, daemon=True)
+        if split:
+            encoders[i] = processes[i].get_encoder(rings[i])
 
     def quitHandler(signalNumber, frame):
 
@@ -42,6 +70,9 @@ def main():
         print(f"Received: signal.SIGINT")
         for i, process in enumerate(processes):
             process.terminate()
+        for encoder in encoders:
+            if encoder is not None:
+                encoder.terminate()
 
         signal_count += 1
         os._exit(0)
@@ -51,15 +82,23 @@ def main():
 
     for i in range(njobs):
         print(i)
+        if encoders[i] is not None:
+            encoders[i].start()
         processes[i].start()
 
     for i in range(njobs):
         print(i)
         try:
             processes[i].join()
+            if encoders[i] is not None:
+                encoders[i].join()
         except KeyboardInterrupt:
             pass
 
+    for ring in rings:
+        if ring is not None:
+            ring.unlink()
+
 
 if __name__ == "__main__":
     main()
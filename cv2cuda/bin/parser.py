@@ -16,17 +16,63 @@ def get_parser():
     )
     ap.add_argument("--device", default=0, help="Device to be used for encoding of video. Use cpu or gpu. An integer is understood as a GPU id")
     ap.add_argument(
-        "--backend", type=str, default="FFMPEG", choices=["FFMPEG", "cv2"],
+        "--backend", type=str, default="FFMPEG", choices=["FFMPEG", "cv2", "raw"],
         help="""
         Backend to be used to encode the video.
-        Options are cv2 (uses cv2.VideoWriter)
-        or FFMPEG (calls an ffmpeg subprocess
+        Options are cv2 (uses cv2.VideoWriter),
+        FFMPEG (calls an ffmpeg subprocess
         that reads output from the main cv2cuda process and encodes it)
+        or raw (stores the frames unencoded in a .raw file, which is encoded in the background
+        with the fastest encoder of the device once the recording ends, see cv2cuda.raw_writer)
         """
     )
     ap.add_argument("--jobs", type=int, default=1)
+    ap.add_argument(
+        "--split", default=False, action="store_true",
+        help="Capture and encode in separate processes, which exchange frames through shared memory"
+    )
+    ap.add_argument("--ring-slots", type=int, default=16, help="Number of frames the shared memory ring can hold (with --split)")
+    ap.add_argument(
+        "--affinity", default=False, action="store_true",
+        help="Pin the capture process and the ffmpeg encoder of every job to their own cores"
+    )
+    ap.add_argument("--capture-cores", type=int, default=1, help="Number of cores for each capture process (with --affinity)")
+    ap.add_argument(
+        "--pool", default=False, action="store_true",
+        help="Start the ffmpeg process of every job before the first frame arrives, instead of when it does (FFMPEG backend)"
+    )
     ap.add_argument("--profile", type=str, default=None)
     ap.add_argument("--duration", type=int, default=999999)
     ap.add_argument("--yes", default=False, action="store_true")
     return ap
 
+
+
+def get_bench_parser():
+
+    ap = argparse.ArgumentParser(
+        prog="cv2cuda bench",
+        description="Measure the throughput of the video writers over a matrix of configurations"
+    )
+    ap.add_argument("--resolutions", nargs="+", default=["1920x1080", "3860x2178"], help="WIDTHxHEIGHT of the frames")
+    ap.add_argument("--fps", type=int, nargs="+", default=[30])
+    ap.add_argument("--jobs", type=int, nargs="+", default=[1], help="Number of cameras recorded in parallel")
+    ap.add_argument("--backends", nargs="+", default=["FFMPEG"], choices=["FFMPEG", "cv2"])
+    ap.add_argument(
+        "--codecs", nargs="+", default=["libx264", "mpeg4", "MJPG"],
+        help="ffmpeg encoders for the FFMPEG backend and fourcc codes for the cv2 backend."
+        " Combinations that do not apply to a backend are skipped"
+    )
+    ap.add_argument("--device", default="cpu", choices=["cpu", "gpu"], help="Device used by the FFMPEG backend")
+    ap.add_argument(
+        "--batches", type=int, nargs="+", default=[1],
+        help="Number of frames passed to every write. More than 1 uses write_many (FFMPEG backend only)"
+    )
+    ap.add_argument("--duration", type=float, default=10, help="Seconds every configuration runs for")
+    ap.add_argument("--output", type=str, default=None, help="Folder for the videos. By default a temporary folder, removed after each configuration")
+    ap.add_argument("--report", type=str, default="cv2cuda_bench", help="Prefix of the .json and .csv reports")
+    ap.add_argument("--pattern", default="noise", choices=["noise", "blobs"], help="Frames produced by the virtual camera")
+    ap.add_argument("--source", type=str, default=None, help="A .npy or raw file with frames the virtual camera replays instead of the pattern")
+    ap.add_argument("--jitter", type=float, default=0.0, help="Max seconds the virtual camera delivers a frame early or late")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="Probability that the virtual camera drops a frame")
+    return ap
@@ -1,10 +1,31 @@
+import os
 import subprocess
 import shlex
 import logging
 import threading
 import math
+import time
+import tempfile
+import uuid
+import shutil
+
+from cv2cuda.progress import ProgressReader
+from cv2cuda.utils.affinity import apply_process_affinity
+from cv2cuda.rate_control import build_rate_control, AUTO
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
 
 PIX_FMT = "gray" # graycolor format
+# number of channels of the numpy frames piped with each input pixel format
+PIX_FMT_CHANNELS = {"gray": 1, "bgr24": 3, "rgb24": 3, "bgra": 4, "rgba": 4}
+# input pixel format assumed for frames with this number of channels (cv2 convention)
+CHANNELS_PIX_FMT = {1: "gray", 3: "bgr24", 4: "bgra"}
+
+# seconds ffmpeg has to exit after SIGTERM before it is killed
+KILL_TIMEOUT = 5
 
 logger = logging.getLogger(__name__)
 write_log = logging.getLogger(__name__ + ".write")
@@ -12,14 +33,181 @@ terminate_log = logging.getLogger(__name__ + ".terminate")
 # write_log.setLevel(logging.DEBUG)
 # terminate_log.setLevel(logging.DEBUG)
 # FFMPEG_BINARY="/usr/local/ffmpeg4/bin/ffmpeg"
-FFMPEG_BINARY="/usr/local/bin/ffmpeg"
+# the ffmpeg built with CUDA support, unless another binary is set in the environment
+FFMPEG_BINARY=os.environ.get("CV2CUDA_FFMPEG_BINARY", "/usr/local/bin/ffmpeg")
+if not os.path.exists(FFMPEG_BINARY):
+    FFMPEG_BINARY = shutil.which("ffmpeg") or "ffmpeg"
+# the ffprobe next to the ffmpeg binary
+FFPROBE_BINARY = os.path.join(os.path.dirname(FFMPEG_BINARY), "ffprobe")
+if not os.path.exists(FFPROBE_BINARY):
+    FFPROBE_BINARY = shutil.which("ffprobe") or "ffprobe"
+
+
+def write_all(fd, buffer):
+    """
+    Write a C contiguous buffer to a file descriptor without copying it
+    """
+    view = memoryview(buffer).cast("B")
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def writev_all(fd, buffers):
+    """
+    Write several C contiguous buffers to a file descriptor with scatter/gather I/O,
+    in batches of at most IOV_MAX buffers per syscall
+    """
+    buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+    start = 0
+    while start < len(buffers):
+        written = os.writev(fd, buffers[start:start+IOV_MAX])
+        while written and written >= len(buffers[start]):
+            written -= len(buffers[start])
+            start += 1
+        if written:
+            buffers[start] = buffers[start][written:]
+
+
+def write_frame(fd, image):
+    """
+    Write a numpy frame to a file descriptor through the buffer protocol
+
+    Contiguous frames are written in one go.
+    Frames whose rows are contiguous (like a crop of the right edge)
+    are written row by row with scatter/gather I/O.
+    Any other frame is copied first
+
+    Returns the number of copies made (0 or 1)
+    """
+    if image.flags.c_contiguous:
+        write_all(fd, image)
+        return 0
+
+    elif image.ndim > 1 and image.shape[0] > 0 and image[0].flags.c_contiguous:
+        writev_all(fd, list(image))
+        return 0
+
+    else:
+        write_all(fd, image.copy(order="C"))
+        return 1
+
+
+def write_frames(fd, frames):
+    """
+    Write a stack of numpy frames (first axis is the frame) to a file descriptor.
+    A contiguous stack is written in one go, otherwise the frames (or their rows)
+    are gathered in as few writev calls as possible, copying only the frames that need it
+
+    Returns the number of frames copied
+    """
+    if frames.flags.c_contiguous:
+        write_all(fd, frames)
+        return 0
+
+    buffers = []
+    copies = 0
+    for image in frames:
+        if image.flags.c_contiguous:
+            buffers.append(image)
+        elif image.ndim > 1 and image.shape[0] > 0 and image[0].flags.c_contiguous:
+            buffers.extend(image)
+        else:
+            buffers.append(image.copy(order="C"))
+            copies += 1
+
+    writev_all(fd, buffers)
+    return copies
+
+
+class Output:
+    """
+    An extra encoding of the frames piped to a FFMPEG process.
+    ffmpeg splits the incoming stream and encodes every output in its own threads,
+    so Python still writes each frame once
+
+    Arguments:
+        * filename (str): Path to the video
+        * codec (str): Encoder of this output
+        * size (tuple): (width, height) the frames are scaled to. By default they are not scaled
+        * first_frame, last_frame (int): Range of frames (both included) kept in this output.
+        By default all of them
+        * filters (list): Extra ffmpeg filters applied to this output only
+        * flags (str): Extra encoder flags, i.e. "-preset ultrafast" or "-vtag DIVX"
+    """
+
+    def __init__(self, filename, codec="mpeg4", size=None, first_frame=None, last_frame=None, filters=None, flags=""):
+        self.filename = filename
+        self.codec = codec
+        self.size = size
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.filters = list(filters or [])
+        self.flags = flags
+
+    def renamed(self, filename):
+        return Output(
+            filename, codec=self.codec, size=self.size, first_frame=self.first_frame,
+            last_frame=self.last_frame, filters=self.filters, flags=self.flags
+        )
+
+    def clipped(self, filename, first_frame, last_frame=None):
+        """
+        Copy of this output writing to filename, for a process that gets frames first_frame to last_frame
+        (both included, None for all the frames after first_frame) of the recording.
+        The range of the copy is relative to the first frame the process gets.
+        Returns None if the range of this output and the frames of the process do not overlap
+        """
+        if self.last_frame is not None and self.last_frame < first_frame:
+            return None
+        if self.first_frame is not None and last_frame is not None and self.first_frame > last_frame:
+            return None
+
+        start = None
+        if self.first_frame is not None and self.first_frame > first_frame:
+            start = self.first_frame - first_frame
+        end = None
+        if self.last_frame is not None and (last_frame is None or self.last_frame < last_frame):
+            end = self.last_frame - first_frame
+
+        return Output(
+            filename, codec=self.codec, size=self.size, first_frame=start,
+            last_frame=end, filters=self.filters, flags=self.flags
+        )
+
+    def graph(self):
+        """
+        Filter chain of this output
+        """
+        chain = []
+        if self.first_frame is not None or self.last_frame is not None:
+            trim = []
+            if self.first_frame is not None:
+                trim.append(f"start_frame={self.first_frame}")
+            if self.last_frame is not None:
+                trim.append(f"end_frame={self.last_frame + 1}")
+            chain.append(f"trim={':'.join(trim)}")
+            chain.append("setpts=PTS-STARTPTS")
+
+        if self.size is not None:
+            chain.append(f"scale={self.size[0]}:{self.size[1]}")
+
+        chain.extend(self.filters)
+        return ",".join(chain) or "null"
+
+    def arguments(self, label):
+        return f'-map "{label}" -c:v {self.codec} {self.flags} {self.filename}'
+
+    def __repr__(self):
+        return f"Output({self.filename}, {self.codec})"
 
 
 class FFMPEG:
 
-    def __init__(self, width, height, fps, output, device="gpu", codec="h264_nvenc", min_bitrate=None, max_bitrate=None, maxframes=math.inf, encode=True, gop_duration=None):
+    def __init__(self, width, height, fps, output, device="gpu", codec="h264_nvenc", min_bitrate=None, max_bitrate=None, maxframes=math.inf, encode=True, gop_duration=None, pix_fmt=PIX_FMT, output_pix_fmt=None, preset="default", outputs=(), affinity=None, progress=True, hwaccel=None, vf=None, start=None, start_pts=None, rate_control=None):
         """
-        Manage a subprocess which calls ffmpeg and encodes incoming images
+        Manage a subprocess which calls ffmpeg and encodes incoming images,
+        or decodes a video to raw images if encode is False
 
         Arguments:
             * width, height (int): Width and height of the images
@@ -28,9 +216,42 @@ class FFMPEG:
             * device (str): If gpu, ffmpeg is called with gpu acceleration
             * codec (str): If device = gpu, this should be h264_nvenc, otherwise,
             it should be one of the codes available for the cv2.VideoWriter_fourcc call
-            * encode (str): For now it should always be True
+            * encode (str): If False, output is the video to decode and width, height are the size of the decoded images
+            * pix_fmt (str): Pixel format of the incoming (or decoded) images, one of PIX_FMT_CHANNELS
+            * output_pix_fmt (str): Pixel format passed to the encoder. ffmpeg converts to it in its own threads.
+            If gray and the images are in color, they are turned gray by ffmpeg.
+            By default, color images are encoded as nv12 (gpu) or yuv420p (cpu)
+            * preset (str): Encoder preset. By default llhp on the gpu and none on the cpu. auto picks the best one
+            that keeps up on this host (see cv2cuda.rate_control.autotune)
+            * min_bitrate, max_bitrate (int): Bounds of the bitrate in bits/s (variable bitrate)
+            * gop_duration (float): Seconds between keyframes
+            * rate_control (RateControl): Rate control options (mode, bitrates, quality, preset, GOP).
+            If passed, preset, min_bitrate, max_bitrate and gop_duration are ignored
+            * outputs (list): Extra Output encodings of the same frames, produced by this process.
+            If output is None, only these are encoded
+            * affinity (tuple): Cores ffmpeg (and all its threads) may run on. See cv2cuda.utils.affinity
+            * progress (bool): If True, ffmpeg reports its progress on a dedicated pipe, available in self.stats
+            * hwaccel (str): Hardware decoder, like cuda (only when decoding)
+            * vf (list): ffmpeg filters applied to the decoded images, like crop or scale (only when decoding)
+            * start (float): Seconds of video skipped before the first decoded image (only when decoding)
+            * start_pts (float): If passed, ffmpeg jumps to the keyframe before start, without decoding anything before it,
+            and the images with a timestamp (as stored in the file) earlier than start_pts are dropped (only when decoding)
         """
-        command, registers = self._setup(width, height, fps, output, device=device, max_bitrate=max_bitrate, min_bitrate=min_bitrate, maxframes=maxframes, codec=codec, encode=encode, gop_duration=gop_duration)
+        if progress:
+            progress_read, progress_write = os.pipe()
+            pass_fds = (progress_write, )
+        else:
+            progress_read, progress_write = None, None
+            pass_fds = ()
+
+        if encode and (preset == AUTO or getattr(rate_control, "preset", None) == AUTO):
+            # tune the preset once for this host (the result is cached). Video writers pass it tuned already
+            rate_control = build_rate_control(
+                fps, device=device, rate_control=rate_control, preset=preset,
+                min_bitrate=min_bitrate, max_bitrate=max_bitrate, gop_duration=gop_duration
+            ).resolve(codec, width, height, fps)
+
+        command, registers = self._setup(width, height, fps, output, device=device, max_bitrate=max_bitrate, min_bitrate=min_bitrate, maxframes=maxframes, codec=codec, encode=encode, gop_duration=gop_duration, pix_fmt=pix_fmt, output_pix_fmt=output_pix_fmt, preset=preset, outputs=outputs, progress=progress_write, hwaccel=hwaccel, vf=vf, start=start, start_pts=start_pts, rate_control=rate_control)
         print(command)
         cmd = shlex.split(command)
         self._cmd = cmd
@@ -43,30 +264,74 @@ class FFMPEG:
             stdout=registers[1],
             shell=False,
             bufsize=0,
+            pass_fds=pass_fds,
         )
+        if affinity is not None:
+            # set by PID once ffmpeg runs (a preexec_fn is not safe while other threads are running)
+            apply_process_affinity(self._process.pid, affinity)
         self._terminate_event = False
+        # frames piped to ffmpeg, and how many of them had to be copied
+        self.frames_written = 0
+        self.copies = 0
+        # time.time() when ffmpeg was started, when the write in progress started (None between writes)
+        # and when frames were piped for the first and last time, read by cv2cuda.watchdog
+        self.started_at = time.time()
+        self.write_started = None
+        self.first_write = None
+        self.last_write = None
+        if progress:
+            # ffmpeg holds the write end now, so the reader sees EOF when ffmpeg exits
+            os.close(progress_write)
+            self._progress = ProgressReader(progress_read)
+            self._progress.start()
+        else:
+            self._progress = None
+        # set by FFMPEGPool when the output is reached through a symlink
+        self.placeholder = None
 
         self._validate_popen()
         self._lock = threading.Lock()
 
 
 
+    @classmethod
+    def build_command(cls, width, height, fps, output, **kwargs):
+        """
+        Return the arguments of the ffmpeg call a FFMPEG with these settings would run, without running it
+        """
+        command, _ = cls.__new__(cls)._setup(width, height, fps, output, **kwargs)
+        return shlex.split(command)
+
+    @property
+    def stats(self):
+        """
+        Last cv2cuda.progress.EncoderStats reported by ffmpeg, or None if progress is disabled
+        """
+        if self._progress is None:
+            return None
+        return self._progress.stats
+
     def _validate_popen(self):
 
         if self._process.poll() is None:
             logger.info(f"{self._command} is alive")
 
-    def _setup(self, width, height, fps, output, device="gpu", min_bitrate=None, max_bitrate=None, maxframes=math.inf, codec="h264_nvenc", encode=True, gop_duration=None):
+    def _setup(self, width, height, fps, output, device="gpu", min_bitrate=None, max_bitrate=None, maxframes=math.inf, codec="h264_nvenc", encode=True, gop_duration=None, pix_fmt=PIX_FMT, output_pix_fmt=None, preset="default", outputs=(), progress=None, hwaccel=None, vf=None, start=None, start_pts=None, rate_control=None):
+
+        if not encode:
+            return self._setup_decoder(output, pix_fmt=pix_fmt, progress=progress, hwaccel=hwaccel, vf=vf, start=start, start_pts=start_pts)
 
         # drawtext = r'drawtext="box=1:text=\'%{n}\':x=(w-tw)*0.01: y=(2*lh):fontcolor=black: fontsize=16"'
         # pipeline = f'-vf {drawtext} {output}'
         pipeline = output
 
         # ffmpeg -hide_banner -h encoder=h264_nvenc | xclip -sel clip
-        encoder_flags = " "#-preset lossless "
-
-        if gop_duration is not None:
-            encoder_flags += f"-g {int(fps * gop_duration)}"
+        rate_control = build_rate_control(
+            fps, device=device, rate_control=rate_control, preset=preset,
+            min_bitrate=min_bitrate, max_bitrate=max_bitrate, gop_duration=gop_duration
+        )
+        # an auto preset must be tuned before (see __init__), building a command runs no test encode
+        encoder_flags = rate_control.flags(codec)
 
         # if "highspeed" in output:
         #     encoder_flags = f"-g {int(fps*60)}"
@@ -75,36 +340,71 @@ class FFMPEG:
         print(f"Encoder flags: {encoder_flags}")
         # import ipdb; ipdb.set_trace()
 
-        if not encode:
-            raise Exception("Decoder is not yet implemented")
+        filters = []
+        if width % 2 == 1 or height % 2 == 1:
+            # the encoders need even dimensions, drop the last column / row like cv2cuda used to do in Python
+            filters.append(f"crop={width - width % 2}:{height - height % 2}:0:0")
+
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise Exception(f"pix_fmt must be one of {list(PIX_FMT_CHANNELS)}, not {pix_fmt}")
+
+        if output_pix_fmt is None and pix_fmt != "gray":
+            output_pix_fmt = "nv12" if device == "gpu" else "yuv420p"
+
+        pix_fmt_flags = ""
+        if output_pix_fmt == "gray":
+            if pix_fmt != "gray":
+                filters.append("format=gray")
+        elif output_pix_fmt is not None and output_pix_fmt != pix_fmt:
+            pix_fmt_flags = f"-pix_fmt {output_pix_fmt}"
+
+        extra_outputs = ""
+        # without an output, only the extra outputs are encoded
+        only_outputs = output is None and bool(outputs)
+        if outputs:
+            # split the stream inside ffmpeg, the main output is the first branch
+            first = 1 if only_outputs else 0
+            labels = "".join(f"[v{i}]" for i in range(first, len(outputs) + 1))
+            graph = f"[0:v]{','.join(filters + [f'split={len(outputs) + 1 - first}'])}{labels}"
+            for i, extra in enumerate(outputs, 1):
+                graph += f";[v{i}]{extra.graph()}[o{i}]"
+                extra_outputs += f" {extra.arguments(f'[o{i}]')}"
+            if only_outputs:
+                filter_flags = f'-filter_complex "{graph}"'
+            else:
+                filter_flags = f'-filter_complex "{graph}" -map "[v0]" {pix_fmt_flags}'
 
+        elif filters:
+            filter_flags = f"-vf {','.join(filters)} {pix_fmt_flags}"
+        else:
+            filter_flags = pix_fmt_flags
+
+        if progress is None:
+            progress_flags = ""
+        else:
+            progress_flags = f"-progress pipe:{progress}"
 
         if device == "gpu":
-            command = f"{FFMPEG_BINARY} -y -hwaccel cuda -hwaccel_output_format nv12 -loglevel warning -r {fps} -f rawvideo -pix_fmt {PIX_FMT}"\
+            command = f"{FFMPEG_BINARY} -y -hwaccel cuda -hwaccel_output_format nv12 -loglevel warning {progress_flags} -r {fps} -f rawvideo -pix_fmt {pix_fmt}"\
                 " -vsync 0 -extra_hw_frames 2"\
                 f" -s {width}x{height}"
-            if output is None:
-                command += f" -i - -an -c:v {codec} -preset llhp -f null - "
+            if only_outputs:
+                command += f" -i - -an {filter_flags}{extra_outputs}"
+            elif output is None:
+                command += f" -i - -an {filter_flags} -c:v {codec} {encoder_flags} -f null - {extra_outputs}"
             else:
-                command += f" -i - -an -c:v {codec} -preset llhp {encoder_flags} {pipeline}"
-
-            if "FlyHostel1" in command:
-                command=f"taskset -c 0-5 {command}"
-            elif "FlyHostel2" in command:
-                command=f"taskset -c 6-11 {command}"
-            elif "FlyHostel3" in command:
-                command=f"taskset -c 12-17 {command}"
-            elif "FlyHostel4" in command:
-                command=f"taskset -c 18-23 {command}"
+                command += f" -i - -an {filter_flags} -c:v {codec} {encoder_flags} {pipeline}{extra_outputs}"
 
 
         elif device == "cpu":
-                command = f"ffmpeg -loglevel warning -y  -r {fps} -f rawvideo  -pix_fmt {PIX_FMT}"\
+                command = f"{FFMPEG_BINARY} -loglevel warning {progress_flags} -y  -r {fps} -f rawvideo  -pix_fmt {pix_fmt}"\
                     f" -s {width}x{height}"
-                if output is None:
-                    command += f" -i - -an -vcodec {codec} -f null -"
+                if only_outputs:
+                    command += f" -i - -an {filter_flags}{extra_outputs}"
+                elif output is None:
+                    command += f" -i - -an {filter_flags} -vcodec {codec} {encoder_flags} -f null -{extra_outputs}"
                 else:
-                    command += f" -i - -an -vcodec {codec} {pipeline}"
+                    command += f" -i - -an {filter_flags} -vcodec {codec} {encoder_flags} {pipeline}{extra_outputs}"
 
         if encode:
             registers = (subprocess.PIPE, None)
@@ -115,6 +415,36 @@ class FFMPEG:
 
 
 
+    def _setup_decoder(self, input, pix_fmt=PIX_FMT, progress=None, hwaccel=None, vf=None, start=None, start_pts=None):
+        """
+        Build a command that decodes input and writes raw images to stdout
+        """
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise Exception(f"pix_fmt must be one of {list(PIX_FMT_CHANNELS)}, not {pix_fmt}")
+
+        command = f"{FFMPEG_BINARY} -nostdin -loglevel warning"
+        if progress is not None:
+            command += f" -progress pipe:{progress}"
+        if hwaccel is not None:
+            # frames are downloaded to system memory before the filters
+            command += f" -hwaccel {hwaccel}"
+        vf = list(vf or [])
+        if start_pts is not None:
+            # keep the timestamps of the file, so frames can be selected by them whatever the seek landed on
+            command += " -noaccurate_seek -copyts"
+            vf.insert(0, f"select=gte(t\\,{start_pts:.6f})")
+        if start:
+            command += f" -ss {start:.6f}"
+
+        command += f" -i {shlex.quote(input)} -an"
+        if vf:
+            command += f" -vf {shlex.quote(','.join(vf))}"
+        if start_pts is not None:
+            command += " -vsync 0"
+        command += f" -f rawvideo -pix_fmt {pix_fmt} -"
+
+        return command, (None, subprocess.PIPE)
+
     def _setup_not_working(self, width, height, fps, output, device="gpu", min_bitrate=None, max_bitrate=None, maxframes=math.inf, codec="h264_nvenc", encode=True):
 
 
@@ -179,7 +509,7 @@ class FFMPEG:
 
 
         # elif device == "cpu":
-        #         command = f"ffmpeg -loglevel {loglevel} -y  -r {fps} -f rawvideo  -pix_fmt {PIX_FMT}"\
+        #         command = f"ffmpeg -loglevel {loglevel} -y  -r {fps} -f rawvideo  -pix_fmt {pix_fmt}"\
         #             f" -s {width}x{height}"
         #         if output is None:
         #             command += f" -i - {bitrate} -an -vcodec {codec} -f null -"
@@ -196,47 +526,155 @@ class FFMPEG:
 
 
     def write(self, image):
+        """
+        Pipe a frame to ffmpeg. Returns False if ffmpeg is gone and the frame was not piped
+        """
+        if self._terminate_event:
+            return False
 
-        if not self._terminate_event:
-            with self._lock:
-                try:
-                    self._process.stdin.write(image)
-                    # write_log.debug(f"{image.shape} to {self._command}")
-                except BrokenPipeError as error:
-                    write_log.warning(
-                        "The FFMPEG process\n"\
-                        f"{self._command}"\
-                        "\nis defunct"
-                    )
-                    self._terminate_event = 2
+        with self._lock:
+            self.write_started = time.time()
+            try:
+                self.copies += write_frame(self._process.stdin.fileno(), image)
+                self.frames_written += 1
+                self._piped()
+                # write_log.debug(f"{image.shape} to {self._command}")
+            except BrokenPipeError as error:
+                write_log.warning(
+                    "The FFMPEG process\n"\
+                    f"{self._command}"\
+                    "\nis defunct"
+                )
+                self._terminate_event = 2
+                return False
+            finally:
+                self.write_started = None
+        return True
 
                 # poll = self._process.poll()
                 # print(f"Poll {poll}")
                 # if poll is not None:
                 #     self.terminate()
 
-    def terminate(self):
+    def write_many(self, frames):
+        """
+        Write a stack of frames (first axis is the frame) holding the lock once.
+        Returns False if ffmpeg is gone and the frames were not (all) piped
+        """
+        if self._terminate_event:
+            return False
+
         with self._lock:
-            print(f"Executing ffmpeg process terminate() for {self._command}")
+            self.write_started = time.time()
+            try:
+                self.copies += write_frames(self._process.stdin.fileno(), frames)
+                self.frames_written += len(frames)
+                self._piped()
+            except BrokenPipeError as error:
+                write_log.warning(
+                    "The FFMPEG process\n"\
+                    f"{self._command}"\
+                    "\nis defunct"
+                )
+                self._terminate_event = 2
+                return False
+            finally:
+                self.write_started = None
+        return True
+
+    def _piped(self):
+        self.last_write = time.time()
+        if self.first_write is None:
+            self.first_write = self.last_write
+
+    def read_into(self, buffer):
+        """
+        Fill a C contiguous buffer with the next decoded image.
+        Returns False if the video ended before the buffer was full
+        """
+        view = memoryview(buffer).cast("B")
+        while view:
+            read = self._process.stdout.readinto(view)
+            if not read:
+                return False
+            view = view[read:]
+        return True
+
+    def _close_pipes(self):
+        for pipe in (self._process.stdin, self._process.stdout):
+            if pipe is not None:
+                pipe.close()
+
+    def close(self, timeout=None, kill_timeout=KILL_TIMEOUT):
+        """
+        Close the pipe and wait for ffmpeg to finish the video.
+        If it is not done after timeout seconds, it is terminated (see stop)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        # a write blocked on a pipe ffmpeg does not read holds the lock
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            logger.warning(f"A write to {self._command} has been blocked for {timeout} seconds")
+            # the blocked write fails with a broken pipe once ffmpeg is gone
+            self.stop(kill_timeout)
+            self._lock.acquire()
+        try:
             self._terminate_event = True
+            self._close_pipes()
+        finally:
+            self._lock.release()
+        try:
+            returncode = self._process.wait(timeout=None if deadline is None else max(0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self._command} did not finish in {timeout} seconds")
+            returncode = self.stop(kill_timeout)
+        if self._progress is not None:
+            # read the last report (progress=end)
+            self._progress.join(timeout=1)
+        self._remove_placeholder()
+        return returncode
+
+    def _remove_placeholder(self):
+        if self.placeholder is not None and os.path.islink(self.placeholder):
+            os.remove(self.placeholder)
+
+    def terminate(self, timeout=KILL_TIMEOUT):
+        """
+        Close the pipe and stop ffmpeg right away (see stop)
+        """
+        with self._lock:
             logger.debug(f"Terminating {self._command}")
-            self._process.stdin.close()
-            out = self._process.terminate()
-            self._process.wait()
-            print(f"out: {out}")
-            # self._process.communicate()
-            self._process.poll()
-            assert self._process.returncode is not None
+            self._terminate_event = True
+            self._close_pipes()
+        return self.stop(timeout)
+
+    def stop(self, timeout=KILL_TIMEOUT):
+        """
+        Send SIGTERM to ffmpeg, which makes it finish the file with what it has,
+        and SIGKILL if it is still running timeout seconds later. Returns the exit code
+        """
+        self._process.terminate()
+        try:
+            return self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self._command} ignored SIGTERM for {timeout} seconds. Killing it")
             self._process.kill()
+            return self._process.wait()
 
     def kill(self):
-        self._process.stdin.close()
-        return self._process.kill()
+        # kill before closing the pipes, so ffmpeg does not complain about a broken pipe
+        out = self._process.kill()
+        self._close_pipes()
+        self._remove_placeholder()
+        return out
 
 
     def poll(self):
         return self._process.poll()
 
+    @property
+    def pid(self):
+        return self._process.pid
+
     @property
     def returncode(self):
         return self._process.returncode
@@ -244,3 +682,135 @@ class FFMPEG:
 
     def wait(self, *args, **kwargs):
         return self._process.wait(*args, **kwargs)
+
+
+class FFMPEGPool:
+    """
+    Keep ffmpeg processes started in advance, so a video writer
+    gets one with the cost of a pipe handoff instead of a subprocess.Popen
+
+    Idle processes are grouped by the arguments they were started with
+    (width, height, fps, codec, pixel format ...) and the extension of the output.
+    They write to a placeholder in directory which becomes the real output when the process is handed out:
+    the placeholder is renamed if ffmpeg already created it,
+    or else it is made a symlink to the output before ffmpeg opens it.
+    A handout is followed by a refill in the background if the caller says it will need another process,
+    so a recording that uses a single process does not keep an idle one (and on GPU, an NVENC session) for nothing
+
+    Arguments:
+        * size (int): Number of idle processes kept for each set of arguments
+        * directory (str): Folder of the placeholders, ideally on the filesystem of the outputs
+    """
+
+    def __init__(self, size=1, directory=None):
+        self._size = size
+        if directory is None:
+            directory = tempfile.gettempdir()
+        self._directory = directory
+        self._idle = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def _key(extension, kwargs):
+        return (extension, tuple(sorted(kwargs.items())))
+
+    def _spawn(self, extension, kwargs):
+        placeholder = os.path.join(self._directory, f".cv2cuda-pool-{uuid.uuid4().hex}{extension}")
+        return FFMPEG(output=placeholder, **kwargs), placeholder
+
+    @staticmethod
+    def _dispose(ffmpeg, placeholder):
+        ffmpeg.kill()
+        ffmpeg.wait()
+        if os.path.lexists(placeholder):
+            os.remove(placeholder)
+
+    def _refill(self, extension, kwargs):
+        key = self._key(extension, kwargs)
+        with self._lock:
+            missing = self._size - len(self._idle.get(key, [])) - self._pending.get(key, 0)
+            if self._closed or missing <= 0:
+                return
+            self._pending[key] = self._pending.get(key, 0) + missing
+
+        for _ in range(missing):
+            try:
+                spawned = self._spawn(extension, kwargs)
+            except Exception as error:
+                logger.warning(f"Could not prestart ffmpeg: {error}")
+                spawned = None
+
+            with self._lock:
+                self._pending[key] -= 1
+                if spawned is None:
+                    continue
+                if self._closed:
+                    self._dispose(*spawned)
+                else:
+                    self._idle.setdefault(key, []).append(spawned)
+
+    def prewarm(self, extension=".mp4", **kwargs):
+        """
+        Start idle processes in the background for outputs with this extension
+        and FFMPEG called with these arguments
+        """
+        thread = threading.Thread(target=self._refill, args=(extension, kwargs), name="cv2cuda-pool-refill", daemon=True)
+        thread.start()
+        return thread
+
+    def acquire(self, output, refill=False, **kwargs):
+        """
+        Return a FFMPEG instance writing to output, taken from the pool if one is ready
+
+        Arguments:
+            * output (str): Path of the video
+            * refill (bool): Start another idle process in the background for the next acquire with these arguments
+        """
+        extension = os.path.splitext(output)[1]
+        key = self._key(extension, kwargs)
+
+        with self._lock:
+            idle = self._idle.get(key, [])
+            spawned = idle.pop(0) if idle else None
+
+        if refill:
+            self.prewarm(extension, **kwargs)
+
+        if spawned is not None:
+            ffmpeg, placeholder = spawned
+            if ffmpeg.poll() is None:
+                try:
+                    self._hand_over(ffmpeg, placeholder, output)
+                    return ffmpeg
+                except OSError as error:
+                    logger.warning(f"Could not hand {placeholder} over to {output}: {error}")
+            self._dispose(ffmpeg, placeholder)
+
+        logger.info(f"No prestarted ffmpeg is available for {output}")
+        return FFMPEG(output=output, **kwargs)
+
+    @staticmethod
+    def _hand_over(ffmpeg, placeholder, output):
+        if os.path.lexists(output):
+            os.remove(output)
+
+        if os.path.isfile(placeholder) and not os.path.islink(placeholder):
+            # ffmpeg has already opened its output
+            os.replace(placeholder, output)
+        else:
+            os.symlink(os.path.abspath(output), placeholder)
+            ffmpeg.placeholder = placeholder
+
+    def close(self):
+        """
+        Kill the idle processes
+        """
+        with self._lock:
+            self._closed = True
+            idle = [spawned for processes in self._idle.values() for spawned in processes]
+            self._idle = {}
+
+        for spawned in idle:
+            self._dispose(*spawned)
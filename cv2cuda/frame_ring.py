@@ -0,0 +1,404 @@
+import os
+import os.path
+import time
+import uuid
+import tempfile
+import collections
+import threading
+import logging
+
+from cv2cuda.ffmpeg_process import writev_all
+
+try:
+    import numpy as np # type: ignore
+except ModuleNotFoundError:
+    raise Exception("The frame ring requires numpy installed (pip install numpy)")
+
+OVERFLOW_POLICIES = ["block", "drop-oldest", "drop-newest"]
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing:
+    """
+    A bounded ring of preallocated frame slots, shared by a producer
+    (the capture loop) and a consumer (the thread feeding ffmpeg)
+
+    The producer copies every frame into a free slot and returns right away,
+    so the only cost paid by the capture loop is one memcpy.
+    The slots are allocated with the shape and dtype of the first frame
+
+    Arguments:
+        * capacity (int): Number of frame slots
+        * overflow (str): What to do when all slots are taken. One of
+            block: wait until the consumer frees a slot
+            drop-oldest: discard the oldest queued frame and take its slot
+            drop-newest: discard the incoming frame
+    """
+
+    def __init__(self, capacity, overflow="block"):
+
+        if capacity < 1:
+            raise Exception(f"capacity must be at least 1, not {capacity}")
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise Exception(f"overflow must be one of {OVERFLOW_POLICIES}, not {overflow}")
+
+        self._capacity = capacity
+        self._overflow = overflow
+        self._slots = None
+        # whatever the producer passed along with the frame of each slot
+        self._stamps = [None] * capacity
+        self._free = collections.deque(range(capacity))
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.enqueued = 0
+        self.dropped = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def overflow(self):
+        return self._overflow
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _allocate(self, frame):
+        self._slots = np.empty((self._capacity, *frame.shape), dtype=frame.dtype)
+
+    def _check_frame(self, frame):
+        if self._slots is None:
+            self._allocate(frame)
+
+        elif frame.shape != self._slots.shape[1:] or frame.dtype != self._slots.dtype:
+            raise Exception(
+                f"Frame of shape {frame.shape} and dtype {frame.dtype} does not fit"
+                f" in slots of shape {self._slots.shape[1:]} and dtype {self._slots.dtype}"
+            )
+
+    def _take_slot(self, timeout):
+        """
+        Return the index of a slot the producer can write to,
+        or None if the frame must be dropped
+        """
+        with self._cond:
+            if self._closed:
+                raise Exception("Cannot put frames in a closed FrameRing")
+
+            if not self._free:
+                if self._overflow == "block":
+                    if not self._cond.wait_for(lambda: self._free or self._closed, timeout=timeout):
+                        self.dropped += 1
+                        return None
+                    if self._closed:
+                        raise Exception("Cannot put frames in a closed FrameRing")
+
+                elif self._overflow == "drop-oldest" and self._queue:
+                    self.dropped += 1
+                    return self._queue.popleft()
+
+                else:
+                    # drop-newest, or drop-oldest while the only slot is being consumed
+                    self.dropped += 1
+                    return None
+
+            return self._free.popleft()
+
+    def put(self, frame, timeout=None, stamp=None):
+        """
+        Copy a frame into the ring. stamp (like the capture time) is kept with it, see stamp(index)
+
+        Returns True if the frame was queued and False if it was dropped
+        """
+        self._check_frame(frame)
+        index = self._take_slot(timeout)
+        if index is None:
+            return False
+
+        np.copyto(self._slots[index], frame)
+        self._stamps[index] = stamp
+
+        with self._cond:
+            self._queue.append(index)
+            self.enqueued += 1
+            self._cond.notify_all()
+
+        return True
+
+    def get(self, timeout=None):
+        """
+        Return the index of the oldest queued slot.
+        The caller owns the slot until it calls release(index)
+
+        Returns None if the ring is closed and empty, or on timeout
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._closed, timeout=timeout)
+            if not self._queue:
+                return None
+            return self._queue.popleft()
+
+    def slot(self, index):
+        return self._slots[index]
+
+    def stamp(self, index):
+        return self._stamps[index]
+
+    def release(self, index):
+        with self._cond:
+            self._free.append(index)
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Stop accepting frames. Frames already queued can still be consumed
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class SpillRing(FrameRing):
+    """
+    A FrameRing that never drops or blocks: when all slots are taken, frames are appended
+    to a spill file on local disk, with large buffered writes, and read back in order once the consumer
+    has taken the frames in memory. While there are frames on disk, new frames go to disk too,
+    so the consumer gets them in the order they were put. The file is emptied every time the consumer catches up
+
+    The file is read and written outside the lock of the ring, which only guards the counters,
+    so the producer never waits for a read of the consumer nor the other way around.
+    The producer writes at the end of the file and the consumer reads at its own offset (pread).
+    The buffer of the producer is flushed when it is full, or by the consumer when it needs the frames in it
+
+    The stamp of every frame must be None or a tuple of two floats, like (timestamp, write time)
+
+    Arguments:
+        * capacity (int): Number of frame slots in memory
+        * directory (str): Folder of the spill file, by default the temporary folder
+        * buffer_size (int): Bytes buffered before a write to the spill file
+    """
+
+    # metadata written before every spilled frame: the two values of its stamp
+    STAMP_DTYPE = np.dtype("<f8")
+
+    def __init__(self, capacity, directory=None, buffer_size=8 * 1024 * 1024):
+        super().__init__(capacity, overflow="block")
+        if directory is None:
+            directory = tempfile.gettempdir()
+        self._path = os.path.join(directory, f".cv2cuda-spill-{uuid.uuid4().hex}")
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._buffer_size = buffer_size
+        # guards the buffer of the producer and the end of the file. Taken before self._cond, never after
+        self._write_lock = threading.Lock()
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._buffered_frames = 0
+        # the slot frames read back from disk are placed in, handed out with index capacity
+        self._spill_slot = None
+        self._spill_stamp = None
+        self._read_stamp = np.empty(2, self.STAMP_DTYPE)
+        self._record_size = None
+        # frames bound for disk and not consumed yet (some may still be on their way)
+        self._on_disk = 0
+        # since the file was last emptied: frames appended (to the buffer or the file), frames in the file and frames read
+        self._appended = 0
+        self._on_file = 0
+        self._read = 0
+        self._spill_started = None
+
+        self.spilled_frames = 0
+        self.spilled_bytes = 0
+        # seconds it took the consumer to empty the spill file the last time
+        self.catchup_time = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def ram_depth(self):
+        return len(self._queue)
+
+    @property
+    def disk_depth(self):
+        return self._on_disk
+
+    @property
+    def queued(self):
+        return len(self._queue) + self._on_disk
+
+    def _allocate(self, frame):
+        super()._allocate(frame)
+        self._spill_slot = np.empty(frame.shape, dtype=frame.dtype)
+        self._record_size = self._read_stamp.nbytes + frame.nbytes
+
+    def _flush(self):
+        """
+        Write the buffer of the producer to the file. The caller holds self._write_lock
+        """
+        if not self._buffer:
+            return
+        writev_all(self._fd, self._buffer)
+        frames = self._buffered_frames
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._buffered_frames = 0
+        with self._cond:
+            self._on_file += frames
+
+    def _spill(self, frame, stamp):
+        # copies of the stamp and the frame, the caller may reuse its frame right away
+        stamp = np.array([np.nan, np.nan] if stamp is None else stamp, dtype=self.STAMP_DTYPE)
+        frame = np.array(frame, order="C")
+
+        with self._write_lock:
+            self._buffer += [stamp, frame]
+            self._buffered_bytes += stamp.nbytes + frame.nbytes
+            self._buffered_frames += 1
+            with self._cond:
+                self._appended += 1
+                self.spilled_frames += 1
+                self.spilled_bytes += stamp.nbytes + frame.nbytes
+                self._cond.notify_all()
+            if self._buffered_bytes >= self._buffer_size:
+                self._flush()
+
+    def put(self, frame, timeout=None, stamp=None):
+        """
+        Copy a frame into a slot or, if none is free or frames are waiting on disk, to the spill file.
+        Always returns True
+        """
+        self._check_frame(frame)
+
+        with self._cond:
+            if self._closed:
+                raise Exception("Cannot put frames in a closed FrameRing")
+            spill = not self._free or self._on_disk
+            if spill:
+                if self._on_disk == 0:
+                    self._spill_started = time.time()
+                    logger.warning(f"The consumer is {self._capacity} frames behind. Spilling frames to {self._path}")
+                # counted before the frame is written, so the next frames follow it to disk
+                self._on_disk += 1
+                self.enqueued += 1
+            else:
+                index = self._free.popleft()
+
+        if spill:
+            self._spill(frame, stamp)
+            return True
+
+        np.copyto(self._slots[index], frame)
+        self._stamps[index] = stamp
+
+        with self._cond:
+            self._queue.append(index)
+            self.enqueued += 1
+            self._cond.notify_all()
+        return True
+
+    def _read_record(self, offset):
+        """
+        Read the frame at offset of the spill file into the spill slot
+        """
+        buffers = [memoryview(self._read_stamp).cast("B"), memoryview(self._spill_slot).cast("B")]
+        while buffers:
+            read = os.preadv(self._fd, buffers, offset)
+            if read == 0:
+                raise Exception(f"{self._path} ended before the frame at {offset}")
+            offset += read
+            while buffers and read >= len(buffers[0]):
+                read -= len(buffers.pop(0))
+            if read:
+                buffers[0] = buffers[0][read:]
+        self._spill_stamp = None if np.isnan(self._read_stamp[0]) else tuple(float(value) for value in self._read_stamp)
+
+    def _start_over(self):
+        """
+        Empty the spill file, if the consumer has read every frame and the producer is not spilling more
+        """
+        with self._write_lock:
+            with self._cond:
+                if self._on_disk:
+                    return
+                self._appended = self._on_file = self._read = 0
+                self.catchup_time = time.time() - self._spill_started
+            os.ftruncate(self._fd, 0)
+            os.lseek(self._fd, 0, os.SEEK_SET)
+        logger.info(f"The consumer caught up with the spill file after {self.catchup_time} seconds")
+
+    def get(self, timeout=None):
+        """
+        Return the index of the oldest frame, which is capacity if it was read back from disk.
+        Returns None if the ring is closed and empty, or on timeout
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._queue or self._read < self._appended or (self._closed and not self._on_disk),
+                timeout=timeout
+            )
+            if self._queue:
+                return self._queue.popleft()
+            if self._read >= self._appended:
+                if self._closed and not self._on_disk:
+                    self._remove_spill_file()
+                return None
+            offset = self._read * self._record_size
+            in_buffer = self._read >= self._on_file
+
+        if in_buffer:
+            # the frame is still in the buffer of the producer
+            with self._write_lock:
+                self._flush()
+        self._read_record(offset)
+
+        with self._cond:
+            self._read += 1
+            self._on_disk -= 1
+            caught_up = self._on_disk == 0
+        if caught_up:
+            self._start_over()
+        return self._capacity
+
+    def slot(self, index):
+        if index == self._capacity:
+            return self._spill_slot
+        return self._slots[index]
+
+    def stamp(self, index):
+        if index == self._capacity:
+            return self._spill_stamp
+        return self._stamps[index]
+
+    def release(self, index):
+        if index == self._capacity:
+            return
+        super().release(index)
+
+    def _remove_spill_file(self):
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def stats(self):
+        """
+        Frames in memory and on disk, bytes spilled so far and the last catch up time
+        """
+        with self._cond:
+            return {
+                "ram_depth": len(self._queue), "disk_depth": self._on_disk,
+                "spilled_frames": self.spilled_frames, "spilled_bytes": self.spilled_bytes,
+                "catchup_time": self.catchup_time,
+            }
@@ -0,0 +1,166 @@
+"""
+Keyframe index of a video: the presentation time, byte offset and keyframe flag of every frame,
+saved in a binary sidecar next to the video (video.mp4 -> video.mp4.index.npy)
+
+With it, frame n is read by making ffmpeg jump to the keyframe before it
+and drop the frames in between by their timestamp, and reading forward within a GOP does not need a seek at all
+"""
+
+import os
+import os.path
+import hashlib
+import logging
+import subprocess
+
+import numpy as np
+
+from cv2cuda.ffmpeg_process import FFMPEG_BINARY, FFPROBE_BINARY
+from cv2cuda.probe import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype([("frame", "<u4"), ("pts", "<f8"), ("pos", "<i8"), ("key", "u1")])
+INDEX_SUFFIX = ".index.npy"
+INDEX_CACHE_DIR = os.path.join(CACHE_DIR, "index")
+
+# (path, mtime) -> index, so a video is indexed once per process
+_loaded = {}
+
+
+def _to_index(packets):
+    """
+    Turn a list of (pts, pos, key) packets in decoding order into an index in presentation order.
+    pts are in seconds, as stored in the file
+    """
+    packets = [packet for packet in packets if packet[0] is not None]
+    index = np.zeros(len(packets), dtype=INDEX_DTYPE)
+    if not packets:
+        return index
+
+    packets.sort(key=lambda packet: packet[0])
+    index["frame"] = np.arange(len(packets))
+    index["pts"] = [pts for pts, _, _ in packets]
+    index["pos"] = [pos for _, pos, _ in packets]
+    index["key"] = [key for _, _, key in packets]
+    return index
+
+
+def _ffprobe_packets(filename, binary=FFPROBE_BINARY):
+    process = subprocess.run(
+        [binary, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,pos,flags", "-of", "csv=p=0", filename],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if process.returncode != 0:
+        raise Exception(f"Could not index {filename}: {process.stderr.decode().strip()}")
+
+    packets = []
+    for line in process.stdout.decode().splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 3:
+            continue
+        pts, pos, flags = fields[:3]
+        packets.append((
+            None if pts == "N/A" else float(pts),
+            -1 if pos == "N/A" else int(pos),
+            "K" in flags
+        ))
+    return packets
+
+
+def _framecrc_packets(filename, binary=FFMPEG_BINARY):
+    # the same packets, listed by ffmpeg itself for hosts without ffprobe. Byte offsets are not available
+    process = subprocess.run(
+        [binary, "-nostdin", "-loglevel", "error", "-i", filename, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if process.returncode != 0:
+        raise Exception(f"Could not index {filename}: {process.stderr.decode().strip()}")
+
+    time_base = 1
+    packets = []
+    for line in process.stdout.decode().splitlines():
+        if line.startswith("#tb 0:"):
+            numerator, denominator = line.split(":")[1].strip().split("/")
+            time_base = int(numerator) / int(denominator)
+        elif not line.startswith("#"):
+            fields = [field.strip() for field in line.split(",")]
+            # stream, dts, pts, duration, size, crc[, F=flags], flags are only listed if they are not just keyframe
+            flags = [int(field[2:], 16) for field in fields[6:] if field.startswith("F=")]
+            key = bool(flags[0] & 1) if flags else True
+            packets.append((int(fields[2]) * time_base, -1, key))
+    return packets
+
+
+def build_index(filename):
+    """
+    Return the index of the first video stream of filename, listing its packets (no decoding)
+    with ffprobe, or with ffmpeg if ffprobe is not installed
+    """
+    try:
+        packets = _ffprobe_packets(filename)
+    except OSError:
+        packets = _framecrc_packets(filename)
+    return _to_index(packets)
+
+
+def index_filename(filename):
+    return filename + INDEX_SUFFIX
+
+
+def save_index(filename, index=None):
+    """
+    Build (if not passed) the index of filename and save it next to it,
+    or in the cache folder if the folder of the video is not writable.
+    Returns the index
+    """
+    if index is None:
+        index = build_index(filename)
+
+    for path in (index_filename(filename), _cached_filename(filename)):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "wb") as filehandle:
+                np.save(filehandle, index)
+            break
+        except OSError as error:
+            logger.warning(f"Could not save the index of {filename} to {path}: {error}")
+
+    _loaded[(os.path.realpath(filename), os.path.getmtime(filename))] = index
+    return index
+
+
+def _cached_filename(filename):
+    key = hashlib.sha1(os.path.realpath(filename).encode()).hexdigest()
+    return os.path.join(INDEX_CACHE_DIR, key + INDEX_SUFFIX)
+
+
+def load_index(filename, build=True):
+    """
+    Return the index of filename from its sidecar, if it is newer than the video.
+    Otherwise it is built and saved (if build is True) or None is returned
+    """
+    mtime = os.path.getmtime(filename)
+    key = (os.path.realpath(filename), mtime)
+    if key in _loaded:
+        return _loaded[key]
+
+    for path in (index_filename(filename), _cached_filename(filename)):
+        if os.path.exists(path) and os.path.getmtime(path) >= mtime:
+            index = np.load(path)
+            _loaded[key] = index
+            return index
+
+    if not build:
+        return None
+    return save_index(filename)
+
+
+def nearest_keyframe(index, frame):
+    """
+    Return the number of the last keyframe at or before frame
+    """
+    keyframes = index["frame"][index["key"].astype(bool)]
+    position = np.searchsorted(keyframes, frame, side="right")
+    if position == 0:
+        return 0
+    return int(keyframes[position - 1])
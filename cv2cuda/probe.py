@@ -0,0 +1,256 @@
+"""
+Find out what the ffmpeg binary can do (encoders, pixel formats, hardware acceleration)
+and which encoders actually work on this host, so video writers are not started
+with an encoder that is doomed to fail
+
+Results are cached on disk, keyed by the path and modification time of the binary
+"""
+
+import os
+import os.path
+import json
+import logging
+import subprocess
+import threading
+
+import cv2
+
+from cv2cuda.ffmpeg_process import FFMPEG_BINARY, FFPROBE_BINARY
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "cv2cuda")
+PROBE_CACHE = os.path.join(CACHE_DIR, "probe.json")
+PROBE_TIMEOUT = 30 # seconds
+
+# encoders tried by select_encoder, fastest first
+ENCODER_PREFERENCES = [
+    {"codec": "h264_nvenc", "device": "gpu", "preset": "llhp"},
+    {"codec": "libx264", "device": "cpu", "preset": "ultrafast"},
+    {"codec": "mpeg4", "device": "cpu", "preset": None},
+]
+
+_lock = threading.Lock()
+
+
+def _run(command):
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as error:
+        logger.warning(f"{' '.join(command)} failed: {error}")
+        return None
+    return process
+
+
+def _parse_table(output, separator):
+    """
+    Return the first two columns (flags and name) of the rows listed by
+    ffmpeg -encoders or ffmpeg -pix_fmts, after the separator line
+    """
+    rows = []
+    started = False
+    for line in output.splitlines():
+        if line.strip().startswith(separator):
+            started = True
+            continue
+        fields = line.split()
+        if started and len(fields) >= 2:
+            rows.append((fields[0], fields[1]))
+    return rows
+
+
+def list_encoders(binary=FFMPEG_BINARY):
+    process = _run([binary, "-hide_banner", "-encoders"])
+    if process is None or process.returncode != 0:
+        return []
+    return [name for flags, name in _parse_table(process.stdout.decode(), "------") if flags.startswith("V")]
+
+
+def list_pix_fmts(binary=FFMPEG_BINARY):
+    process = _run([binary, "-hide_banner", "-pix_fmts"])
+    if process is None or process.returncode != 0:
+        return []
+    return [name for flags, name in _parse_table(process.stdout.decode(), "-----")]
+
+
+def list_hwaccels(binary=FFMPEG_BINARY):
+    process = _run([binary, "-hide_banner", "-hwaccels"])
+    if process is None or process.returncode != 0:
+        return []
+    lines = process.stdout.decode().splitlines()
+    return [line.strip() for line in lines[1:] if line.strip()]
+
+
+def test_encode(codec, preset=None, binary=FFMPEG_BINARY):
+    """
+    Encode a few gray frames with the codec and discard the result.
+    Returns True if ffmpeg succeeded
+    """
+    command = [
+        binary, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=black:s=256x256:r=10",
+        "-frames:v", "5", "-pix_fmt", "yuv420p", "-c:v", codec,
+    ]
+    if preset is not None:
+        command += ["-preset", preset]
+    command += ["-f", "null", "-"]
+
+    process = _run(command)
+    if process is None:
+        return False
+    if process.returncode != 0:
+        logger.info(f"Test encode with {codec} failed: {process.stderr.decode().strip()}")
+    return process.returncode == 0
+
+
+def _load_cache(cache):
+    try:
+        with open(cache, "r") as filehandle:
+            return json.load(filehandle)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache, data):
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache + ".tmp", "w") as filehandle:
+            json.dump(data, filehandle, indent=2)
+        os.replace(cache + ".tmp", cache)
+    except OSError as error:
+        logger.warning(f"Could not save the probe cache to {cache}: {error}")
+
+
+def probe(binary=FFMPEG_BINARY, cache=PROBE_CACHE, refresh=False):
+    """
+    Return a dictionary with the encoders, pix_fmts and hwaccels of the binary,
+    and the result of the test encodes made so far (tested)
+
+    If the binary cannot be found, the lists are empty
+    """
+    with _lock:
+        path = os.path.realpath(binary)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            logger.warning(f"{binary} not found")
+            return {"binary": binary, "mtime": None, "encoders": [], "pix_fmts": [], "hwaccels": [], "tested": {}}
+
+        data = _load_cache(cache)
+        entry = data.get(path)
+        if refresh or entry is None or entry["mtime"] != mtime:
+            logger.info(f"Probing {binary}")
+            entry = {
+                "binary": binary, "mtime": mtime,
+                "encoders": list_encoders(binary), "pix_fmts": list_pix_fmts(binary),
+                "hwaccels": list_hwaccels(binary), "tested": {},
+            }
+            data[path] = entry
+            _save_cache(cache, data)
+
+        return entry
+
+
+def encoder_works(codec, preset=None, binary=FFMPEG_BINARY, cache=PROBE_CACHE):
+    """
+    Returns True if the binary has the codec and a short test encode with it succeeds.
+    The test encode runs once per binary, codec and preset
+    """
+    entry = probe(binary, cache=cache)
+    if codec not in entry["encoders"]:
+        return False
+
+    key = f"{codec}:{preset}"
+    if key not in entry["tested"]:
+        works = test_encode(codec, preset=preset, binary=binary)
+        with _lock:
+            data = _load_cache(cache)
+            path = os.path.realpath(binary)
+            data.setdefault(path, entry)["tested"][key] = works
+            entry["tested"][key] = works
+            _save_cache(cache, data)
+
+    return entry["tested"][key]
+
+
+def select_encoder(device=None, preferences=None, binary=FFMPEG_BINARY, cache=PROBE_CACHE):
+    """
+    Return the first working encoder of the preferences,
+    a dictionary with the codec, the device it runs on and the preset to use
+
+    If device is cpu, gpu encoders are skipped.
+    If device is gpu and no gpu encoder works, the fastest cpu encoder is returned
+    """
+    if preferences is None:
+        preferences = ENCODER_PREFERENCES
+
+    for preference in preferences:
+        if device == "cpu" and preference["device"] == "gpu":
+            continue
+        if encoder_works(preference["codec"], preset=preference.get("preset"), binary=binary, cache=cache):
+            if device == "gpu" and preference["device"] != "gpu":
+                logger.warning(f"No GPU encoder works with {binary}. Falling back to {preference['codec']}")
+            return preference
+
+    raise Exception(
+        f"None of the encoders {[preference['codec'] for preference in preferences]}"
+        f" works with {binary}"
+    )
+
+
+def _rate(rate):
+    numerator, _, denominator = rate.partition("/")
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _cv2_video_info(filename):
+    # the container metadata as read by cv2, for hosts without ffprobe
+    cap = cv2.VideoCapture(filename)
+    if not cap.isOpened():
+        raise Exception(f"Could not open {filename}")
+    info = {
+        "codec": None, "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": cap.get(cv2.CAP_PROP_FPS), "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None,
+    }
+    cap.release()
+    return info
+
+
+def video_info(filename, binary=FFPROBE_BINARY):
+    """
+    Return a dictionary with the codec, width, height, fps and number of frames (frame_count)
+    of the first video stream of filename, as reported by ffprobe.
+    If the container does not store the number of frames, it is estimated from the duration.
+    If ffprobe is not installed, the metadata is read with cv2
+    """
+    process = _run([
+        binary, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,width,height,r_frame_rate,avg_frame_rate,nb_frames,duration",
+        "-of", "json", filename
+    ])
+    if process is None:
+        return _cv2_video_info(filename)
+    if process.returncode != 0:
+        raise Exception(f"Could not probe {filename}: {process.stderr.decode().strip()}")
+
+    streams = json.loads(process.stdout.decode()).get("streams", [])
+    if not streams:
+        raise Exception(f"{filename} has no video stream")
+    stream = streams[0]
+
+    fps = _rate(stream.get("avg_frame_rate", "")) or _rate(stream.get("r_frame_rate", ""))
+    try:
+        frame_count = int(stream["nb_frames"])
+    except (KeyError, ValueError):
+        try:
+            frame_count = int(round(float(stream["duration"]) * fps))
+        except (KeyError, ValueError, TypeError):
+            frame_count = None
+
+    return {
+        "codec": stream.get("codec_name"), "width": stream["width"], "height": stream["height"],
+        "fps": fps, "frame_count": frame_count,
+    }
@@ -0,0 +1,121 @@
+"""
+Live statistics of an ffmpeg encoder, parsed from the key=value blocks
+that ffmpeg writes with -progress pipe:N (about twice per second)
+"""
+
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _number(value, suffix="", cast=float):
+    value = value.strip()
+    if value.endswith(suffix):
+        value = value[:len(value)-len(suffix)]
+    try:
+        return cast(value)
+    except ValueError:
+        # N/A before the first frame is encoded
+        return None
+
+
+class EncoderStats:
+    """
+    One progress report of ffmpeg
+
+    Attributes:
+        * frame (int): Frames encoded so far
+        * fps (float): Encoding framerate
+        * speed (float): Encoding speed relative to realtime
+        * bitrate (float): Output bitrate in kbits/s
+        * dup, drop (int): Frames duplicated / dropped by ffmpeg to keep the output framerate
+        * total_size (int): Bytes written to the output
+        * out_time (float): Seconds of video encoded
+        * ended (bool): True in the last report, written when ffmpeg exits
+        * updated_at (float): time.time() when the report was read
+        * advanced_at (float): time.time() when the report in which frame last increased was read.
+        ffmpeg keeps reporting while it is stuck, so this (not updated_at) tells whether it makes progress
+    """
+
+    def __init__(self, frame=0, fps=None, speed=None, bitrate=None, dup=0, drop=0, total_size=0, out_time=None, ended=False, updated_at=None, advanced_at=None):
+        self.frame = frame
+        self.fps = fps
+        self.speed = speed
+        self.bitrate = bitrate
+        self.dup = dup
+        self.drop = drop
+        self.total_size = total_size
+        self.out_time = out_time
+        self.ended = ended
+        self.updated_at = updated_at
+        self.advanced_at = advanced_at
+
+    @classmethod
+    def from_block(cls, block, updated_at=None):
+        """
+        Build the stats from a dictionary with the key=value pairs of a progress block
+        """
+        out_time_us = _number(block.get("out_time_us", ""), cast=int)
+        return cls(
+            frame=_number(block.get("frame", "0"), cast=int) or 0,
+            fps=_number(block.get("fps", "")),
+            speed=_number(block.get("speed", ""), "x"),
+            bitrate=_number(block.get("bitrate", ""), "kbits/s"),
+            dup=_number(block.get("dup_frames", "0"), cast=int) or 0,
+            drop=_number(block.get("drop_frames", "0"), cast=int) or 0,
+            total_size=_number(block.get("total_size", "0"), cast=int) or 0,
+            out_time=None if out_time_us is None else out_time_us / 1e6,
+            ended=block.get("progress") == "end",
+            updated_at=updated_at,
+        )
+
+    def __repr__(self):
+        return f"EncoderStats(frame={self.frame}, fps={self.fps}, speed={self.speed}, bitrate={self.bitrate}, "\
+            f"dup={self.dup}, drop={self.drop}, total_size={self.total_size}, ended={self.ended})"
+
+
+def parse_progress(lines):
+    """
+    Yield an EncoderStats for every complete block (terminated by progress=continue|end) in lines
+    """
+    block = {}
+    frame = 0
+    advanced_at = None
+    for line in lines:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            stats = EncoderStats.from_block(block, updated_at=time.time())
+            if stats.frame > frame:
+                frame = stats.frame
+                advanced_at = stats.updated_at
+            stats.advanced_at = advanced_at
+            yield stats
+            block = {}
+
+
+class ProgressReader(threading.Thread):
+    """
+    Read the -progress pipe of ffmpeg in the background and keep the last EncoderStats
+
+    Arguments:
+        * fd (int): Read end of the pipe. It is closed when ffmpeg closes the write end
+    """
+
+    def __init__(self, fd):
+        super().__init__(name="cv2cuda-progress", daemon=True)
+        self._fd = fd
+        self.stats = EncoderStats()
+
+    def run(self):
+        with os.fdopen(self._fd, "r") as filehandle:
+            try:
+                for stats in parse_progress(filehandle):
+                    self.stats = stats
+            except (OSError, ValueError) as error:
+                logger.debug(f"Progress pipe closed: {error}")
@@ -0,0 +1,251 @@
+"""
+Rate control of the encoders: how many bits they spend, how fast they go (preset) and how often they place a keyframe.
+A RateControl is turned into the flags of each encoder family (nvenc, x264/x265, and the rest of ffmpeg encoders)
+
+The preset can be tuned for this host: a short encode of synthetic frames is run with every preset of the encoder,
+from the best quality to the fastest, and the first one that keeps up with the framerate is used.
+The choice is cached next to the probe cache
+"""
+
+import os
+import os.path
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+RATE_CONTROL_MODES = ["cbr", "vbr", "cq"]
+# preset tuned by autotune
+AUTO = "auto"
+# presets of each encoder, best quality first
+PRESET_LADDERS = {
+    "nvenc": ["slow", "medium", "fast", "llhq", "llhp"],
+    "x26x": ["slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"],
+}
+CALIBRATION_DURATION = 2 # seconds of video encoded to calibrate each preset
+# the encoder must be this much faster than real time
+HEADROOM = 1.2
+
+
+def encoder_family(codec):
+    if codec.endswith("_nvenc"):
+        return "nvenc"
+    elif codec in ("libx264", "libx265"):
+        return "x26x"
+    else:
+        return "generic"
+
+
+def _kbits(bitrate):
+    return f"{int(round(bitrate / 1000))}k"
+
+
+class RateControl:
+    """
+    Rate control options of an encoder
+
+    Arguments:
+        * mode (str): cbr (constant bitrate), vbr (variable bitrate, within min_bitrate and max_bitrate)
+        or cq (constant quality). By default vbr if any bitrate is passed, otherwise the encoder defaults
+        * bitrate (int): Target bitrate in bits/s. By default max_bitrate (or min_bitrate)
+        * min_bitrate, max_bitrate (int): Bounds of the bitrate in bits/s
+        * quality (int): Quality of cq, lower is better (-cq for nvenc, -crf for x264/x265 and -q:v for the rest)
+        * preset (str): Encoder preset, or auto to pick the best one that keeps up (see autotune)
+        * gop (int): Frames between keyframes
+        * buffer_size (int): Size of the rate control buffer in bits. By default one second of max_bitrate
+    """
+
+    def __init__(self, mode=None, bitrate=None, min_bitrate=None, max_bitrate=None, quality=None, preset=None, gop=None, buffer_size=None):
+        if mode is None and (bitrate or min_bitrate or max_bitrate):
+            mode = "vbr"
+        if mode is not None and mode not in RATE_CONTROL_MODES:
+            raise Exception(f"mode must be one of {RATE_CONTROL_MODES}, not {mode}")
+        if bitrate is None:
+            bitrate = max_bitrate or min_bitrate
+        if mode in ("cbr", "vbr") and bitrate is None:
+            raise Exception(f"{mode} rate control needs a bitrate")
+        if mode == "cq" and quality is None:
+            raise Exception("cq rate control needs a quality")
+
+        self.mode = mode
+        self.bitrate = bitrate
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.quality = quality
+        self.preset = preset
+        self.gop = gop
+        self.buffer_size = buffer_size
+
+    def _fields(self):
+        return (self.mode, self.bitrate, self.min_bitrate, self.max_bitrate, self.quality, self.preset, self.gop, self.buffer_size)
+
+    def __eq__(self, other):
+        return isinstance(other, RateControl) and self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return f"RateControl(mode={self.mode}, bitrate={self.bitrate}, min_bitrate={self.min_bitrate}, "\
+            f"max_bitrate={self.max_bitrate}, quality={self.quality}, preset={self.preset}, gop={self.gop})"
+
+    def with_preset(self, preset):
+        return RateControl(
+            mode=self.mode, bitrate=self.bitrate, min_bitrate=self.min_bitrate, max_bitrate=self.max_bitrate,
+            quality=self.quality, preset=preset, gop=self.gop, buffer_size=self.buffer_size
+        )
+
+    def resolve(self, codec, width, height, fps, binary=None):
+        """
+        Return this RateControl with the preset tuned, if it is auto
+        """
+        if self.preset != AUTO:
+            return self
+        return self.with_preset(autotune(codec, width, height, fps, rate_control=self.with_preset(None), binary=binary))
+
+    def flags(self, codec):
+        """
+        ffmpeg flags of these options for the codec
+        """
+        if self.preset == AUTO:
+            raise Exception("The preset must be tuned with resolve() before building the flags")
+
+        family = encoder_family(codec)
+        flags = []
+
+        if self.preset is not None:
+            if family == "generic":
+                logger.warning(f"{codec} has no presets, ignoring preset {self.preset}")
+            else:
+                flags += ["-preset", self.preset]
+
+        buffer_size = self.buffer_size or self.max_bitrate or self.bitrate
+        if self.mode == "cbr":
+            if family == "nvenc":
+                flags += ["-rc", "cbr", "-b:v", _kbits(self.bitrate)]
+            else:
+                flags += ["-b:v", _kbits(self.bitrate), "-minrate", _kbits(self.bitrate), "-maxrate", _kbits(self.bitrate)]
+                if codec == "libx264":
+                    flags += ["-x264-params", "nal-hrd=cbr"]
+            flags += ["-bufsize", _kbits(self.buffer_size or self.bitrate)]
+
+        elif self.mode == "vbr":
+            if family == "nvenc":
+                flags += ["-rc", "vbr"]
+            flags += ["-b:v", _kbits(self.bitrate)]
+            # x264 and x265 have no lower bound
+            if self.min_bitrate is not None and family != "x26x":
+                flags += ["-minrate", _kbits(self.min_bitrate)]
+            if self.max_bitrate is not None:
+                flags += ["-maxrate", _kbits(self.max_bitrate), "-bufsize", _kbits(buffer_size)]
+
+        elif self.mode == "cq":
+            if family == "nvenc":
+                flags += ["-rc", "vbr", "-cq", str(self.quality), "-b:v", "0"]
+            elif family == "x26x":
+                flags += ["-crf", str(self.quality)]
+            else:
+                flags += ["-q:v", str(self.quality)]
+
+        if self.gop is not None:
+            flags += ["-g", str(self.gop)]
+
+        return " ".join(flags)
+
+
+def default_preset(device):
+    """
+    Preset used when none is passed: llhp on the gpu (nvenc) and the encoder default on the cpu
+    """
+    return "llhp" if device == "gpu" else None
+
+
+def build_rate_control(fps, device="gpu", rate_control=None, preset="default", min_bitrate=None, max_bitrate=None, gop_duration=None):
+    """
+    Return rate_control or, if it is None, the RateControl of the older arguments
+    (preset, bitrate bounds and gop_duration in seconds)
+    """
+    if rate_control is not None:
+        return rate_control
+    if preset == "default":
+        preset = default_preset(device)
+    return RateControl(
+        min_bitrate=min_bitrate, max_bitrate=max_bitrate, preset=preset,
+        gop=None if gop_duration is None else int(fps * gop_duration)
+    )
+
+
+def calibrate(codec, width, height, fps, rate_control=None, duration=CALIBRATION_DURATION, binary=None):
+    """
+    Encode duration seconds of synthetic frames of width x height with codec
+    and return the framerate achieved, or None if the encode failed
+    """
+    from cv2cuda import probe
+    if binary is None:
+        binary = probe.FFMPEG_BINARY
+
+    frames = max(int(duration * fps), 10)
+    command = [
+        binary, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=s={width}x{height}:r={fps}",
+        "-frames:v", str(frames), "-pix_fmt", "yuv420p", "-c:v", codec,
+    ]
+    if rate_control is not None:
+        command += rate_control.flags(codec).split()
+    command += ["-f", "null", "-"]
+
+    before = time.time()
+    process = probe._run(command)
+    elapsed = time.time() - before
+    if process is None or process.returncode != 0:
+        if process is not None:
+            logger.info(f"Calibration of {codec} failed: {process.stderr.decode().strip()}")
+        return None
+    return frames / elapsed
+
+
+def autotune(codec, width, height, fps, rate_control=None, duration=CALIBRATION_DURATION, headroom=HEADROOM, binary=None, cache=None):
+    """
+    Return the best quality preset of codec which encodes width x height frames
+    at least headroom times faster than fps on this host. If none does, the fastest preset is returned.
+    Encoders without presets get None
+
+    The result is cached (in cache, by default autotune.json in the probe cache folder)
+    for the binary, codec, frame size, framerate and rate_control
+    """
+    from cv2cuda import probe
+    if binary is None:
+        binary = probe.FFMPEG_BINARY
+    if cache is None:
+        cache = os.path.join(probe.CACHE_DIR, "autotune.json")
+
+    ladder = PRESET_LADDERS.get(encoder_family(codec))
+    if ladder is None:
+        return None
+
+    try:
+        mtime = os.path.getmtime(os.path.realpath(binary))
+    except OSError:
+        mtime = None
+    key = f"{os.path.realpath(binary)}:{mtime}:{codec}:{width}x{height}@{fps}:{rate_control}"
+    data = probe._load_cache(cache)
+    if key in data:
+        return data[key]["preset"]
+
+    tried = {}
+    chosen = ladder[-1]
+    for preset in ladder:
+        control = (rate_control or RateControl()).with_preset(preset)
+        achieved = calibrate(codec, width, height, fps, rate_control=control, duration=duration, binary=binary)
+        tried[preset] = achieved
+        logger.info(f"{codec} with preset {preset} encodes {width}x{height} at {achieved} fps")
+        if achieved is not None and achieved >= fps * headroom:
+            chosen = preset
+            break
+    else:
+        logger.warning(f"No preset of {codec} keeps up with {width}x{height} at {fps} fps. Using {chosen}")
+
+    data = probe._load_cache(cache)
+    data[key] = {"preset": chosen, "fps": tried}
+    probe._save_cache(cache, data)
+    return chosen
@@ -0,0 +1,232 @@
+"""
+Record frames without encoding them, and encode them later.
+
+RawVideoWriter appends every frame (and its timestamp) to a memory mapped file of fixed size records,
+so write costs one memcpy and keeps up with any framerate the disk can take.
+A TranscodePool encodes the finished raw files with ffmpeg in the background,
+checks the video has all the frames and deletes the raw file
+
+The raw file starts with a RAW_HEADER_SIZE bytes JSON header (width, height, channels, pix_fmt, fps, output)
+followed by records with RAW_RECORD fields (see raw_dtype)
+"""
+
+import os
+import os.path
+import json
+import time
+import logging
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+from cv2cuda.ffmpeg_process import FFMPEG, PIX_FMT_CHANNELS
+from cv2cuda.sidecar import ChunkedMemmap, load_records
+from cv2cuda.timestamps import TimestampLog
+from cv2cuda.index import build_index
+from cv2cuda.video_writer import PYTHON_CONVERSIONS
+from cv2cuda.decorator import timeit
+
+logger = logging.getLogger(__name__)
+
+RAW_MAGIC = "cv2cuda-raw"
+RAW_HEADER_SIZE = 4096
+RAW_SUFFIX = ".raw"
+# seconds of frames the raw file grows by. The file is extended sparsely (and trimmed on release)
+# so a large chunk costs no disk space, and the map is replaced less often
+RAW_CHUNK_DURATION = 60
+
+
+def raw_dtype(height, width, channels=1):
+    """
+    dtype of the records of a raw file: the timestamp and the pixels of a frame
+    """
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    return np.dtype([("timestamp", "<f8"), ("frame", "u1", shape)])
+
+
+def load_raw(filename, mmap=True):
+    """
+    Return the header (a dictionary) and the records of a raw file
+    """
+    with open(filename, "rb") as filehandle:
+        header = filehandle.read(RAW_HEADER_SIZE)
+    try:
+        header = json.loads(header.decode().rstrip())
+    except ValueError:
+        raise Exception(f"{filename} is not a cv2cuda raw file")
+    if header.get("format") != RAW_MAGIC:
+        raise Exception(f"{filename} is not a cv2cuda raw file")
+
+    dtype = raw_dtype(header["height"], header["width"], header["channels"])
+    return header, load_records(filename, dtype, mmap=mmap, offset=RAW_HEADER_SIZE)
+
+
+class RawVideoWriter:
+    """
+    A video writer that stores the frames unencoded in a memory mapped file (filename with a .raw extension).
+    The file grows by chunk frames at a time, and write copies the frame into it.
+    If a TranscodePool is passed, release hands the raw file to it, to be encoded to filename
+
+    Arguments:
+        * filename (str): Path to the video the raw file is encoded to
+        * apiPreference, fourcc: Ignored, for compatibility with cv2cuda.VideoWriter (the codec is set by the TranscodePool)
+        * fps (int): Framerate of the video
+        * frameSize (tuple): Width and height of the frames. Larger frames are cropped
+        * isColor (bool): If True, frames are stored in color (bgr24)
+        * pix_fmt (str): Pixel format of the stored frames, one of cv2cuda.ffmpeg_process.PIX_FMT_CHANNELS
+        * chunk (int): Frames the file grows by. By default RAW_CHUNK_DURATION seconds of frames
+        * transcoder (TranscodePool): Encodes the raw file when the writer is released
+    """
+
+    def __init__(self, filename, apiPreference=None, fourcc=None, fps=30, frameSize=None, isColor=False, pix_fmt=None, chunk=None, transcoder=None, **kwargs):
+        if frameSize is None:
+            raise Exception("frameSize must be passed")
+        if pix_fmt is None:
+            pix_fmt = "bgr24" if isColor else "gray"
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise Exception(f"pix_fmt must be one of {list(PIX_FMT_CHANNELS)}, not {pix_fmt}")
+
+        self._filename = filename
+        self._fps = fps
+        self._width, self._height = frameSize
+        self._pix_fmt = pix_fmt
+        self._channels = PIX_FMT_CHANNELS[pix_fmt]
+        self._transcoder = transcoder
+        self._already_warned = False
+        self._is_released = False
+        self.raw_filename = os.path.splitext(filename)[0] + RAW_SUFFIX
+
+        header = json.dumps({
+            "format": RAW_MAGIC, "version": 1, "width": self._width, "height": self._height,
+            "channels": self._channels, "pix_fmt": pix_fmt, "fps": fps, "output": filename,
+        })
+        if len(header) >= RAW_HEADER_SIZE:
+            raise Exception(f"The header of {self.raw_filename} does not fit in {RAW_HEADER_SIZE} bytes")
+        self._records = ChunkedMemmap(
+            self.raw_filename, raw_dtype(self._height, self._width, self._channels),
+            chunk=chunk or int(max(fps, 1) * RAW_CHUNK_DURATION), header=header.ljust(RAW_HEADER_SIZE).encode()
+        )
+
+    def __str__(self):
+        return self._filename
+
+    @property
+    def frames_written(self):
+        return len(self._records)
+
+    def _match_pix_fmt(self, image):
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        if channels == self._channels:
+            return image
+
+        if not self._already_warned:
+            logger.warning(
+                f"Frames with {channels} channels do not match the pixel format of the video ({self._pix_fmt})."
+                " They will be converted in Python"
+            )
+            self._already_warned = True
+        code = PYTHON_CONVERSIONS.get((channels, self._pix_fmt))
+        if code is None:
+            raise Exception(f"Cannot convert frames with {channels} channels to {self._pix_fmt}")
+        return cv2.cvtColor(image, code)
+
+    @timeit
+    def write(self, image, timestamp=None):
+        """
+        Copy the frame (and its capture time, by default now) into the raw file
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        image = self._match_pix_fmt(image[:self._height, :self._width])
+        self._records.append((timestamp, image))
+
+    def release(self):
+        """
+        Close the raw file. Returns its path or, if a TranscodePool was passed,
+        the concurrent.futures.Future of its encoding
+        """
+        if not self._is_released:
+            self._is_released = True
+            self._records.close()
+            if self._transcoder is not None:
+                self._future = self._transcoder.submit(self.raw_filename)
+
+        if self._transcoder is not None:
+            return self._future
+        return self.raw_filename
+
+
+def transcode(raw_filename, output=None, fourcc="libx264", device="cpu", delete=True, batch=32, **kwargs):
+    """
+    Encode a raw file with ffmpeg, save the timestamps of its frames next to the video (see cv2cuda.timestamps)
+    and, if delete is True, delete the raw file once the video is checked to have all the frames.
+    Returns the path to the video
+
+    Arguments:
+        * raw_filename (str): Path to the raw file
+        * output (str): Path to the video. By default, the one the raw file was recorded for
+        * fourcc, device: Encoder and the device it runs on
+        * batch (int): Frames piped to ffmpeg with every write
+        * kwargs: Passed to FFMPEG, like preset or rate_control
+    """
+    header, records = load_raw(raw_filename)
+    if output is None:
+        output = header["output"]
+    if len(records) == 0:
+        raise Exception(f"{raw_filename} has no frames")
+
+    ffmpeg = FFMPEG(
+        header["width"], header["height"], header["fps"], output, device=device, codec=fourcc,
+        pix_fmt=header["pix_fmt"], output_pix_fmt="gray" if header["channels"] == 1 else None,
+        progress=False, **kwargs
+    )
+    frames = records["frame"]
+    for start in range(0, len(records), batch):
+        ffmpeg.write_many(frames[start:start+batch])
+    returncode = ffmpeg.close()
+    if returncode != 0:
+        raise Exception(f"ffmpeg exited with code {returncode} encoding {raw_filename}")
+
+    encoded = len(build_index(output))
+    if encoded != len(records):
+        raise Exception(f"{output} has {encoded} frames, but {raw_filename} has {len(records)}. Keeping the raw file")
+
+    timestamps = TimestampLog(output, chunk=len(records))
+    for frame, timestamp in enumerate(records["timestamp"]):
+        timestamps.record(frame, timestamp, np.nan)
+    timestamps.close()
+
+    del frames, records
+    if delete:
+        os.remove(raw_filename)
+    return output
+
+
+class TranscodePool:
+    """
+    Worker threads that transcode raw files (each one runs its own ffmpeg process)
+
+    Arguments:
+        * workers (int): Raw files encoded at the same time
+        * kwargs: Passed to transcode, like fourcc, device, delete or preset
+    """
+
+    def __init__(self, workers=1, **kwargs):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cv2cuda-transcode")
+        self._kwargs = kwargs
+
+    def submit(self, raw_filename, output=None):
+        """
+        Queue a raw file. Returns a concurrent.futures.Future with the path to the video
+        """
+        return self._executor.submit(transcode, raw_filename, output=output, **self._kwargs)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,157 @@
+"""
+Record regions of interest (ROIs) of the frames in their own videos, without encoding the rest of the frame
+"""
+
+import os.path
+import logging
+
+import cv2
+
+from cv2cuda.ffmpeg_process import FFMPEG, Output, PIX_FMT_CHANNELS
+from cv2cuda.rate_control import build_rate_control
+from cv2cuda.video_writer import FFMPEGVideoWriter, PYTHON_CONVERSIONS
+from cv2cuda.decorator import timeit
+
+logger = logging.getLogger(__name__)
+
+ROI_MODES = ["filter", "views"]
+
+
+def roi_filenames(filename, rois, names=None):
+    """
+    Filenames of the videos of the rois: video.mp4 -> video_roi00.mp4, video_roi01.mp4 ...
+    or video_<name>.mp4 if names are passed
+    """
+    root, extension = os.path.splitext(filename)
+    if names is None:
+        names = [f"roi{str(i).zfill(2)}" for i in range(len(rois))]
+    elif len(names) != len(rois):
+        raise Exception(f"{len(names)} names passed for {len(rois)} rois")
+    return [f"{root}_{name}{extension}" for name in names]
+
+
+class ROIVideoWriter:
+    """
+    A video writer that encodes a list of rectangles of the frames, each in its own video.
+    Python passes every frame once:
+
+        filter: a single ffmpeg process gets the whole frame and crops every roi with a filter
+        in its own branch of the filter graph, so Python makes one write per frame
+        views: every roi has its own FFMPEGVideoWriter, which is passed a numpy view of the frame (no copy).
+        The encoders run in parallel processes, and every option of FFMPEGVideoWriter (segments, async_write ...) is available
+
+    Encoders need even widths and heights, so the rois are shrunk by one pixel if needed
+
+    Arguments:
+        * filename (str): Path the names of the videos are made from, see roi_filenames
+        * apiPreference, fourcc, fps, frameSize, isColor, device: Like cv2cuda.VideoWriter
+        * rois (list): (x, y, width, height) of each region
+        * mode (str): filter or views
+        * names (list): Names of the rois, used in the filenames
+        * kwargs: Passed to FFMPEG (filter) or to every FFMPEGVideoWriter (views)
+    """
+
+    def __init__(self, filename, apiPreference, fourcc, fps, frameSize, rois, mode="filter", isColor=False, device="gpu", names=None, pix_fmt=None, **kwargs):
+        if mode not in ROI_MODES:
+            raise Exception(f"mode must be one of {ROI_MODES}, not {mode}")
+        if not rois:
+            raise Exception("At least one roi must be passed")
+
+        self._filename = filename
+        self._fourcc = fourcc
+        self._fps = fps
+        self._frameSize = frameSize
+        self._width, self._height = frameSize
+        self._mode = mode
+        self._pix_fmt = pix_fmt or ("bgr24" if isColor else "gray")
+        self._is_released = False
+
+        self.rois = []
+        for x, y, width, height in rois:
+            if x < 0 or y < 0 or x + width > self._width or y + height > self._height:
+                raise Exception(f"roi {(x, y, width, height)} does not fit in frames of {frameSize}")
+            self.rois.append((x, y, width - width % 2, height - height % 2))
+        self.filenames = roi_filenames(filename, self.rois, names)
+        # frames piped to the single ffmpeg of filter mode
+        self._frames_written = 0
+
+        if mode == "filter":
+            self._writers = None
+            self._ffmpeg = self._open_ffmpeg(isColor, device, **kwargs)
+        else:
+            self._ffmpeg = None
+            self._writers = [
+                FFMPEGVideoWriter(
+                    roi_filename, apiPreference, fourcc, fps, (width, height),
+                    isColor=isColor, device=device, pix_fmt=pix_fmt, **kwargs
+                )
+                for roi_filename, (_, _, width, height) in zip(self.filenames, self.rois)
+            ]
+
+    def _open_ffmpeg(self, isColor, device, rate_control=None, preset="default", min_bitrate=None, max_bitrate=None, gop_duration=None, **kwargs):
+        rate_control = build_rate_control(
+            self._fps, device=device, rate_control=rate_control, preset=preset,
+            min_bitrate=min_bitrate, max_bitrate=max_bitrate, gop_duration=gop_duration
+        )
+
+        outputs = []
+        for roi_filename, (x, y, width, height) in zip(self.filenames, self.rois):
+            flags = rate_control.resolve(self._fourcc, width, height, self._fps).flags(self._fourcc)
+            outputs.append(Output(roi_filename, codec=self._fourcc, filters=[f"crop={width}:{height}:{x}:{y}"], flags=flags))
+
+        return FFMPEG(
+            self._width, self._height, self._fps, None, device=device, codec=self._fourcc,
+            pix_fmt=self._pix_fmt, output_pix_fmt=None if isColor else "gray", outputs=outputs, **kwargs
+        )
+
+    def __str__(self):
+        return self._filename
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def frames_written(self):
+        """
+        Frames piped to ffmpeg for every roi (not counting the frames lost if ffmpeg is gone)
+        """
+        if self._mode == "views":
+            return [writer.frames_written for writer in self._writers]
+        return [self._frames_written] * len(self.rois)
+
+    @timeit
+    def write(self, image, timestamp=None):
+        """
+        Pass a whole frame, every roi is written to its video.
+        timestamp is saved in the timestamps sidecar of every roi in views mode (with timestamps=True).
+        filter mode keeps no timestamps and ignores it
+        """
+        if self._mode == "filter":
+            image = image[:self._height, :self._width]
+            channels = 1 if image.ndim == 2 else image.shape[2]
+            if channels != PIX_FMT_CHANNELS[self._pix_fmt]:
+                code = PYTHON_CONVERSIONS.get((channels, self._pix_fmt))
+                if code is None:
+                    raise Exception(f"Cannot convert frames with {channels} channels to {self._pix_fmt}")
+                image = cv2.cvtColor(image, code)
+            if self._ffmpeg.write(image):
+                self._frames_written += 1
+        else:
+            for writer, (x, y, width, height) in zip(self._writers, self.rois):
+                writer.write.unwrapped(writer, image[y:y+height, x:x+width], timestamp)
+
+    def release(self):
+        """
+        Finish the videos of all rois. Returns their filenames
+        """
+        if self._is_released:
+            return self.filenames
+        self._is_released = True
+
+        if self._mode == "filter":
+            self._ffmpeg.close()
+        else:
+            for writer in self._writers:
+                writer.release()
+        return self.filenames
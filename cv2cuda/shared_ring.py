@@ -0,0 +1,133 @@
+import multiprocessing
+import queue
+import logging
+import time
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np # type: ignore
+except ModuleNotFoundError:
+    raise Exception("The shared ring requires numpy installed (pip install numpy)")
+
+logger = logging.getLogger(__name__)
+
+
+class SharedFrameRing:
+    """
+    A ring of fixed-size frame slots in shared memory,
+    so frames can move between processes without being pickled
+
+    The producer copies a frame into a free slot and only sends the slot index
+    and a timestamp to the consumer, which reads the frame in place
+    and gives the slot back with release()
+
+    The ring can be passed to a multiprocessing.Process,
+    the child attaches to the same shared memory block
+
+    Arguments:
+        * slots (int): Number of frame slots
+        * shape (tuple): Shape of every frame, i.e. (height, width) or (height, width, channels)
+        * dtype: numpy dtype of the frames
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+
+        self._slots = slots
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self._shape)) * self._dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner = True
+        self._free = multiprocessing.Queue(slots)
+        self._ready = multiprocessing.Queue(slots + 1)
+        for index in range(slots):
+            self._free.put(index)
+
+        self.dropped = 0
+        self._attach_buffer()
+
+    def _attach_buffer(self):
+        self._buffer = np.ndarray((self._slots, *self._shape), dtype=self._dtype, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        return {
+            "slots": self._slots, "shape": self._shape, "dtype": self._dtype.str,
+            "name": self._shm.name, "free": self._free, "ready": self._ready,
+        }
+
+    def __setstate__(self, state):
+        self._slots = state["slots"]
+        self._shape = state["shape"]
+        self._dtype = np.dtype(state["dtype"])
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner = False
+        self._free = state["free"]
+        self._ready = state["ready"]
+        self.dropped = 0
+        self._attach_buffer()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def put(self, frame, timestamp=None, timeout=None):
+        """
+        Copy a frame into a free slot and hand it over to the consumer
+
+        If no slot frees up within timeout seconds the frame is dropped
+
+        Returns the index of the slot, or None if the frame was dropped
+        """
+        if frame.shape != self._shape:
+            raise Exception(f"Frame of shape {frame.shape} does not fit in slots of shape {self._shape}")
+
+        try:
+            index = self._free.get(timeout=timeout)
+        except queue.Empty:
+            self.dropped += 1
+            return None
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        np.copyto(self._buffer[index], frame)
+        self._ready.put((index, timestamp))
+        return index
+
+    def get(self, timeout=None):
+        """
+        Return the (index, timestamp) of the next frame,
+        or None once the producer has closed the ring
+
+        Raises queue.Empty on timeout
+        """
+        return self._ready.get(timeout=timeout)
+
+    def slot(self, index):
+        return self._buffer[index]
+
+    def release(self, index):
+        self._free.put(index)
+
+    def close(self):
+        """
+        Tell the consumer no more frames will come
+        """
+        self._ready.put(None)
+
+    def unlink(self):
+        """
+        Free the shared memory block. Only the process that created the ring should call this
+        """
+        self._buffer = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,103 @@
+"""
+Append-only binary files of fixed size records, written through a memory map.
+The file is allocated chunk records at a time, so appending a record is an assignment to the map:
+there is no I/O call per record (only close() flushes), and the records reach the disk with the page cache
+"""
+
+import os
+import os.path
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedMemmap:
+    """
+    A memory mapped file of records of dtype, which grows by chunk records when it is full.
+    close() trims the file to the records appended, a file that was not closed
+    (the program crashed) ends with empty records, which load_records leaves out
+
+    Arguments:
+        * path (str): Path to the file. It is overwritten
+        * dtype (np.dtype): dtype of the records
+        * chunk (int): Number of records the file grows by
+        * header (bytes): Written at the start of the file, before the records
+    """
+
+    def __init__(self, path, dtype, chunk=4096, header=b""):
+        self._path = path
+        self._dtype = np.dtype(dtype)
+        self._chunk = chunk
+        self._offset = len(header)
+        self._count = 0
+        self._capacity = 0
+        self._map = None
+
+        with open(path, "wb") as filehandle:
+            filehandle.write(header)
+        self._grow()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def path(self):
+        return self._path
+
+    def _grow(self):
+        # no flush of the old map: it is shared with the file, so its pages are in the page cache already
+        # and reach the disk with the rest, without a synchronous msync on the writing thread
+        self._capacity += self._chunk
+        os.truncate(self._path, self._offset + self._capacity * self._dtype.itemsize)
+        self._map = np.memmap(self._path, dtype=self._dtype, mode="r+", offset=self._offset, shape=(self._capacity, ))
+
+    def append(self, record):
+        """
+        Append a record (a tuple with a value per field) and return its position
+        """
+        if self._count == self._capacity:
+            self._grow()
+        self._map[self._count] = record
+        self._count += 1
+        return self._count - 1
+
+    def records(self):
+        """
+        View of the records appended so far
+        """
+        return self._map[:self._count]
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map = None
+        os.truncate(self._path, self._offset + self._count * self._dtype.itemsize)
+
+
+def load_records(path, dtype, mmap=True, offset=0):
+    """
+    Return the records of a file written by ChunkedMemmap as a numpy structured array
+    (memory mapped, if mmap is True), without the empty records left at the end of a file that was not closed.
+    offset is the size of the header of the file
+    """
+    dtype = np.dtype(dtype)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count < 1:
+        return np.zeros(0, dtype=dtype)
+
+    if mmap:
+        records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count, ))
+    else:
+        records = np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+    # only the records of the last chunk can be empty, the file is not scanned further back
+    while count > 0 and not records[count - 1:count].view(np.uint8).any():
+        count -= 1
+    return records[:count]
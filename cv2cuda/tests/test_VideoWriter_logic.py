@@ -0,0 +1,212 @@
+"""
+Tests of the bookkeeping of FFMPEGVideoWriter
+that do not need ffmpeg: frames go to an in-memory sink instead
+"""
+
+import unittest
+import tempfile
+import threading
+import os.path
+
+import numpy as np
+from cv2cuda.video_writer import FFMPEGVideoWriter
+from cv2cuda.ffmpeg_process import Output
+from cv2cuda.timestamps import load_timestamps
+
+
+class MemoryFFMPEG:
+
+    def __init__(self, output):
+        self.output = output
+        self.frames = []
+        self.closed = False
+        self.copies = 0
+
+    def write(self, image):
+        self.frames.append(int(image[0, 0]))
+        return True
+
+    def write_many(self, frames):
+        self.frames.extend(int(image[0, 0]) for image in frames)
+        self.blocks = getattr(self, "blocks", 0) + 1
+        return True
+
+    def close(self, timeout=None):
+        self.closed = True
+        return 0
+
+    def stop(self, timeout=None):
+        self.closed = True
+        return 0
+
+    def kill(self):
+        self.closed = True
+
+    def wait(self, *args, **kwargs):
+        return 0
+
+
+class MemoryVideoWriter(FFMPEGVideoWriter):
+
+    def __init__(self, *args, **kwargs):
+        self.sinks = []
+        super().__init__(*args, **kwargs)
+
+    def _open_ffmpeg(self, output, index=0):
+        sink = MemoryFFMPEG(output)
+        self.sinks.append(sink)
+        return sink
+
+    def _check_deps(self):
+        pass
+
+
+def frame(value):
+    return np.full((4, 6), value, np.uint8)
+
+
+class TestVideoWriterLogic(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._tempdir.name, "video.mp4")
+
+    def get_writer(self, **kwargs):
+        return MemoryVideoWriter(
+            self._filename, apiPreference="FFMPEG", fourcc="mpeg4",
+            fps=10, frameSize=(6, 4), device="cpu", **kwargs
+        )
+
+    def test_segments_split_at_frame_boundaries(self):
+        writer = self.get_writer(segment_frames=3)
+        for i in range(7):
+            writer.write(frame(i))
+        writer.release()
+
+        ranges = [(segment.first_frame, segment.last_frame) for segment in writer.segments]
+        self.assertEqual(ranges, [(0, 2), (3, 5), (6, 6)])
+        self.assertTrue(writer.segments[1].filename.endswith("video_000001.mp4"))
+
+        written = [sink for sink in writer.sinks if sink.frames]
+        self.assertEqual([sink.frames for sink in written], [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(writer.frames_written, 7)
+
+    def test_extra_outputs_of_segments(self):
+        clip = os.path.join(self._tempdir.name, "clip.avi")
+        writer = self.get_writer(segment_frames=5, outputs=[Output(clip, first_frame=2, last_frame=5)])
+        outputs = [writer._extra_outputs(index) for index in range(3)]
+        writer.release()
+
+        self.assertEqual([len(extra) for extra in outputs], [1, 1, 0])
+        self.assertEqual((outputs[0][0].first_frame, outputs[0][0].last_frame), (2, None))
+        self.assertEqual((outputs[1][0].first_frame, outputs[1][0].last_frame), (None, 0))
+        self.assertTrue(outputs[1][0].filename.endswith("clip_000001.avi"))
+
+    def test_release_without_blocking(self):
+        writer = self.get_writer(segment_frames=3, async_write=True)
+        for i in range(5):
+            writer.write(frame(i))
+        future = writer.release(block=False)
+
+        segments = future.result(timeout=5)
+        self.assertEqual([(segment.first_frame, segment.last_frame) for segment in segments], [(0, 2), (3, 4)])
+        self.assertTrue(all(sink.closed for sink in writer.sinks))
+        self.assertTrue(writer.is_released())
+        # releasing again does nothing
+        self.assertIs(writer.release(block=False).result(), segments)
+
+    def test_timestamps_sidecar(self):
+        for async_write in (False, True):
+            writer = self.get_writer(segment_frames=3, async_write=async_write, timestamps=True)
+            for i in range(4):
+                writer.write(frame(i), timestamp=10 + i)
+            writer.write_many(np.stack([frame(4), frame(5)]), timestamps=[14, 15])
+            writer.write(frame(6))
+            writer.release()
+
+            timestamps = load_timestamps(self._filename)
+            self.assertEqual(list(timestamps["frame"]), list(range(7)))
+            self.assertEqual(list(timestamps["timestamp"][:6]), [10, 11, 12, 13, 14, 15])
+            self.assertGreater(timestamps["timestamp"][6], 15)
+            self.assertTrue(np.all(timestamps["latency_ms"] >= 0))
+
+    def test_spill_keeps_every_frame(self):
+        writer = self.get_writer(async_write=True, queue_size=2, overflow="spill", spill_dir=self._tempdir.name)
+        # nothing is passed to ffmpeg until the feeder is let go
+        stall = threading.Lock()
+        stall.acquire()
+        encode = writer._encode
+        def stalled_encode(*args, **kwargs):
+            with stall:
+                encode(*args, **kwargs)
+        writer._encode = stalled_encode
+
+        for i in range(10):
+            writer.write(frame(i))
+        stats = writer.spill_stats
+        self.assertGreaterEqual(stats["disk_depth"], 7)
+        # the feeder may hold the first frame already
+        self.assertGreaterEqual(writer.frames_queued, 9)
+
+        stall.release()
+        writer.release()
+        self.assertEqual(writer.sinks[0].frames, list(range(10)))
+        self.assertEqual(writer.frames_dropped, 0)
+        self.assertEqual(writer.spill_stats["disk_depth"], 0)
+        self.assertIsNotNone(writer.spill_stats["catchup_time"])
+
+    def test_segment_duration(self):
+        writer = self.get_writer(segment_duration=0.5)
+        for i in range(10):
+            writer.write(frame(i))
+        writer.release()
+        self.assertEqual([segment.nframes for segment in writer.segments], [5, 5])
+
+    def test_async_writer_keeps_every_frame(self):
+        writer = self.get_writer(async_write=True, queue_size=2, overflow="block")
+        for i in range(20):
+            writer.write(frame(i))
+        writer.release()
+
+        self.assertEqual(writer.sinks[0].frames, list(range(20)))
+        self.assertEqual(writer.frames_dropped, 0)
+        self.assertEqual(writer.frames_queued, 0)
+
+    def test_write_many_splits_blocks_at_segments(self):
+        writer = self.get_writer(segment_frames=4)
+        writer.write(frame(0))
+        writer.write_many(np.stack([frame(i) for i in range(1, 10)]))
+        writer.release()
+
+        written = [sink for sink in writer.sinks if sink.frames]
+        self.assertEqual([sink.frames for sink in written], [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual([sink.blocks for sink in written], [1, 1, 1])
+        self.assertEqual(writer.frames_written, 10)
+        self.assertEqual(writer.segments[-1].last_frame, 9)
+
+    def test_write_many_crops_to_frame_size(self):
+        writer = self.get_writer()
+        writer.write_many(np.zeros((3, 5, 7), np.uint8))
+        writer.release()
+        self.assertEqual(writer.frames_written, 3)
+
+        with self.assertRaises(Exception):
+            writer.write_many(np.zeros((3, 4, 6), np.float32))
+
+    def test_write_many_checks_the_shape(self):
+        writer = self.get_writer()
+        with self.assertRaisesRegex(Exception, "shape"):
+            writer.write_many(np.zeros((4, 6), np.uint8))
+        with self.assertRaisesRegex(Exception, "smaller"):
+            writer.write_many(np.zeros((3, 4, 5), np.uint8))
+        with self.assertRaisesRegex(Exception, "smaller"):
+            writer.write_many(np.zeros((3, 3, 6, 3), np.uint8))
+        writer.release()
+        self.assertEqual(writer.frames_written, 0)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import glob
+import os
+import shutil
+import tempfile
+import os.path
+
+import numpy as np
+
+from cv2cuda.ffmpeg_process import FFMPEG
+from cv2cuda.utils.affinity import parse_cpulist, plan_affinity, get_topology
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+TWO_NODES = {0: list(range(0, 12)), 1: list(range(12, 24))}
+
+
+class TestAffinity(unittest.TestCase):
+
+    def test_parse_cpulist(self):
+        self.assertEqual(parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+
+    def test_jobs_get_disjoint_cores(self):
+        plan = plan_affinity(4, topology=TWO_NODES)
+
+        self.assertEqual([placement.node for placement in plan], [0, 0, 1, 1])
+        self.assertEqual(plan[0].capture, (0,))
+        self.assertEqual(plan[0].encoder, (1, 2, 3, 4, 5))
+        self.assertEqual(plan[3].capture, (18,))
+
+        cores = [core for placement in plan for core in placement.capture + placement.encoder]
+        self.assertEqual(len(cores), len(set(cores)))
+
+    def test_odd_number_of_jobs(self):
+        plan = plan_affinity(3, capture_cores=2, topology=TWO_NODES)
+        self.assertEqual(len(plan), 3)
+        self.assertTrue(all(len(placement.capture) == 2 for placement in plan))
+
+    def test_more_jobs_than_cores(self):
+        plan = plan_affinity(3, topology={0: [0, 1]})
+        self.assertEqual(len(plan), 3)
+        for placement in plan:
+            self.assertEqual(placement.capture, placement.encoder)
+
+    def test_topology_of_this_host(self):
+        topology = get_topology()
+        self.assertTrue(all(topology.values()))
+
+    @unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+    def test_ffmpeg_runs_on_its_cores(self):
+        core = min(os.sched_getaffinity(0))
+        with tempfile.TemporaryDirectory() as tempdir:
+            ffmpeg = FFMPEG(
+                64, 48, 30, os.path.join(tempdir, "video.avi"), device="cpu", codec="mpeg4",
+                preset=None, affinity=(core, ), progress=False
+            )
+            ffmpeg.write(np.zeros((48, 64), np.uint8))
+            tasks = glob.glob(f"/proc/{ffmpeg.pid}/task/*")
+            affinities = [os.sched_getaffinity(int(os.path.basename(task))) for task in tasks]
+            self.assertEqual(ffmpeg.close(), 0)
+
+        self.assertTrue(affinities)
+        self.assertTrue(all(affinity == {core} for affinity in affinities))
+
+
+if __name__ == "__main__":
+    unittest.main()
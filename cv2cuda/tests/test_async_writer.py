@@ -0,0 +1,99 @@
+import unittest
+import tempfile
+import asyncio
+import os.path
+import shutil
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import cv2
+
+import cv2cuda
+from cv2cuda.ffmpeg_process import FFMPEG
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+class TestAsyncWriterCommand(unittest.TestCase):
+
+    def test_command_is_built_by_ffmpeg_setup(self):
+        writer = cv2cuda.AsyncVideoWriter("video.mp4", "mpeg4", 30, (64, 48), device="cpu", preset=None)
+        command = writer._build_command()
+        self.assertEqual(command, FFMPEG.build_command(64, 48, 30, "video.mp4", device="cpu", codec="mpeg4", preset=None, output_pix_fmt="gray"))
+        self.assertIn("gray", command)
+        self.assertNotIn("-progress", command)
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestAsyncVideoWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    async def _record(self, filename, frames, color=False):
+        async with cv2cuda.AsyncVideoWriter(filename, "mpeg4", 30, (64, 48), device="cpu", preset=None) as writer:
+            for i in range(frames):
+                if color:
+                    image = np.full((48, 64, 3), i * 10, np.uint8)
+                else:
+                    image = np.full((48, 64), i * 10, np.uint8)
+                await writer.write(image)
+        return writer
+
+    def test_many_writers_in_one_loop(self):
+        filenames = [os.path.join(self._tempdir.name, f"video_{i}.avi") for i in range(3)]
+
+        async def main():
+            return await asyncio.gather(*[self._record(filename, 20) for filename in filenames])
+
+        writers = asyncio.run(main())
+        for writer, filename in zip(writers, filenames):
+            self.assertEqual(writer.returncode, 0)
+            self.assertEqual(writer.frames_written, 20)
+            cap = cv2.VideoCapture(filename)
+            self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 20)
+            cap.release()
+
+    def test_auto_preset_is_tuned_off_the_loop(self):
+        filename = os.path.join(self._tempdir.name, "tuned.avi")
+        threads = []
+        def autotune(*args, **kwargs):
+            threads.append(threading.current_thread())
+            time.sleep(0.5)
+            return None
+
+        async def main():
+            ticks = 0
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+            ticker = asyncio.ensure_future(tick())
+            async with cv2cuda.AsyncVideoWriter(filename, "mpeg4", 30, (64, 48), device="cpu", preset="auto") as writer:
+                await writer.write(np.zeros((48, 64), np.uint8))
+            ticker.cancel()
+            return writer, ticks
+
+        with mock.patch("cv2cuda.rate_control.autotune", side_effect=autotune):
+            writer, ticks = asyncio.run(main())
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        # the loop kept running while the preset was tuned
+        self.assertGreater(ticks, 10)
+        self.assertEqual(writer.returncode, 0)
+
+    def test_color_frames_set_the_pix_fmt(self):
+        filename = os.path.join(self._tempdir.name, "color.avi")
+        writer = asyncio.run(self._record(filename, 5, color=True))
+        self.assertEqual(writer._pix_fmt, "bgr24")
+        self.assertEqual(writer.returncode, 0)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
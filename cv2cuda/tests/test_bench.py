@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import shutil
+import json
+import csv
+import os.path
+
+from cv2cuda.bin.bench import main, REPORT_FIELDS
+from cv2cuda.bin.parser import get_bench_parser
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+class TestBenchParser(unittest.TestCase):
+
+    def test_matrix_arguments(self):
+        args = get_bench_parser().parse_args(["--resolutions", "64x48", "128x96", "--fps", "10", "30", "--batches", "1", "4"])
+        self.assertEqual(args.resolutions, ["64x48", "128x96"])
+        self.assertEqual(args.fps, [10, 30])
+        self.assertEqual(args.batches, [1, 4])
+        self.assertEqual(args.backends, ["FFMPEG"])
+        self.assertEqual(args.device, "cpu")
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._report = os.path.join(self._tempdir.name, "report")
+
+    def test_short_run(self):
+        rows = main([
+            "--resolutions", "64x48", "--fps", "30", "--backends", "FFMPEG", "cv2",
+            "--codecs", "mpeg4", "--device", "cpu", "--batches", "1", "4",
+            "--duration", "0.5", "--report", self._report,
+        ])
+
+        with open(self._report + ".json", "r") as filehandle:
+            self.assertEqual(json.load(filehandle), rows)
+        with open(self._report + ".csv", "r", newline="") as filehandle:
+            reader = csv.DictReader(filehandle)
+            self.assertEqual(reader.fieldnames, REPORT_FIELDS)
+            self.assertEqual(len(list(reader)), 4)
+
+        ran = [row for row in rows if row["backend"] == "FFMPEG"]
+        self.assertEqual([row["status"] for row in ran], ["ok", "ok"])
+        self.assertEqual([row["batch"] for row in ran], [1, 4])
+        for row in ran:
+            self.assertGreater(row["frames"], 0)
+            self.assertGreater(row["achieved_fps"], 0)
+            self.assertLessEqual(row["p50_ms"], row["max_ms"])
+        # mpeg4 is not a fourcc code, so the cv2 backend skips it
+        self.assertEqual([row["status"] for row in rows if row["backend"] == "cv2"], ["skipped", "skipped"])
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import unittest
+import tempfile
+import shutil
+import signal
+import threading
+import time
+import os
+
+import numpy as np
+import cv2
+from cv2cuda.ffmpeg_process import FFMPEG, FFMPEGPool, Output, write_frame, write_frames
+from cv2cuda.video_writer import FFMPEGVideoWriter
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+def get_command(width, height, **kwargs):
+    # build the command without spawning ffmpeg
+    ffmpeg = FFMPEG.__new__(FFMPEG)
+    command, _ = ffmpeg._setup(width, height, 30, "output.mp4", **kwargs)
+    return command
+
+
+class TestWriteFrame(unittest.TestCase):
+
+    def setUp(self):
+        self._file = tempfile.TemporaryFile()
+        self._fd = self._file.fileno()
+        self._image = np.arange(7 * 11, dtype=np.uint8).reshape(7, 11)
+
+    def written(self):
+        self._file.seek(0)
+        return self._file.read()
+
+    def test_contiguous_frame_is_not_copied(self):
+        copies = write_frame(self._fd, self._image)
+        self.assertEqual(copies, 0)
+        self.assertEqual(self.written(), self._image.tobytes())
+
+    def test_cropped_columns_are_not_copied(self):
+        view = self._image[:6, :10]
+        self.assertFalse(view.flags.c_contiguous)
+        copies = write_frame(self._fd, view)
+        self.assertEqual(copies, 0)
+        self.assertEqual(self.written(), view.tobytes())
+
+    def test_more_rows_than_iov_max(self):
+        image = np.random.randint(0, 256, (2179, 33), np.uint8)
+        view = image[:2178, :32]
+        copies = write_frame(self._fd, view)
+        self.assertEqual(copies, 0)
+        self.assertEqual(self.written(), view.tobytes())
+
+    def test_strided_frame_is_copied(self):
+        view = self._image[:, ::2]
+        copies = write_frame(self._fd, view)
+        self.assertEqual(copies, 1)
+        self.assertEqual(self.written(), view.tobytes())
+
+    def test_stack_of_cropped_frames(self):
+        frames = np.random.randint(0, 256, (5, 7, 11), np.uint8)
+        view = frames[:, :6, :10]
+        copies = write_frames(self._fd, view)
+        self.assertEqual(copies, 0)
+        self.assertEqual(self.written(), view.tobytes())
+
+    def test_stack_of_strided_frames(self):
+        frames = np.random.randint(0, 256, (3, 7, 11), np.uint8)
+        view = frames[:, :, ::2]
+        self.assertEqual(write_frames(self._fd, view), 3)
+        self.assertEqual(self.written(), view.tobytes())
+
+    def tearDown(self):
+        self._file.close()
+
+
+class TestCommand(unittest.TestCase):
+
+    def test_odd_frames_are_cropped_by_ffmpeg(self):
+        command = get_command(3861, 2179, device="cpu")
+        self.assertIn("-s 3861x2179", command)
+        self.assertIn("crop=3860:2178:0:0", command)
+
+    def test_even_frames_are_not_filtered(self):
+        command = get_command(3860, 2178, device="cpu")
+        self.assertNotIn("crop", command)
+
+    def test_color_frames_are_converted_by_ffmpeg(self):
+        command = get_command(3860, 2178, device="gpu", pix_fmt="bgr24")
+        self.assertIn("-pix_fmt bgr24", command)
+        self.assertIn("-pix_fmt nv12", command)
+
+    def test_color_frames_in_gray_video(self):
+        command = get_command(3860, 2178, device="cpu", pix_fmt="bgra", output_pix_fmt="gray")
+        self.assertIn("-pix_fmt bgra", command)
+        self.assertIn("format=gray", command)
+
+    def test_extra_outputs_share_one_process(self):
+        outputs = [
+            Output("lowres.mp4", codec="libx264", size=(965, 544)),
+            Output("first.avi", codec="mpeg4", first_frame=10, last_frame=19),
+        ]
+        command = get_command(3861, 2178, device="cpu", outputs=outputs)
+        self.assertIn("[0:v]crop=3860:2178:0:0,split=3[v0][v1][v2]", command)
+        self.assertIn("[v1]scale=965:544[o1]", command)
+        self.assertIn("[v2]trim=start_frame=10:end_frame=20,setpts=PTS-STARTPTS[o2]", command)
+        self.assertIn('-map "[o2]" -c:v mpeg4', command)
+        self.assertNotIn("-vf", command)
+
+    def test_output_clipped_to_a_segment(self):
+        extra = Output("clip.avi", first_frame=7, last_frame=12)
+        # frames 5 to 9 of the recording
+        clipped = extra.clipped("clip_000001.avi", 5, 9)
+        self.assertEqual((clipped.filename, clipped.first_frame, clipped.last_frame), ("clip_000001.avi", 2, None))
+        clipped = extra.clipped("clip_000002.avi", 10, 14)
+        self.assertEqual((clipped.first_frame, clipped.last_frame), (None, 2))
+        self.assertIsNone(extra.clipped("clip_000000.avi", 0, 4))
+        self.assertIsNone(extra.clipped("clip_000003.avi", 15))
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestFFMPEGPool(unittest.TestCase):
+
+    KWARGS = dict(width=64, height=48, fps=10, device="cpu", codec="mpeg4")
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._pool = FFMPEGPool(directory=self._tempdir.name)
+
+    def test_prewarmed_process_writes_to_output(self):
+        self._pool.prewarm(".mp4", **self.KWARGS).join()
+        output = os.path.join(self._tempdir.name, "pooled.mp4")
+        ffmpeg = self._pool.acquire(output, **self.KWARGS)
+
+        for i in range(10):
+            ffmpeg.write(np.full((48, 64), i * 20, np.uint8))
+        self.assertEqual(ffmpeg.close(), 0)
+
+        self.assertTrue(os.path.isfile(output))
+        self.assertGreater(os.path.getsize(output), 0)
+        self.assertFalse(os.path.lexists(ffmpeg.placeholder or ""))
+
+    def idle(self):
+        return sum(len(processes) for processes in self._pool._idle.values())
+
+    def test_refill_only_on_request(self):
+        self._pool.prewarm(".mp4", **self.KWARGS).join()
+        first = self._pool.acquire(os.path.join(self._tempdir.name, "first.mp4"), **self.KWARGS)
+        time.sleep(0.5)
+        # no idle ffmpeg is left behind for a writer that needs a single process
+        self.assertEqual(self.idle(), 0)
+
+        second = self._pool.acquire(os.path.join(self._tempdir.name, "second.mp4"), refill=True, **self.KWARGS)
+        deadline = time.time() + 10
+        while self.idle() == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.idle(), 1)
+        first.close()
+        second.close()
+
+    def tearDown(self):
+        self._pool.close()
+        self._tempdir.cleanup()
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestFFMPEGClose(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    def test_hung_ffmpeg_is_killed_after_the_deadline(self):
+        output = os.path.join(self._tempdir.name, "hung.avi")
+        ffmpeg = FFMPEG(64, 48, 10, output, device="cpu", codec="mpeg4", preset=None, progress=False)
+        ffmpeg.write(np.zeros((48, 64), np.uint8))
+        # a stopped process does not act on SIGTERM
+        os.kill(ffmpeg._process.pid, signal.SIGSTOP)
+        self.assertEqual(ffmpeg.close(timeout=0.2, kill_timeout=0.2), -signal.SIGKILL)
+
+    def test_terminate_returns_the_exit_code(self):
+        output = os.path.join(self._tempdir.name, "terminated.avi")
+        ffmpeg = FFMPEG(64, 48, 10, output, device="cpu", codec="mpeg4", preset=None, progress=False)
+        self.assertIsNotNone(ffmpeg.terminate())
+        self.assertIsNotNone(ffmpeg.returncode)
+
+    def test_ranged_output_of_a_segmented_recording(self):
+        filename = os.path.join(self._tempdir.name, "segmented.avi")
+        clip = os.path.join(self._tempdir.name, "clip.avi")
+        writer = FFMPEGVideoWriter(
+            filename, apiPreference="FFMPEG", fourcc="mpeg4", fps=10, frameSize=(64, 48), device="cpu",
+            preset=None, segment_frames=5, outputs=[Output(clip, first_frame=2, last_frame=5)]
+        )
+        for i in range(12):
+            writer.write(np.full((48, 64), i * 20, np.uint8))
+        writer.release()
+
+        clips = sorted(name for name in os.listdir(self._tempdir.name) if name.startswith("clip"))
+        self.assertEqual(clips, ["clip_000000.avi", "clip_000001.avi"])
+        counts = []
+        for name in clips:
+            cap = cv2.VideoCapture(os.path.join(self._tempdir.name, name))
+            counts.append(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+            cap.release()
+        self.assertEqual(counts, [3, 1])
+
+    def test_close_while_a_write_is_blocked(self):
+        output = os.path.join(self._tempdir.name, "blocked.avi")
+        ffmpeg = FFMPEG(640, 480, 10, output, device="cpu", codec="mpeg4", preset=None, progress=False)
+        os.kill(ffmpeg._process.pid, signal.SIGSTOP)
+        # a frame does not fit in the pipe, so the write blocks holding the lock
+        writer = threading.Thread(target=ffmpeg.write, args=(np.zeros((480, 640), np.uint8), ), daemon=True)
+        writer.start()
+        while ffmpeg.write_started is None:
+            time.sleep(0.01)
+        self.assertEqual(ffmpeg.close(timeout=0.2, kill_timeout=0.2), -signal.SIGKILL)
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+
+    def test_release_of_a_stopped_ffmpeg(self):
+        filename = os.path.join(self._tempdir.name, "stopped.avi")
+        writer = FFMPEGVideoWriter(
+            filename, apiPreference="FFMPEG", fourcc="mpeg4", fps=10, frameSize=(640, 480),
+            device="cpu", preset=None, async_write=True
+        )
+        os.kill(writer._ffmpeg.pid, signal.SIGSTOP)
+        for i in range(10):
+            writer.write(np.zeros((480, 640), np.uint8))
+
+        before = time.time()
+        segments = writer.release(block=False, timeout=1).result(timeout=20)
+        # the deadline, and the time ffmpeg is given to act on SIGTERM
+        self.assertLess(time.time() - before, 1 + 5 + 2)
+        self.assertEqual(len(segments), 1)
+        self.assertFalse(writer._feeder.is_alive())
+        self.assertLess(writer.frames_written, 10)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import threading
+import tempfile
+import os.path
+
+import numpy as np
+from cv2cuda.frame_ring import FrameRing, SpillRing
+
+
+def make_frame(value):
+    return np.full((4, 6), value, np.uint8)
+
+
+class TestFrameRing(unittest.TestCase):
+
+    def consume(self, ring):
+        index = ring.get(timeout=0)
+        value = int(ring.slot(index)[0, 0])
+        ring.release(index)
+        return value
+
+    def test_frames_come_out_in_order(self):
+        ring = FrameRing(4)
+        for i in range(3):
+            self.assertTrue(ring.put(make_frame(i)))
+
+        self.assertEqual(ring.queued, 3)
+        self.assertEqual([self.consume(ring) for _ in range(3)], [0, 1, 2])
+        self.assertEqual(ring.queued, 0)
+
+    def test_drop_newest(self):
+        ring = FrameRing(2, overflow="drop-newest")
+        results = [ring.put(make_frame(i)) for i in range(4)]
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(ring.dropped, 2)
+        self.assertEqual([self.consume(ring) for _ in range(2)], [0, 1])
+
+    def test_drop_oldest(self):
+        ring = FrameRing(2, overflow="drop-oldest")
+        results = [ring.put(make_frame(i)) for i in range(4)]
+
+        self.assertEqual(results, [True, True, True, True])
+        self.assertEqual(ring.dropped, 2)
+        self.assertEqual([self.consume(ring) for _ in range(2)], [2, 3])
+
+    def test_block_waits_for_consumer(self):
+        ring = FrameRing(1, overflow="block")
+        ring.put(make_frame(0))
+
+        consumer = threading.Timer(0.1, lambda: self.consume(ring))
+        consumer.start()
+        self.assertTrue(ring.put(make_frame(1), timeout=5))
+        consumer.join()
+
+        self.assertEqual(ring.dropped, 0)
+        self.assertEqual(self.consume(ring), 1)
+
+    def test_closed_ring_drains(self):
+        ring = FrameRing(2)
+        ring.put(make_frame(7))
+        ring.close()
+
+        self.assertEqual(self.consume(ring), 7)
+        self.assertIsNone(ring.get())
+        with self.assertRaises(Exception):
+            ring.put(make_frame(8))
+
+    def test_frames_must_match_slots(self):
+        ring = FrameRing(2)
+        ring.put(make_frame(0))
+        with self.assertRaises(Exception):
+            ring.put(np.zeros((5, 6), np.uint8))
+
+
+class TestSpillRing(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    def consume(self, ring):
+        index = ring.get(timeout=0)
+        value = int(ring.slot(index)[0, 0]), ring.stamp(index)
+        ring.release(index)
+        return value
+
+    def test_spilled_frames_keep_their_order(self):
+        ring = SpillRing(2, directory=self._tempdir.name)
+        for i in range(6):
+            self.assertTrue(ring.put(make_frame(i), stamp=(i, 0.5)))
+
+        self.assertEqual((ring.ram_depth, ring.disk_depth, ring.queued), (2, 4, 6))
+        self.assertEqual(ring.spilled_bytes, 4 * (16 + 24))
+        # a slot is free, but frames are waiting on disk
+        self.assertEqual(self.consume(ring), (0, (0, 0.5)))
+        ring.put(make_frame(6))
+        self.assertEqual(ring.disk_depth, 5)
+
+        values = [self.consume(ring) for _ in range(6)]
+        self.assertEqual([value for value, _ in values], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(values[3][1], (4.0, 0.5))
+        self.assertIsNone(values[5][1])
+        self.assertIsNotNone(ring.catchup_time)
+        self.assertEqual(os.path.getsize(ring.path), 0)
+
+        # caught up, frames stay in memory again
+        ring.put(make_frame(7))
+        self.assertEqual((ring.ram_depth, ring.disk_depth), (1, 0))
+
+        ring.close()
+        self.assertEqual(self.consume(ring)[0], 7)
+        self.assertIsNone(ring.get())
+        self.assertFalse(os.path.exists(ring.path))
+
+    def test_spilled_frames_are_written_in_batches(self):
+        ring = SpillRing(1, directory=self._tempdir.name, buffer_size=3 * (16 + 24))
+        for i in range(3):
+            ring.put(make_frame(i))
+        # the two spilled frames are still in the buffer
+        self.assertEqual(os.path.getsize(ring.path), 0)
+        ring.put(make_frame(3))
+        self.assertEqual(os.path.getsize(ring.path), 3 * (16 + 24))
+        ring.put(make_frame(4))
+        ring.put(make_frame(5))
+
+        self.assertEqual([self.consume(ring)[0] for _ in range(5)], [0, 1, 2, 3, 4])
+        # the consumer reached the buffer and flushed it
+        self.assertEqual(os.path.getsize(ring.path), 5 * (16 + 24))
+        self.assertEqual(self.consume(ring)[0], 5)
+        self.assertEqual(os.path.getsize(ring.path), 0)
+
+    def test_concurrent_consumer(self):
+        ring = SpillRing(4, directory=self._tempdir.name)
+        received = []
+
+        def consume():
+            while True:
+                index = ring.get()
+                if index is None:
+                    break
+                received.append(int(ring.slot(index)[0, 0]))
+                ring.release(index)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for i in range(200):
+            ring.put(make_frame(i % 256))
+        ring.close()
+        consumer.join()
+        self.assertEqual(received, [i % 256 for i in range(200)])
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+
+import numpy as np
+import cv2
+
+import cv2cuda
+from cv2cuda.index import _to_index, nearest_keyframe, load_index, index_filename
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+class TestIndex(unittest.TestCase):
+
+    def test_packets_are_sorted_by_pts(self):
+        # decoding order of a stream with B frames
+        packets = [(1.0, 100, True), (1.2, 300, False), (1.1, 200, False), (None, 400, False)]
+        index = _to_index(packets)
+
+        self.assertEqual(list(index["frame"]), [0, 1, 2])
+        np.testing.assert_allclose(index["pts"], [1.0, 1.1, 1.2])
+        self.assertEqual(list(index["pos"]), [100, 200, 300])
+
+    def test_nearest_keyframe(self):
+        index = _to_index([(i / 30, -1, i % 10 == 0) for i in range(25)])
+        self.assertEqual(nearest_keyframe(index, 0), 0)
+        self.assertEqual(nearest_keyframe(index, 9), 0)
+        self.assertEqual(nearest_keyframe(index, 10), 10)
+        self.assertEqual(nearest_keyframe(index, 24), 20)
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestWriterIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._video = os.path.join(self._tempdir.name, "video.mp4")
+
+    def test_index_and_seek(self):
+        writer = cv2cuda.VideoWriter(
+            filename=self._video, apiPreference="FFMPEG", fourcc="mpeg4", fps=30, frameSize=(64, 48),
+            device="cpu", preset=None, gop_duration=1/3, index=True
+        )
+        # mostly static frames, so the encoder does not make every frame a keyframe
+        background = np.random.default_rng(0).integers(0, 256, (48, 64), dtype=np.uint8)
+        for i in range(30):
+            image = background.copy()
+            image[:16, :16] = i * 8
+            writer.write(image)
+        writer.release()
+
+        self.assertTrue(os.path.exists(index_filename(self._video)))
+        index = load_index(self._video)
+        self.assertEqual(len(index), 30)
+        self.assertEqual(list(index["frame"][index["key"] == 1]), [0, 10, 20])
+
+        cap = cv2cuda.VideoCapture(self._video)
+        for frame in (25, 27, 12, 0):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            ret, image = cap.read()
+            self.assertTrue(ret)
+            self.assertAlmostEqual(image[4:12, 4:12].mean(), frame * 8, delta=2)
+        cap.release()
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+
+from cv2cuda import probe
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D h264_nvenc           NVIDIA NVENC H.264 encoder (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_parse_encoders(self):
+        rows = probe._parse_table(ENCODERS, "------")
+        video = [name for flags, name in rows if flags.startswith("V")]
+        self.assertEqual(video, ["libx264", "h264_nvenc"])
+
+    def test_missing_binary(self):
+        entry = probe.probe("/nonexistent/ffmpeg")
+        self.assertEqual(entry["encoders"], [])
+        self.assertFalse(probe.encoder_works("mpeg4", binary="/nonexistent/ffmpeg"))
+        with self.assertRaises(Exception):
+            probe.select_encoder(binary="/nonexistent/ffmpeg")
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestProbeCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._cache = os.path.join(self._tempdir.name, "probe.json")
+        self._binary = shutil.which("ffmpeg")
+
+    def test_select_cpu_encoder(self):
+        encoder = probe.select_encoder("cpu", binary=self._binary, cache=self._cache)
+        self.assertEqual(encoder["device"], "cpu")
+
+        entry = probe.probe(self._binary, cache=self._cache)
+        self.assertIn(encoder["codec"], entry["encoders"])
+        self.assertTrue(entry["tested"][f"{encoder['codec']}:{encoder['preset']}"])
+        self.assertTrue(os.path.exists(self._cache))
+
+    def test_unknown_encoder_is_not_tested(self):
+        self.assertFalse(probe.encoder_works("not_an_encoder", binary=self._binary, cache=self._cache))
+        self.assertEqual(probe.probe(self._binary, cache=self._cache)["tested"], {})
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+
+import numpy as np
+
+from cv2cuda.progress import parse_progress
+from cv2cuda.ffmpeg_process import FFMPEG
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+PROGRESS = """frame=0
+fps=0.00
+stream_0_0_q=0.0
+bitrate=N/A
+total_size=48
+out_time_us=N/A
+out_time_ms=N/A
+out_time=N/A
+dup_frames=0
+drop_frames=0
+speed=N/A
+progress=continue
+frame=45
+fps=44.87
+stream_0_0_q=28.0
+bitrate= 181.2kbits/s
+total_size=34012
+out_time_us=1500000
+out_time_ms=1500000
+out_time=00:00:01.500000
+dup_frames=1
+drop_frames=2
+speed=1.49x
+progress=end
+"""
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_parse_blocks(self):
+        first, last = parse_progress(PROGRESS.splitlines())
+
+        self.assertEqual(first.frame, 0)
+        self.assertIsNone(first.speed)
+        self.assertIsNone(first.bitrate)
+        self.assertFalse(first.ended)
+
+        self.assertEqual(last.frame, 45)
+        self.assertAlmostEqual(last.fps, 44.87)
+        self.assertAlmostEqual(last.speed, 1.49)
+        self.assertAlmostEqual(last.bitrate, 181.2)
+        self.assertEqual((last.dup, last.drop), (1, 2))
+        self.assertEqual(last.total_size, 34012)
+        self.assertAlmostEqual(last.out_time, 1.5)
+        self.assertTrue(last.ended)
+
+    def test_time_of_the_last_advance(self):
+        first, last = parse_progress(PROGRESS.splitlines())
+        self.assertIsNone(first.advanced_at)
+        self.assertEqual(last.advanced_at, last.updated_at)
+
+        stuck = list(parse_progress(["frame=5", "progress=continue", "frame=5", "progress=continue"]))
+        self.assertEqual([stats.advanced_at for stats in stuck], [stuck[0].updated_at] * 2)
+
+    def test_incomplete_block_is_ignored(self):
+        self.assertEqual(list(parse_progress(["frame=3", "fps=1.0"])), [])
+
+    def test_command(self):
+        ffmpeg = FFMPEG.__new__(FFMPEG)
+        command, _ = ffmpeg._setup(100, 100, 30, "output.mp4", device="cpu", codec="mpeg4", progress=7)
+        self.assertIn("-progress pipe:7", command)
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestLiveProgress(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    def test_encoded_frames_are_reported(self):
+        output = os.path.join(self._tempdir.name, "video.avi")
+        ffmpeg = FFMPEG(64, 48, 30, output, device="cpu", codec="mpeg4", preset=None)
+        for i in range(10):
+            ffmpeg.write(np.full((48, 64), i, np.uint8))
+        ffmpeg.close()
+
+        self.assertTrue(ffmpeg.stats.ended)
+        self.assertEqual(ffmpeg.stats.frame, ffmpeg.frames_written)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
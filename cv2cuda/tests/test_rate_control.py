@@ -0,0 +1,116 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os.path
+from unittest import mock
+
+import numpy as np
+
+from cv2cuda import probe
+from cv2cuda.ffmpeg_process import FFMPEG
+from cv2cuda.rate_control import RateControl, autotune, PRESET_LADDERS
+from cv2cuda.video_writer import FFMPEGVideoWriter
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+def get_command(codec, device="cpu", **kwargs):
+    ffmpeg = FFMPEG.__new__(FFMPEG)
+    command, _ = ffmpeg._setup(640, 480, 30, "output.mp4", codec=codec, device=device, **kwargs)
+    return command
+
+
+class TestRateControl(unittest.TestCase):
+
+    def test_flags_per_encoder(self):
+        cbr = RateControl("cbr", bitrate=4_000_000, preset="fast", gop=60)
+        self.assertEqual(cbr.flags("h264_nvenc"), "-preset fast -rc cbr -b:v 4000k -bufsize 4000k -g 60")
+        self.assertEqual(
+            cbr.flags("libx264"),
+            "-preset fast -b:v 4000k -minrate 4000k -maxrate 4000k -x264-params nal-hrd=cbr -bufsize 4000k -g 60"
+        )
+        # mpeg4 has no presets
+        self.assertEqual(cbr.flags("mpeg4"), "-b:v 4000k -minrate 4000k -maxrate 4000k -bufsize 4000k -g 60")
+
+        cq = RateControl("cq", quality=23)
+        self.assertEqual(cq.flags("hevc_nvenc"), "-rc vbr -cq 23 -b:v 0")
+        self.assertEqual(cq.flags("libx265"), "-crf 23")
+        self.assertEqual(cq.flags("mpeg4"), "-q:v 23")
+
+    def test_bitrate_bounds_imply_vbr(self):
+        control = RateControl(min_bitrate=1_000_000, max_bitrate=3_000_000)
+        self.assertEqual(control.mode, "vbr")
+        self.assertEqual(control.flags("mpeg4"), "-b:v 3000k -minrate 1000k -maxrate 3000k -bufsize 3000k")
+        # x264 has no lower bound
+        self.assertEqual(control.flags("libx264"), "-b:v 3000k -maxrate 3000k -bufsize 3000k")
+
+    def test_invalid_options(self):
+        with self.assertRaises(Exception):
+            RateControl("abr", bitrate=1000)
+        with self.assertRaises(Exception):
+            RateControl("cbr")
+        with self.assertRaises(Exception):
+            RateControl("cq")
+
+    def test_setup_uses_bitrates_and_gop(self):
+        command = get_command("mpeg4", preset=None, min_bitrate=500_000, max_bitrate=2_000_000, gop_duration=2)
+        self.assertIn("-vcodec mpeg4 -b:v 2000k -minrate 500k -maxrate 2000k -bufsize 2000k -g 60 output.mp4", command)
+
+        command = get_command("h264_nvenc", device="gpu", rate_control=RateControl("cq", quality=25, preset="p4"))
+        self.assertIn("-c:v h264_nvenc -preset p4 -rc vbr -cq 25 -b:v 0 output.mp4", command)
+
+    def test_default_preset(self):
+        self.assertIn("-c:v h264_nvenc -preset llhp output.mp4", get_command("h264_nvenc", device="gpu"))
+
+    def test_building_a_command_does_not_tune(self):
+        with mock.patch("cv2cuda.rate_control.autotune") as tune:
+            with self.assertRaises(Exception):
+                FFMPEG.build_command(640, 480, 30, "output.mp4", codec="libx264", device="cpu", preset="auto")
+        tune.assert_not_called()
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestAutotune(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._cache = os.path.join(self._tempdir.name, "autotune.json")
+
+    def test_autotune_is_cached(self):
+        preset = autotune("libx264", 64, 48, 10, duration=1, cache=self._cache)
+        self.assertIn(preset, PRESET_LADDERS["x26x"])
+
+        with open(self._cache, "r") as filehandle:
+            entries = list(json.load(filehandle).values())
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["preset"], preset)
+        self.assertIn(preset, entries[0]["fps"])
+
+        self.assertEqual(autotune("libx264", 64, 48, 10, duration=1, cache=self._cache), preset)
+
+    def test_encoders_without_presets(self):
+        self.assertIsNone(autotune("mpeg4", 64, 48, 10, cache=self._cache))
+
+    def test_writer_with_auto_preset(self):
+        filename = os.path.join(self._tempdir.name, "video.mp4")
+        with mock.patch.object(probe, "CACHE_DIR", self._tempdir.name):
+            writer = FFMPEGVideoWriter(filename, "FFMPEG", "libx264", 10, (64, 48), device="cpu", preset="auto", segment_frames=3)
+            for i in range(5):
+                writer.write(np.full((48, 64), i * 40, np.uint8))
+            segments = writer.release()
+
+        preset = writer._rate_control.preset
+        self.assertIn(preset, PRESET_LADDERS["x26x"])
+        self.assertIn(f"-preset {preset}", writer._ffmpeg._command)
+        self.assertTrue(all(os.path.getsize(segment.filename) > 0 for segment in segments))
+        # tuned once for the whole recording
+        with open(os.path.join(self._tempdir.name, "autotune.json"), "r") as filehandle:
+            self.assertEqual(len(json.load(filehandle)), 1)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
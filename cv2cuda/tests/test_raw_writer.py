@@ -0,0 +1,85 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+
+import numpy as np
+import cv2
+
+import cv2cuda
+from cv2cuda.raw_writer import RawVideoWriter, TranscodePool, load_raw, RAW_HEADER_SIZE
+from cv2cuda.timestamps import load_timestamps
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+def frame(value, channels=1):
+    shape = (48, 64) if channels == 1 else (48, 64, channels)
+    return np.full(shape, value, np.uint8)
+
+
+class TestRawVideoWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._tempdir.name, "video.mp4")
+
+    def test_frames_and_header_roundtrip(self):
+        writer = RawVideoWriter(self._filename, fps=30, frameSize=(64, 48), chunk=4)
+        for i in range(10):
+            writer.write(frame(i), timestamp=100 + i)
+        # color frames are turned gray
+        writer.write(frame(10, channels=3))
+        raw_filename = writer.release()
+
+        self.assertEqual(raw_filename, os.path.join(self._tempdir.name, "video.raw"))
+        self.assertEqual(os.path.getsize(raw_filename), RAW_HEADER_SIZE + 11 * (8 + 48 * 64))
+        header, records = load_raw(raw_filename)
+        self.assertEqual((header["width"], header["height"], header["fps"]), (64, 48, 30))
+        self.assertEqual(header["output"], self._filename)
+        self.assertEqual([int(image[0, 0]) for image in records["frame"]], list(range(11)))
+        self.assertEqual(list(records["timestamp"][:10]), list(range(100, 110)))
+
+    def test_not_a_raw_file(self):
+        path = os.path.join(self._tempdir.name, "other.raw")
+        with open(path, "wb") as filehandle:
+            filehandle.write(b"\0" * 100)
+        with self.assertRaises(Exception):
+            load_raw(path)
+
+    @unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+    def test_transcode_in_the_background(self):
+        with TranscodePool(fourcc="mpeg4") as transcoder:
+            writer = cv2cuda.RawVideoWriter(self._filename, fps=30, frameSize=(64, 48), transcoder=transcoder)
+            for i in range(12):
+                writer.write(frame(i * 20), timestamp=i / 30)
+            output = writer.release().result(timeout=30)
+
+        self.assertEqual(output, self._filename)
+        self.assertFalse(os.path.exists(writer.raw_filename))
+        cap = cv2.VideoCapture(output)
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 12)
+        cap.release()
+        np.testing.assert_allclose(load_timestamps(output)["timestamp"], np.arange(12) / 30)
+
+    @unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+    def test_cli_backend_transcodes(self):
+        from cv2cuda.utils.components import get_video_writer, get_transcoder, release_writer
+
+        transcoder = get_transcoder("raw", "cpu")
+        writer = get_video_writer(self._filename, 30, (64, 48), backend="raw", device="cpu", transcoder=transcoder)
+        self.assertEqual(writer.raw_filename, os.path.join(self._tempdir.name, "video.raw"))
+        for i in range(5):
+            writer.write(frame(i * 40))
+        output = release_writer(writer).result(timeout=30)
+        transcoder.close()
+
+        self.assertEqual(output, self._filename)
+        self.assertFalse(os.path.exists(writer.raw_filename))
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import os.path
+
+import numpy as np
+
+from cv2cuda.utils.recorder import MetricsRecorder, LatencyHistogram, load_profile
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        histogram.add(np.arange(1, 101, dtype=np.float64))
+        histogram.add([np.nan])
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 50, delta=50 * 0.05)
+        self.assertAlmostEqual(histogram.percentile(99), 99, delta=99 * 0.05)
+
+    def test_add_one(self):
+        one_by_one = LatencyHistogram()
+        for value in (0.001, 0.5, 1.0, 7.3, 1e6, np.nan):
+            one_by_one.add_one(value)
+        histogram = LatencyHistogram()
+        histogram.add([0.001, 0.5, 1.0, 7.3, 1e6, np.nan])
+        np.testing.assert_array_equal(one_by_one.counts, histogram.counts)
+
+    def test_empty(self):
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+
+class TestMetricsRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._tempdir.name, "test_0.profile")
+
+    def test_flush_in_batches(self):
+        recorder = MetricsRecorder(self._path, samplers={"cpu_usage": lambda: 1.0}, interval=0.01, chunk=8)
+        for i in range(20):
+            recorder.record(i / 10, 1.0, None if i == 3 else 2.0)
+        recorder.close()
+
+        profile = load_profile(self._path)
+        frames = profile["frames"]
+        self.assertEqual(len(frames), 20)
+        np.testing.assert_allclose(frames["t"], np.arange(20) / 10)
+        self.assertTrue(np.isnan(frames["write_ms"][3]))
+        self.assertEqual(recorder.histograms["write_ms"].count, 19)
+        self.assertTrue(os.path.exists(os.path.join(self._path, "histograms.json")))
+        self.assertEqual(profile["system"].dtype.names, ("t", "cpu_usage"))
+
+    def test_percentiles_before_a_flush(self):
+        recorder = MetricsRecorder(self._path, chunk=4096)
+        for i in range(10):
+            recorder.record(i / 10, 1.0, 2.0)
+        self.assertEqual(recorder.histograms["read_ms"].count, 10)
+        self.assertAlmostEqual(recorder.histograms["write_ms"].percentile(50), 2.0, delta=0.1)
+        recorder.close()
+
+    def test_failing_sampler(self):
+        def sampler():
+            raise Exception("no gpu")
+
+        recorder = MetricsRecorder(self._path, samplers={"gpu_usage": sampler}, interval=0.01)
+        recorder.close()
+        self.assertTrue(np.isnan(load_profile(self._path)["system"]["gpu_usage"]).all())
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
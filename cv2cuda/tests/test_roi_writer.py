@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+import signal
+
+import numpy as np
+import cv2
+
+from cv2cuda.ffmpeg_process import FFMPEG, Output
+from cv2cuda.roi_writer import ROIVideoWriter, roi_filenames
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+ROIS = [(0, 0, 32, 24), (40, 20, 21, 27)]
+
+
+class TestROICommand(unittest.TestCase):
+
+    def test_filenames(self):
+        self.assertEqual(roi_filenames("/data/video.mp4", ROIS), ["/data/video_roi00.mp4", "/data/video_roi01.mp4"])
+        self.assertEqual(roi_filenames("video.avi", ROIS, ["left", "right"]), ["video_left.avi", "video_right.avi"])
+
+    def test_only_extra_outputs_are_encoded(self):
+        ffmpeg = FFMPEG.__new__(FFMPEG)
+        outputs = [Output("a.mp4", filters=["crop=32:24:0:0"]), Output("b.mp4", filters=["crop=20:26:40:20"])]
+        command, _ = ffmpeg._setup(64, 48, 30, None, device="cpu", codec="mpeg4", outputs=outputs)
+        self.assertIn('"[0:v]split=2[v1][v2];[v1]crop=32:24:0:0[o1];[v2]crop=20:26:40:20[o2]"', command)
+        self.assertNotIn("[v0]", command)
+        self.assertNotIn("-f null", command)
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestROIVideoWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._tempdir.name, "video.avi")
+
+    def _record(self, mode):
+        writer = ROIVideoWriter(
+            self._filename, "FFMPEG", "mpeg4", 30, (64, 48), ROIS, mode=mode, device="cpu", preset=None
+        )
+        # every roi has its own brightness
+        image = np.zeros((48, 64), np.uint8)
+        image[:24, :32] = 50
+        image[20:, 40:] = 200
+        for _ in range(10):
+            writer.write(image)
+        return writer, writer.release()
+
+    def test_modes(self):
+        for mode in ("filter", "views"):
+            writer, filenames = self._record(mode)
+            self.assertEqual(writer.frames_written, [10, 10])
+            self.assertEqual(writer.rois[1], (40, 20, 20, 26))
+
+            for filename, value, size in zip(filenames, (50, 200), ((32, 24), (20, 26))):
+                cap = cv2.VideoCapture(filename)
+                self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 10)
+                ret, frame = cap.read()
+                cap.release()
+                self.assertEqual(frame.shape[:2][::-1], size)
+                self.assertAlmostEqual(frame.mean(), value, delta=3)
+
+    def test_frames_lost_are_not_counted(self):
+        for mode in ("filter", "views"):
+            writer = ROIVideoWriter(
+                self._filename, "FFMPEG", "mpeg4", 30, (64, 48), ROIS, mode=mode, device="cpu", preset=None
+            )
+            image = np.zeros((48, 64), np.uint8)
+            writer.write(image)
+            ffmpegs = [writer._ffmpeg] if mode == "filter" else [roi_writer._ffmpeg for roi_writer in writer._writers]
+            for ffmpeg in ffmpegs:
+                os.kill(ffmpeg.pid, signal.SIGKILL)
+                ffmpeg.wait()
+            writer.write(image)
+            self.assertEqual(writer.frames_written, [1, 1])
+            writer.release()
+
+    def test_roi_out_of_the_frame(self):
+        with self.assertRaises(Exception):
+            ROIVideoWriter(self._filename, "FFMPEG", "mpeg4", 30, (64, 48), [(50, 0, 32, 24)], device="cpu")
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
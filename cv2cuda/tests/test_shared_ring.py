@@ -0,0 +1,58 @@
+import unittest
+import multiprocessing
+
+import numpy as np
+from cv2cuda.shared_ring import SharedFrameRing
+
+
+def consume(ring, results):
+    while True:
+        item = ring.get(timeout=10)
+        if item is None:
+            break
+        index, timestamp = item
+        results.put((int(ring.slot(index).sum()), timestamp))
+        ring.release(index)
+    results.put(None)
+
+
+class TestSharedFrameRing(unittest.TestCase):
+
+    def setUp(self):
+        self._ring = SharedFrameRing(2, (3, 5))
+
+    def test_frames_cross_processes(self):
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=consume, args=(self._ring, results))
+        consumer.start()
+
+        for i in range(6):
+            self.assertIsNotNone(self._ring.put(np.full((3, 5), i, np.uint8), timestamp=float(i), timeout=10))
+        self._ring.close()
+
+        received = []
+        while True:
+            item = results.get(timeout=10)
+            if item is None:
+                break
+            received.append(item)
+        consumer.join()
+
+        self.assertEqual(received, [(15 * i, float(i)) for i in range(6)])
+
+    def test_full_ring_drops_after_timeout(self):
+        for i in range(2):
+            self._ring.put(np.zeros((3, 5), np.uint8))
+        self.assertIsNone(self._ring.put(np.zeros((3, 5), np.uint8), timeout=0.05))
+        self.assertEqual(self._ring.dropped, 1)
+
+    def test_wrong_shape_is_rejected(self):
+        with self.assertRaises(Exception):
+            self._ring.put(np.zeros((5, 3), np.uint8))
+
+    def tearDown(self):
+        self._ring.unlink()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+import os.path
+
+import numpy as np
+
+from cv2cuda.sidecar import ChunkedMemmap, load_records
+from cv2cuda.timestamps import TimestampLog, load_timestamps, timestamps_filename
+
+
+class TestChunkedMemmap(unittest.TestCase):
+
+    DTYPE = np.dtype([("a", "<u4"), ("b", "<f8")])
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._tempdir.name, "records.bin")
+
+    def test_grows_in_chunks_and_trims_on_close(self):
+        records = ChunkedMemmap(self._path, self.DTYPE, chunk=4)
+        for i in range(10):
+            records.append((i, i / 2))
+        self.assertEqual(os.path.getsize(self._path), 12 * self.DTYPE.itemsize)
+        records.close()
+
+        self.assertEqual(os.path.getsize(self._path), 10 * self.DTYPE.itemsize)
+        loaded = load_records(self._path, self.DTYPE)
+        self.assertEqual(list(loaded["a"]), list(range(10)))
+        np.testing.assert_allclose(loaded["b"], np.arange(10) / 2)
+
+    def test_unclosed_file_is_loaded_without_empty_records(self):
+        records = ChunkedMemmap(self._path, self.DTYPE, chunk=8)
+        for i in range(3):
+            records.append((i + 1, 1.0))
+        records.flush()
+
+        self.assertEqual(len(load_records(self._path, self.DTYPE, mmap=False)), 3)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+class TestTimestampLog(unittest.TestCase):
+
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as folder:
+            video = os.path.join(folder, "video.mp4")
+            log = TimestampLog(video, chunk=2)
+            for frame in range(5):
+                log.record(frame, 100 + frame / 30, 0.5)
+            log.close()
+
+            self.assertTrue(os.path.exists(timestamps_filename(video)))
+            timestamps = load_timestamps(video, mmap=False)
+
+        self.assertEqual(list(timestamps["frame"]), list(range(5)))
+        np.testing.assert_allclose(np.diff(timestamps["timestamp"]), 1 / 30)
+        np.testing.assert_allclose(timestamps["latency_ms"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import tempfile
+import time
+import os.path
+import shutil
+
+import numpy as np
+import cv2
+
+import cv2cuda
+from cv2cuda.ffmpeg_process import FFMPEG
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+def get_capture(width=64, height=48, fps=200, **kwargs):
+    cap = cv2cuda.VideoCapture(0, **kwargs)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return cap
+
+
+class TestVideoCapture(unittest.TestCase):
+
+    def test_frames_are_due_on_an_absolute_clock(self):
+        cap = get_capture(fps=200)
+        (ret, frame), _ = cap.read()
+        t0 = cap.timestamp
+        self.assertTrue(ret)
+        self.assertEqual(frame.shape, (48, 64))
+
+        for n in range(1, 20):
+            cap.read()
+            self.assertAlmostEqual(cap.timestamp - t0, n / 200, places=6)
+            self.assertGreaterEqual(time.time(), cap.timestamp)
+
+        self.assertEqual(cap.get(cv2.CAP_PROP_POS_FRAMES), 20)
+
+    def test_late_reader_does_not_wait(self):
+        cap = get_capture(fps=100)
+        cap.read()
+        time.sleep(0.1)
+        before = time.time()
+        for _ in range(5):
+            cap.read()
+        self.assertLess(time.time() - before, 0.05)
+
+    def test_bank_is_reused(self):
+        cap = get_capture(pattern="blobs", bank_size=4)
+        frames = [cap.read()[0][1] for _ in range(5)]
+        self.assertTrue(np.shares_memory(frames[0], frames[4]))
+        self.assertFalse(np.array_equal(frames[0], frames[1]))
+        self.assertFalse(frames[0].flags.writeable)
+
+    def test_drops(self):
+        cap = get_capture(fps=1000, drop_rate=0.5, seed=1)
+        for _ in range(20):
+            cap.read()
+        self.assertGreater(cap.dropped, 0)
+        self.assertEqual(cap.get(cv2.CAP_PROP_POS_FRAMES), 20 + cap.dropped)
+
+    def test_invalid_drop_rate(self):
+        for drop_rate in (1.0, -0.1):
+            with self.assertRaises(Exception):
+                cv2cuda.VideoCapture(0, drop_rate=drop_rate)
+
+    def test_replay_source(self):
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, "frames.npy")
+            np.save(source, np.arange(3 * 6 * 8, dtype=np.uint8).reshape(3, 6, 8))
+
+            cap = cv2cuda.VideoCapture(0, source=source, loop=False)
+            cap.set(cv2.CAP_PROP_FPS, 1000)
+            self.assertEqual(cap.get(cv2.CAP_PROP_FRAME_COUNT), 3)
+            frames = [cap.read()[0] for _ in range(4)]
+            cap.release()
+
+        self.assertEqual([ret for ret, _ in frames], [True, True, True, False])
+        self.assertEqual(frames[2][1][0, 0], 2 * 6 * 8)
+        self.assertEqual(cap.get(cv2.CAP_PROP_FRAME_WIDTH), 8)
+
+
+class TestDecoderCommand(unittest.TestCase):
+
+    def test_decoder_pipes_raw_frames(self):
+        ffmpeg = FFMPEG.__new__(FFMPEG)
+        command, registers = ffmpeg._setup(
+            160, 120, 30, "my video.mp4", encode=False, hwaccel="cuda", vf=["crop=320:240:0:0", "scale=160:120"], start=2
+        )
+        self.assertIn("-hwaccel cuda -ss 2.000000 -i 'my video.mp4'", command)
+        self.assertIn("-vf crop=320:240:0:0,scale=160:120", command)
+        self.assertTrue(command.endswith("-f rawvideo -pix_fmt gray -"))
+        self.assertIsNone(registers[0])
+
+    def test_decoder_drops_frames_by_timestamp(self):
+        ffmpeg = FFMPEG.__new__(FFMPEG)
+        command, _ = ffmpeg._setup(160, 120, 30, "video.mp4", encode=False, start=0.35, start_pts=0.4)
+        self.assertIn("-noaccurate_seek -copyts -ss 0.350000", command)
+        self.assertIn("-vf 'select=gte(t\\,0.400000)'", command)
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestFFMPEGVideoCapture(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._video = os.path.join(self._tempdir.name, "video.avi")
+        ffmpeg = FFMPEG(64, 48, 30, self._video, device="cpu", codec="mpeg4", preset=None, progress=False)
+        for i in range(20):
+            ffmpeg.write(np.full((48, 64), i * 10, np.uint8))
+        ffmpeg.close()
+
+    def test_read_and_seek(self):
+        cap = cv2cuda.VideoCapture(self._video)
+        self.assertIsInstance(cap, cv2cuda.FFMPEGVideoCapture)
+        self.assertEqual(cap.get(cv2.CAP_PROP_FRAME_WIDTH), 64)
+
+        frames = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(int(frame.mean().round()))
+        self.assertEqual(len(frames), 20)
+        self.assertAlmostEqual(frames[5], 50, delta=2)
+
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 12)
+        ret, frame = cap.read()
+        self.assertAlmostEqual(frame.mean(), 120, delta=2)
+        self.assertEqual(cap.get(cv2.CAP_PROP_POS_FRAMES), 13)
+        cap.release()
+
+    def test_crop_and_scale(self):
+        cap = cv2cuda.VideoCapture(self._video, crop=(0, 0, 32, 24), size=(16, 12))
+        ret, frame = cap.read()
+        cap.release()
+        self.assertEqual(frame.shape, (12, 16))
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
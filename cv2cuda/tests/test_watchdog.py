@@ -0,0 +1,193 @@
+import unittest
+import tempfile
+import os.path
+import shutil
+import signal
+import time
+
+import numpy as np
+import cv2
+
+from cv2cuda.progress import EncoderStats
+from cv2cuda.video_writer import FFMPEGVideoWriter
+from cv2cuda.watchdog import EncoderWatchdog, diagnose
+from cv2cuda.tests.test_VideoWriter_logic import MemoryFFMPEG, MemoryVideoWriter, frame
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+class FakeFFMPEG:
+
+    def __init__(self):
+        self.pid = 1234
+        self.returncode = None
+        self.write_started = None
+        self.first_write = None
+        self.last_write = None
+        self.frames_written = 0
+        self.stats = EncoderStats()
+
+    def poll(self):
+        return self.returncode
+
+
+class TestDiagnose(unittest.TestCase):
+
+    def test_healthy(self):
+        ffmpeg = FakeFFMPEG()
+        self.assertIsNone(diagnose(ffmpeg, now=100))
+        ffmpeg.frames_written = 10
+        ffmpeg.first_write = ffmpeg.last_write = 100
+        self.assertIsNone(diagnose(ffmpeg, now=101))
+
+    def test_exit(self):
+        ffmpeg = FakeFFMPEG()
+        ffmpeg.returncode = -9
+        self.assertIn("exited with code -9", diagnose(ffmpeg))
+
+    def test_stalled_write(self):
+        ffmpeg = FakeFFMPEG()
+        ffmpeg.write_started = 100
+        self.assertIsNone(diagnose(ffmpeg, stall_timeout=5, now=104))
+        self.assertIn("blocked", diagnose(ffmpeg, stall_timeout=5, now=106))
+
+    def test_stalled_progress(self):
+        ffmpeg = FakeFFMPEG()
+        ffmpeg.stats = EncoderStats(frame=5, updated_at=100, advanced_at=100)
+        ffmpeg.frames_written = 50
+        ffmpeg.first_write, ffmpeg.last_write = 90, 105
+        self.assertIsNone(diagnose(ffmpeg, progress_timeout=10, now=105))
+        ffmpeg.last_write = 111
+        self.assertIn("without encoding", diagnose(ffmpeg, progress_timeout=10, now=111))
+        # every frame was encoded, ffmpeg is idle
+        ffmpeg.stats.frame = 50
+        self.assertIsNone(diagnose(ffmpeg, progress_timeout=10, now=111))
+
+    def test_stuck_but_reporting(self):
+        ffmpeg = FakeFFMPEG()
+        # reports keep coming, but the frame count has not moved since 100
+        ffmpeg.stats = EncoderStats(frame=5, updated_at=110, advanced_at=100)
+        ffmpeg.frames_written = 50
+        ffmpeg.first_write, ffmpeg.last_write = 90, 111
+        self.assertIn("without encoding", diagnose(ffmpeg, progress_timeout=10, now=111))
+
+
+class BrokenFFMPEG(MemoryFFMPEG):
+    """
+    Accepts a number of frames and then behaves like an ffmpeg that exited
+    """
+
+    def __init__(self, output, accepts):
+        super().__init__(output)
+        self.accepts = accepts
+
+    def write(self, image):
+        if len(self.frames) == self.accepts:
+            return False
+        return super().write(image)
+
+
+class FailingVideoWriter(MemoryVideoWriter):
+
+    def __init__(self, *args, accepts=(), **kwargs):
+        self._accepts = list(accepts)
+        super().__init__(*args, **kwargs)
+
+    def _open_ffmpeg(self, output, index=0):
+        if not self._accepts:
+            return super()._open_ffmpeg(output, index)
+        sink = BrokenFFMPEG(output, self._accepts.pop(0))
+        self.sinks.append(sink)
+        return sink
+
+
+class TestRestart(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._tempdir.name, "video.mp4")
+        self._watchdog = EncoderWatchdog(interval=60)
+
+    def get_writer(self, **kwargs):
+        return FailingVideoWriter(
+            self._filename, apiPreference="FFMPEG", fourcc="mpeg4", fps=10, frameSize=(6, 4),
+            device="cpu", watchdog=self._watchdog, **kwargs
+        )
+
+    def test_broken_pipe_restarts_in_a_new_segment(self):
+        for async_write in (False, True):
+            writer = self.get_writer(accepts=[3], async_write=async_write)
+            for i in range(8):
+                writer.write(frame(i))
+            writer.release()
+
+            self.assertEqual(writer.restarts, 1)
+            self.assertEqual([(segment.first_frame, segment.last_frame) for segment in writer.segments], [(0, 2), (3, 7)])
+            self.assertTrue(writer.segments[1].filename.endswith("video_000001.mp4"))
+            self.assertEqual([sink.frames for sink in writer.sinks], [[0, 1, 2], [3, 4, 5, 6, 7]])
+            self.assertEqual(self._watchdog.writers, [])
+
+    def test_failure_found_by_the_watchdog(self):
+        writer = self.get_writer(segment_frames=4)
+        writer.write(frame(0))
+        writer._on_failure(writer._ffmpeg, "test")
+        # reported again by the next check
+        writer._on_failure(writer._ffmpeg, "test")
+        writer.write_many(np.stack([frame(1), frame(2)]))
+        writer.release()
+
+        self.assertEqual([segment.error for segment in writer.segments], ["test", None])
+        self.assertEqual([sink.frames for sink in writer.sinks if sink.frames], [[0], [1, 2]])
+
+    def test_too_many_restarts(self):
+        writer = self.get_writer(accepts=[0, 0, 0], max_restarts=1)
+        with self.assertRaises(Exception):
+            writer.write(frame(0))
+
+    def tearDown(self):
+        self._watchdog.close()
+        self._tempdir.cleanup()
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    def test_killed_ffmpeg_is_restarted(self):
+        filename = os.path.join(self._tempdir.name, "video.avi")
+        image = np.zeros((48, 64), np.uint8)
+        with EncoderWatchdog(interval=0.05) as watchdog:
+            writer = FFMPEGVideoWriter(
+                filename, apiPreference="FFMPEG", fourcc="mpeg4", fps=30, frameSize=(64, 48),
+                device="cpu", preset=None, async_write=True, watchdog=watchdog
+            )
+            for i in range(10):
+                writer.write(image)
+            while writer.frames_written < 10:
+                time.sleep(0.01)
+
+            killed = writer._ffmpeg
+            os.kill(killed.pid, signal.SIGKILL)
+            deadline = time.time() + 10
+            while writer._failure is None and time.time() < deadline:
+                time.sleep(0.01)
+
+            for i in range(10):
+                writer.write(image)
+            segments = writer.release()
+
+        self.assertEqual(writer.restarts, 1)
+        self.assertIn("exited", segments[0].error)
+        self.assertEqual((segments[1].first_frame, segments[1].last_frame), (10, 19))
+        cap = cv2.VideoCapture(segments[1].filename)
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 10)
+        cap.release()
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
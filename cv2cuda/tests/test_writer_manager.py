@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import os.path
+import shutil
+import signal
+import time
+
+import numpy as np
+import cv2
+
+from cv2cuda.writer_manager import WriterManager
+
+FFMPEG_AVAILABLE = shutil.which("ffmpeg") is not None
+
+
+@unittest.skipUnless(FFMPEG_AVAILABLE, "ffmpeg is not installed")
+class TestWriterManager(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+
+    def _open(self, manager, i, frameSize=(64, 48)):
+        filename = os.path.join(self._tempdir.name, f"video_{i}.avi")
+        return manager.open(filename, "mpeg4", 30, frameSize, device="cpu", preset=None, progress=False)
+
+    def test_streams_share_one_thread(self):
+        with WriterManager(queue_size=4) as manager:
+            streams = [self._open(manager, i) for i in range(3)]
+            for i in range(20):
+                for stream in streams:
+                    self.assertTrue(stream.write(np.full((48, 64), i * 10, np.uint8)))
+            returncodes = [stream.release() for stream in streams]
+
+        self.assertEqual(returncodes, [0, 0, 0])
+        for stream in streams:
+            self.assertEqual(stream.frames_written, 20)
+            cap = cv2.VideoCapture(str(stream))
+            self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 20)
+            cap.release()
+
+    def test_slow_encoder_does_not_block_the_others(self):
+        # frames larger than the pipe buffer, so a stopped ffmpeg leaves a frame half written
+        frameSize = (320, 240)
+        image = np.zeros((240, 320), np.uint8)
+        with WriterManager(queue_size=4, overflow="drop-newest") as manager:
+            stalled, running = self._open(manager, 0, frameSize), self._open(manager, 1, frameSize)
+            os.kill(stalled._ffmpeg._process.pid, signal.SIGSTOP)
+            try:
+                for i in range(10):
+                    stalled.write(image)
+                    self.assertTrue(running.write(image))
+                    deadline = time.time() + 10
+                    while running.frames_written <= i and time.time() < deadline:
+                        time.sleep(0.001)
+
+                self.assertEqual(running.frames_written, 10)
+                self.assertLess(stalled.frames_written, 10)
+                self.assertGreater(stalled.frames_dropped, 0)
+            finally:
+                os.kill(stalled._ffmpeg._process.pid, signal.SIGCONT)
+
+        self.assertEqual(stalled.frames_written + stalled.frames_dropped, 10)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
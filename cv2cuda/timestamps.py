@@ -0,0 +1,42 @@
+"""
+Capture time of every frame of a video, saved in a binary sidecar next to it (video.mp4 -> video.mp4.timestamps.bin)
+
+ffmpeg encodes the frames at a fixed framerate, so the real time of frame n, and the frames
+lost before reaching the writer, can only be known from this file
+"""
+
+import numpy as np
+
+from cv2cuda.sidecar import ChunkedMemmap, load_records
+
+# frame: position of the frame in the recording (over all its segments)
+# timestamp: capture time, passed to write or the time write was called
+# latency_ms: milliseconds between the call to write and the frame reaching ffmpeg
+TIMESTAMPS_DTYPE = np.dtype([("frame", "<u8"), ("timestamp", "<f8"), ("latency_ms", "<f4")])
+TIMESTAMPS_SUFFIX = ".timestamps.bin"
+
+
+def timestamps_filename(filename):
+    return filename + TIMESTAMPS_SUFFIX
+
+
+class TimestampLog(ChunkedMemmap):
+    """
+    The timestamps sidecar of filename, written by a video writer
+    """
+
+    def __init__(self, filename, chunk=4096):
+        super().__init__(timestamps_filename(filename), TIMESTAMPS_DTYPE, chunk=chunk)
+
+    def record(self, frame, timestamp, latency_ms):
+        return self.append((frame, timestamp, latency_ms))
+
+
+def load_timestamps(filename, mmap=True):
+    """
+    Return the timestamps of the frames of filename (the video, or the sidecar itself)
+    as a structured array with TIMESTAMPS_DTYPE
+    """
+    if not filename.endswith(TIMESTAMPS_SUFFIX):
+        filename = timestamps_filename(filename)
+    return load_records(filename, TIMESTAMPS_DTYPE, mmap=mmap)
@@ -0,0 +1,137 @@
+"""
+Place the capture process and the ffmpeg encoder of every job on their own cores,
+so parallel jobs do not thrash each other's caches
+"""
+
+import os
+import glob
+import logging
+
+logger = logging.getLogger(__name__)
+
+NODE_CPULISTS = "/sys/devices/system/node/node*/cpulist"
+
+
+def parse_cpulist(cpulist):
+    """
+    Parse a list of cpus like 0-5,12-17 as found in /sys
+    """
+    cpus = []
+    for chunk in cpulist.strip().split(","):
+        if not chunk:
+            continue
+        if "-" in chunk:
+            first, last = chunk.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(chunk))
+    return cpus
+
+
+def get_topology():
+    """
+    Return a dictionary with the cpus of every NUMA node that this process is allowed to use
+    """
+    allowed = os.sched_getaffinity(0)
+    topology = {}
+    for path in sorted(glob.glob(NODE_CPULISTS)):
+        node = int(os.path.basename(os.path.dirname(path))[len("node"):])
+        with open(path, "r") as filehandle:
+            cpus = [cpu for cpu in parse_cpulist(filehandle.read()) if cpu in allowed]
+        if cpus:
+            topology[node] = cpus
+
+    if not topology:
+        topology[0] = sorted(allowed)
+
+    return topology
+
+
+class Placement:
+    """
+    Cores assigned to the capture process and the ffmpeg encoder of one job
+    """
+
+    def __init__(self, idx, node, capture, encoder):
+        self.idx = idx
+        self.node = node
+        self.capture = tuple(capture)
+        self.encoder = tuple(encoder)
+
+    def __repr__(self):
+        return f"Job {self.idx}: node {self.node} capture {list(self.capture)} encoder {list(self.encoder)}"
+
+
+def plan_affinity(njobs, capture_cores=1, topology=None):
+    """
+    Split the cores of the machine in disjoint sets, one per job,
+    and within every set, keep capture_cores for the capture process and the rest for ffmpeg.
+    Jobs are spread over the NUMA nodes in proportion to their number of cores,
+    and a job never spans two nodes
+
+    If there are fewer cores than needed, jobs share cores and a warning is issued
+
+    Returns a list of Placement, one per job
+    """
+    if topology is None:
+        topology = get_topology()
+
+    nodes = sorted(topology)
+    total = sum(len(topology[node]) for node in nodes)
+
+    # largest remainder split of the jobs among the nodes
+    shares = {node: njobs * len(topology[node]) / total for node in nodes}
+    counts = {node: int(shares[node]) for node in nodes}
+    by_remainder = sorted(nodes, key=lambda node: shares[node] - counts[node], reverse=True)
+    for node in by_remainder[:njobs - sum(counts.values())]:
+        counts[node] += 1
+
+    plan = []
+    for node in nodes:
+        cpus = topology[node]
+        if counts[node] == 0:
+            continue
+
+        size = len(cpus) // counts[node]
+        if size < capture_cores + 1:
+            logger.warning(
+                f"Node {node} has {len(cpus)} cores for {counts[node]} jobs."
+                " Capture and encoding will share cores"
+            )
+
+        for i in range(counts[node]):
+            if size == 0:
+                cores = [cpus[i % len(cpus)]]
+            else:
+                cores = cpus[i*size:(i+1)*size]
+
+            if len(cores) > capture_cores:
+                capture, encoder = cores[:capture_cores], cores[capture_cores:]
+            else:
+                capture, encoder = cores, cores
+
+            plan.append(Placement(len(plan), node, capture, encoder))
+
+    return plan
+
+
+def apply_affinity(cores, pid=0):
+    """
+    Restrict a process (by default the calling thread) to the cores
+    """
+    os.sched_setaffinity(pid, cores)
+
+
+def apply_process_affinity(pid, cores):
+    """
+    Restrict a running process, and every thread it has started so far, to the cores.
+    The threads it starts later inherit the affinity.
+    Meant for child processes, instead of a preexec_fn, which is not safe in a program with threads
+    """
+    os.sched_setaffinity(pid, cores)
+    for task in glob.glob(f"/proc/{pid}/task/*"):
+        try:
+            os.sched_setaffinity(int(os.path.basename(task)), cores)
+        except (ProcessLookupError, ValueError):
+            # the thread exited
+            pass
@@ -4,11 +4,17 @@ import time
 import threading
 import multiprocessing
 import math
+import concurrent.futures
 from abc import ABC
 
 import cv2
 import cv2cuda
 import cv2cuda.utils.cpu as cpu_utils
+from cv2cuda.utils.recorder import MetricsRecorder
+from cv2cuda.utils.affinity import apply_affinity
+from cv2cuda.ffmpeg_process import FFMPEGPool
+from cv2cuda.raw_writer import TranscodePool
+from cv2cuda import probe
 SUPPORTED_CAMERAS=["virtual", "opencv"]
 # try:
 #     from scicam.io.cameras import BaslerCamera #pyright: reportMissingImports=false
@@ -27,13 +33,16 @@ def get_queue(size):
     return multiprocessing.Queue(size)
 
 
-def get_camera(camera, width, height, fps, idx=0):
+def get_camera(camera, width, height, fps, idx=0, **kwargs):
+    """
+    Return a camera of the given kind. kwargs are passed to the virtual camera (pattern, source, jitter, drop_rate ...)
+    """
 
     if camera not in SUPPORTED_CAMERAS:
         raise Exception(f"Passed camera {camera} is not one of the supported cameras: {SUPPORTED_CAMERAS}")
     
     elif camera == "virtual":
-        cap = cv2cuda.VideoCapture(idx)
+        cap = cv2cuda.VideoCapture(idx, **kwargs)
         cap.set(cv2.CAP_PROP_FPS, fps)
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
@@ -70,7 +79,26 @@ def get_camera(camera, width, height, fps, idx=0):
     return cap
 
 
-def get_video_writer(output, fps, frameSize, backend="FFMPEG", device="gpu", **kwargs):
+def get_ffmpeg_encoder(device):
+    """
+    Return the codec, device and preset of the fastest encoder that works on this host
+    for the FFMPEG backend. If device is gpu but no gpu encoder works, a cpu encoder is returned
+    """
+    encoder = probe.select_encoder(device)
+    return encoder["codec"], encoder["device"], encoder["preset"]
+
+
+def get_video_writer(output, fps, frameSize, backend="FFMPEG", device="gpu", transcoder=None, **kwargs):
+
+    if backend == "raw":
+        # frames are stored unencoded in output with a .raw extension, and encoded to output by the transcoder
+        return cv2cuda.RawVideoWriter(
+            filename = output,
+            fps=fps,
+            frameSize=frameSize,
+            isColor=False,
+            transcoder=transcoder,
+        )
 
     if device == "gpu":
         if backend == "cv2":
@@ -80,12 +108,15 @@ def get_video_writer(output, fps, frameSize, backend="FFMPEG", device="gpu", **k
             )
             
         elif backend == "FFMPEG":
-        
+
+            fourcc, device, preset = get_ffmpeg_encoder(device)
             video_writer = cv2cuda.VideoWriter(
                 filename = output + '.mp4',
                 apiPreference="FFMPEG",
-                fourcc="h264_nvenc",
+                fourcc=fourcc,
                 fps=fps,
+                device=device,
+                preset=preset,
                 frameSize=frameSize,
                 isColor=False,
                 **kwargs,
@@ -107,11 +138,14 @@ def get_video_writer(output, fps, frameSize, backend="FFMPEG", device="gpu", **k
                 isColor=False
             )
         elif backend == "FFMPEG":
+            fourcc, device, preset = get_ffmpeg_encoder(device)
             video_writer = cv2cuda.VideoWriter(
                 filename = output + '.mp4',
                 apiPreference="FFMPEG",
-                fourcc="mpeg4",
+                fourcc=fourcc,
                 fps=fps,
+                device=device,
+                preset=preset,
                 frameSize=frameSize,
                 isColor=False,
                 **kwargs,
@@ -123,11 +157,55 @@ def get_video_writer(output, fps, frameSize, backend="FFMPEG", device="gpu", **k
     return video_writer
 
 
+def get_writer_pool(fps, frameSize, backend="FFMPEG", device="gpu", directory=None, **kwargs):
+    """
+    Return a FFMPEGPool prewarmed for the writers get_video_writer returns with these arguments,
+    or None if the backend does not use ffmpeg
+    """
+    if backend != "FFMPEG":
+        return None
+
+    fourcc, device, preset = get_ffmpeg_encoder(device)
+    pool = FFMPEGPool(directory=directory)
+    pool.prewarm(
+        ".mp4",
+        **cv2cuda.VideoWriter.ffmpeg_kwargs(frameSize, fps, fourcc, isColor=False, device=device, preset=preset, **kwargs)
+    )
+    return pool
+
+
+
+def get_transcoder(backend="FFMPEG", device="gpu"):
+    """
+    Return a TranscodePool that encodes the raw files of the raw backend with the fastest encoder of the device,
+    or None for the other backends
+    """
+    if backend != "raw":
+        return None
+
+    fourcc, device, preset = get_ffmpeg_encoder(device)
+    return TranscodePool(fourcc=fourcc, device=device, preset=preset)
+
+
+def release_writer(video_writer):
+    """
+    Release a writer of get_video_writer. Raw writers with a transcoder return a future, whose errors are logged
+    """
+    result = video_writer.release()
+
+    def log_error(future):
+        if future.exception() is not None:
+            logging.error(f"Could not transcode {video_writer.raw_filename}: {future.exception()}")
+
+    if isinstance(result, concurrent.futures.Future):
+        result.add_done_callback(log_error)
+    return result
+
 
 class BaseProgram(ABC):
 
 
-    def __init__(self, idx, stop_queue, width, height, fps, profile, output, *args, camera="virtual", backend="FFMPEG", device="0", yes=False, duration=math.inf, **kwargs):
+    def __init__(self, idx, stop_queue, width, height, fps, profile, output, *args, camera="virtual", backend="FFMPEG", device="0", yes=False, duration=math.inf, ring=None, affinity=None, pool=False, **kwargs):
         self._idx = idx,
         self._stop_queue = stop_queue
         self._width = width
@@ -138,6 +216,12 @@ class BaseProgram(ABC):
         self._duration = duration
         self._camera = camera
         self._yes = yes
+        # if a SharedFrameRing is passed, frames are handed over to an Encoder process
+        self._ring = ring
+        # Placement of the capture process and the encoder (cv2cuda.utils.affinity)
+        self._affinity = affinity
+        # start ffmpeg before the first frame arrives (cv2cuda.ffmpeg_process.FFMPEGPool)
+        self._pool = pool
 
         self._output_prefix = os.path.join(output, f"{profile}_{idx}")
        
@@ -146,9 +230,6 @@ class BaseProgram(ABC):
         else:
             self._profile = None
 
-        if profile:
-            self._init_profile_log()
-        
         self._handle = None
         self._N = None
 
@@ -172,28 +253,58 @@ class BaseProgram(ABC):
     def video_name(self):
         return self._output_prefix + ".mp4"
 
-    def _init_profile_log(self):
-
-        os.makedirs(self._profile, exist_ok=True)
+    def get_encoder(self, ring, daemon=True):
+        """
+        Return an Encoder process that encodes the frames this program puts in the ring
+        """
+        return Encoder(
+            ring, self.video_name, self._fps, backend=self._backend,
+            device=self._device, yes=self._yes, daemon=daemon,
+            affinity=None if self._affinity is None else self._affinity.encoder
+        )
+
+    def _get_writer_kwargs(self):
+        if self._affinity is None:
+            return {}
+        return {"affinity": self._affinity.encoder}
+
+    def _get_recorder(self):
+        """
+        Return a MetricsRecorder writing to the .profile folder of this program.
+        cpu, encoder and gpu usage are sampled once per second instead of on every frame
+        """
+        samplers = {"cpu_usage": cpu_utils.query_cpu_usage}
+        if GPU_PROFILING_ENABLED and self._device_int is not None:
+            pynvml_handles = gpu_utils.init_pynvml_handlers(self._device_int)
+            samplers["encode_usage"] = lambda: gpu_utils.query_encoder_usage(pynvml_handles)
+            samplers["gpu_usage"] = lambda: gpu_utils.query_gpu_usage(pynvml_handles)
 
-        with open(self._profile, "w") as filehandle:
-            filehandle.write("t,read,write,cpu_usage,encode_usage,gpu_usage\n")
+        return MetricsRecorder(self._profile, samplers=samplers)
 
 
     def run(self):
 
+        if self._affinity is not None:
+            apply_affinity(self._affinity.capture)
+
         cap = get_camera(self._camera, self._width, self._height, self._fps)
 
         video_writer = None
+        if self._ring is None and self._pool:
+            pool = get_writer_pool(
+                self._fps, (self._width, self._height), backend=self._backend,
+                device=self._device, directory=self._output, **self._get_writer_kwargs()
+            )
+        else:
+            pool = None
+        transcoder = get_transcoder(self._backend, self._device) if self._ring is None else None
 
-        start_time = time.time()
-
-
-        if self._profile and GPU_PROFILING_ENABLED:
-            pynvml_handles = gpu_utils.init_pynvml_handlers(self._device_int)
+        if self._profile:
+            recorder = self._get_recorder()
         else:
-            pynvml_handles = None
+            recorder = None
 
+        start_time = time.time()
 
         while (time.time() - start_time) < self._duration:
              
@@ -205,8 +316,10 @@ class BaseProgram(ABC):
             try:
                 logging.debug("Reading frame")
 
+                now = time.time()
+                # cameras whose read is not timed report nan
+                read_msec = math.nan
                 if "unwrapped" in dir(cap.read):
-                    now = time.time()
                     if self._profile:
                         (ret, frame), read_msec = cap.read()
                     else:
@@ -217,34 +330,29 @@ class BaseProgram(ABC):
 
                 if ret:
 
-                    if video_writer is None:
-                        video_writer = get_video_writer(
-                            self.video_name, self._fps, frame.shape[:2][::-1],
-                            backend=self._backend, device=self._device,
-                            yes=self._yes
-                        )
-                    
-                    logging.debug("Writing frame")
-                    if self._profile:
-                        _, write_msec = video_writer.write(frame)
+                    if self._ring is not None:
+                        logging.debug("Passing frame to encoder")
+                        before = time.time()
+                        self._ring.put(frame, timestamp=before)
+                        write_msec = (time.time() - before) * 1000
+
                     else:
-                        video_writer.write.unwrapped(video_writer, frame)
+                        if video_writer is None:
+                            video_writer = get_video_writer(
+                                self.video_name, self._fps, frame.shape[:2][::-1],
+                                backend=self._backend, device=self._device,
+                                yes=self._yes, pool=pool, transcoder=transcoder, **self._get_writer_kwargs()
+                            )
+
+                        logging.debug("Writing frame")
+                        if self._profile:
+                            _, write_msec = video_writer.write(frame)
+                        else:
+                            video_writer.write.unwrapped(video_writer, frame)
 
 
-                    if self._profile:
-                        cpu_usage = cpu_utils.query_cpu_usage()
-                        if GPU_PROFILING_ENABLED:
-                            enc_usage = gpu_utils.query_encoder_usage(pynvml_handles)
-                            gpu_usage = gpu_utils.query_gpu_usage(pynvml_handles)
-                        else:
-                            enc_usage = None
-                            gpu_usage = None
-                        
-                        with open(self._profile, "a") as filehandle:
-                            data = f"{now-start_time},{read_msec},{write_msec},"\
-                            f"{cpu_usage},{enc_usage},{gpu_usage}"\
-                            "\n"
-                            filehandle.write(data)
+                    if recorder is not None:
+                        recorder.record(now - start_time, read_msec, write_msec)
 
                 else:
                     break
@@ -255,9 +363,19 @@ class BaseProgram(ABC):
         logging.debug(f"Queue is empty: {self._stop_queue.qsize() == 0}")
         logging.debug("Releasing VideoCapture instance")
         cap.release()
+        if self._ring is not None:
+            logging.debug("Closing frame ring")
+            self._ring.close()
         if video_writer:
             logging.debug("Releasing VideoWriter instance")
-            video_writer.release()
+            release_writer(video_writer)
+        if pool is not None:
+            pool.close()
+        if transcoder is not None:
+            logging.info("Waiting for the raw files to be encoded")
+            transcoder.close()
+        if recorder is not None:
+            recorder.close()
         logging.debug("Process terminated")
         return
 
@@ -276,5 +394,57 @@ class BaseProgram(ABC):
 class Process(BaseProgram, multiprocessing.Process):
     pass
 
+
+class Encoder(multiprocessing.Process):
+    """
+    Encode the frames a capture program puts in a SharedFrameRing.
+    Only slot indices cross the process boundary,
+    the frames are fed to ffmpeg straight from shared memory
+    """
+
+    def __init__(self, ring, video_name, fps, backend="FFMPEG", device="gpu", yes=False, affinity=None, **kwargs):
+        self._ring = ring
+        self._affinity = affinity
+        self._video_name = video_name
+        self._fps = fps
+        self._backend = backend
+        self._device = device
+        self._yes = yes
+        super().__init__(**kwargs)
+
+    def run(self):
+
+        video_writer = None
+        writer_kwargs = {}
+        if self._affinity is not None:
+            apply_affinity(self._affinity)
+            writer_kwargs["affinity"] = self._affinity
+        transcoder = get_transcoder(self._backend, self._device)
+
+        while True:
+            item = self._ring.get()
+            if item is None:
+                break
+
+            index, timestamp = item
+            frame = self._ring.slot(index)
+            if video_writer is None:
+                video_writer = get_video_writer(
+                    self._video_name, self._fps, frame.shape[:2][::-1],
+                    backend=self._backend, device=self._device,
+                    yes=self._yes, transcoder=transcoder, **writer_kwargs
+                )
+
+            video_writer.write.unwrapped(video_writer, frame)
+            self._ring.release(index)
+
+        if video_writer:
+            logging.debug("Releasing VideoWriter instance")
+            release_writer(video_writer)
+        if transcoder is not None:
+            logging.info("Waiting for the raw files to be encoded")
+            transcoder.close()
+        logging.debug("Encoder terminated")
+
 class Thread(BaseProgram, threading.Thread):
     pass
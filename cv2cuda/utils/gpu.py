@@ -2,7 +2,7 @@ import pynvml as N # type: ignore
 
 def init_pynvml_handlers(index):
     N.nvmlInit()
-    handle = N.nvmlDeviceGetHandleByIndex(int())
+    handle = N.nvmlDeviceGetHandleByIndex(int(index))
     return N, handle
 
 def query_gpu_usage(pynvml_handles):
@@ -0,0 +1,211 @@
+"""
+Low overhead profiling of the capture loop
+
+Per-frame timings are stored in preallocated arrays and flushed in batches to one raw file per column.
+System metrics (cpu, gpu, encoder usage) are sampled by a timer thread, not on every frame,
+and streaming latency histograms give percentiles at any time without keeping every value in memory
+"""
+
+import os
+import os.path
+import bisect
+import math
+import json
+import time
+import threading
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "schema.json"
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies (in ms) with logarithmic bins between min_ms and max_ms
+
+    Arguments:
+        * min_ms, max_ms (float): Range of the bins. Values out of range go to the first / last bin
+        * bins_per_decade (int): Resolution of the histogram
+    """
+
+    def __init__(self, min_ms=0.01, max_ms=10000, bins_per_decade=50):
+        decades = np.log10(max_ms) - np.log10(min_ms)
+        self.edges = np.logspace(np.log10(min_ms), np.log10(max_ms), int(decades * bins_per_decade) + 1)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        # bisect on a list is cheaper than numpy for a single value
+        self._edges = self.edges.tolist()
+
+    def add_one(self, value):
+        """
+        Count a single value (nan is ignored)
+        """
+        if not math.isnan(value):
+            self.counts[bisect.bisect_left(self._edges, value)] += 1
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.counts += np.bincount(np.searchsorted(self.edges, values), minlength=len(self.counts))
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """
+        Approximate q-th percentile (the upper edge of the bin where it falls)
+        """
+        if self.count == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * q / 100))
+        return float(self.edges[min(index, len(self.edges) - 1)])
+
+    def summary(self):
+        return {f"p{q}": self.percentile(q) for q in (50, 95, 99)}
+
+
+class ColumnarFile:
+    """
+    A folder with one raw binary file per column, appended to in batches
+
+    Arguments:
+        * path (str): Folder
+        * dtype: numpy structured dtype of the records
+        * chunk (int): Number of records kept in memory before they are flushed
+        * on_flush (callable): Called with the records of every batch, after they are written
+    """
+
+    def __init__(self, path, dtype, chunk=4096, on_flush=None):
+        self._path = path
+        self._on_flush = on_flush
+        self._dtype = np.dtype(dtype)
+        self._buffer = np.zeros(chunk, dtype=self._dtype)
+        self._n = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, SCHEMA), "w") as filehandle:
+            json.dump({name: self._dtype[name].str for name in self._dtype.names}, filehandle)
+        for name in self._dtype.names:
+            open(self._column(name), "wb").close()
+
+    def _column(self, name):
+        return os.path.join(self._path, name + ".bin")
+
+    def append(self, *values):
+        with self._lock:
+            self._buffer[self._n] = values
+            self._n += 1
+            full = self._n == len(self._buffer)
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records = self._buffer[:self._n].copy()
+            self._n = 0
+
+        for name in self._dtype.names:
+            with open(self._column(name), "ab") as filehandle:
+                records[name].tofile(filehandle)
+
+        if self._on_flush is not None:
+            self._on_flush(records)
+        return records
+
+
+def load_columns(path):
+    """
+    Load a folder written by ColumnarFile into a numpy structured array
+    """
+    with open(os.path.join(path, SCHEMA), "r") as filehandle:
+        schema = json.load(filehandle)
+
+    columns = {name: np.fromfile(os.path.join(path, name + ".bin"), dtype=dtype) for name, dtype in schema.items()}
+    n = min(len(column) for column in columns.values())
+    records = np.zeros(n, dtype=[(name, dtype) for name, dtype in schema.items()])
+    for name, column in columns.items():
+        records[name] = column[:n]
+    return records
+
+
+class MetricsRecorder:
+    """
+    Record the read and write time of every frame and sample system metrics in the background
+
+    The result is a folder with a frames/ and a system/ ColumnarFile,
+    which can be loaded with load_profile
+
+    Arguments:
+        * path (str): Output folder
+        * samplers (dict): Name and function returning a number, for every system metric
+        * interval (float): Seconds between samples of the system metrics
+        * chunk (int): Number of frames kept in memory before they are flushed
+    """
+
+    FRAME_DTYPE = [("t", np.float64), ("read_ms", np.float32), ("write_ms", np.float32)]
+
+    def __init__(self, path, samplers=None, interval=1.0, chunk=4096):
+        self._path = path
+        self._samplers = samplers or {}
+        self._interval = interval
+        self.histograms = {"read_ms": LatencyHistogram(), "write_ms": LatencyHistogram()}
+        self._frames = ColumnarFile(os.path.join(path, "frames"), self.FRAME_DTYPE, chunk=chunk)
+        self._system = ColumnarFile(
+            os.path.join(path, "system"),
+            [("t", np.float64)] + [(name, np.float32) for name in self._samplers],
+            chunk=max(1, int(60 / interval))
+        )
+        self._start_time = time.time()
+        self._stop = threading.Event()
+        self._sampler = None
+        if self._samplers:
+            self._sampler = threading.Thread(target=self._sample, name="cv2cuda-recorder", daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            values = []
+            for name, sampler in self._samplers.items():
+                try:
+                    value = sampler()
+                except Exception as error:
+                    logger.debug(f"Sampling {name} failed: {error}")
+                    value = None
+                values.append(np.nan if value is None else value)
+            self._system.append(time.time() - self._start_time, *values)
+
+    def record(self, t, read_ms, write_ms):
+        """
+        Store the timings of one frame. t is the time of the frame relative to the start of the recording.
+        The histograms are updated right away, so their percentiles include this frame
+        """
+        read_ms = math.nan if read_ms is None else read_ms
+        write_ms = math.nan if write_ms is None else write_ms
+        self._frames.append(t, read_ms, write_ms)
+        self.histograms["read_ms"].add_one(read_ms)
+        self.histograms["write_ms"].add_one(write_ms)
+
+    def flush(self):
+        self._frames.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.flush()
+        self._system.flush()
+        with open(os.path.join(self._path, "histograms.json"), "w") as filehandle:
+            json.dump({name: histogram.summary() for name, histogram in self.histograms.items()}, filehandle)
+
+
+def load_profile(path):
+    """
+    Return the frames and system records of a profile written by MetricsRecorder
+    """
+    return {
+        "frames": load_columns(os.path.join(path, "frames")),
+        "system": load_columns(os.path.join(path, "system")),
+    }
@@ -1,4 +1,5 @@
 import logging
+import math
 import time
 
 try:
@@ -9,28 +10,120 @@ except ModuleNotFoundError:
 import cv2
 
 from cv2cuda.decorator import timeit
+from cv2cuda.ffmpeg_process import FFMPEG, PIX_FMT_CHANNELS
+from cv2cuda import probe
+from cv2cuda.index import load_index, nearest_keyframe
+
+PATTERNS = ["noise", "blobs"]
+# sleep until this many seconds before a frame is due, and spin for the rest
+# (yielding the GIL on every turn, so other threads keep running)
+SPIN_TIME = 0.001
+
+
+def noise_bank(size, height, width, rng):
+    return rng.integers(0, 256, (size, height, width), dtype=np.uint8)
+
+
+def blobs_bank(size, height, width, rng, nblobs=10, radius=None):
+    """
+    Bright discs moving over a dark background. Every blob goes around an ellipse once every size frames,
+    so the bank loops without a jump
+    """
+    if radius is None:
+        radius = max(2, min(height, width) // 40)
+
+    centers = rng.uniform((0, 0), (width, height), (nblobs, 2))
+    axes = rng.uniform(0.05, 0.25, (nblobs, 2)) * (width, height)
+    phases = rng.uniform(0, 2 * np.pi, nblobs)
+
+    bank = np.full((size, height, width), 30, np.uint8)
+    for i in range(size):
+        angle = phases + 2 * np.pi * i / size
+        for (x, y) in centers + axes * np.stack([np.cos(angle), np.sin(angle)], axis=1):
+            cv2.circle(bank[i], (int(x) % width, int(y) % height), radius, 200, -1)
+    return bank
+
+
+def load_bank(source, height=None, width=None):
+    """
+    Memory map the frames of a .npy file (shape (n, height, width[, channels]))
+    or of a raw file of uint8 gray frames with the passed height and width
+    """
+    if source.endswith(".npy"):
+        bank = np.load(source, mmap_mode="r")
+    else:
+        if height is None or width is None:
+            raise Exception(f"The width and height of the frames in {source} must be set")
+        bank = np.memmap(source, dtype=np.uint8, mode="r").reshape(-1, height, width)
+
+    if bank.ndim not in (3, 4):
+        raise Exception(f"{source} should contain an array of frames, not an array of shape {bank.shape}")
+    return bank
+
 
 class VideoCapture:
     """
     A simulated cv2.VideoCapture class with ability to set FPS
-    Useful for testing
+    Useful for testing. If idx is a path, a FFMPEGVideoCapture of the file is returned instead
+
+    The frames come from a bank computed (or memory mapped) before the first read,
+    so producing a frame costs nothing and benchmarks measure the consumer, not the camera.
+    Frame n is due at t0 + n / fps, where t0 is the time of the first read, so the framerate does not drift.
+    If the consumer is late, due frames are returned right away
+
+    Arguments:
+        * idx (int): Camera index, seeds the random patterns
+        * pattern (str): noise or blobs (moving discs), ignored if source is passed
+        * source (str): Path to a .npy or raw file with frames to replay
+        * bank_size (int): Number of frames generated for the pattern. They are played in a loop
+        * loop (bool): If False, read fails after the last frame of source
+        * jitter (float): Max seconds each frame is delivered before or after it is due
+        * drop_rate (float): Probability of dropping a frame (at least 0, less than 1). Dropped frames are skipped and counted in dropped
+        * seed (int): Seed of the patterns, jitter and drops. By default idx
     """
 
-    def __init__(self, idx):
+    def __new__(cls, idx, *args, **kwargs):
+        # cv2cuda.VideoCapture("video.mp4") decodes the file with ffmpeg, like cv2.VideoCapture
+        if isinstance(idx, str):
+            return FFMPEGVideoCapture(idx, *args, **kwargs)
+        return super().__new__(cls)
+
+    def __init__(self, idx, pattern="noise", source=None, bank_size=8, loop=True, jitter=0.0, drop_rate=0.0, seed=None):
+        if pattern not in PATTERNS:
+            raise Exception(f"pattern must be one of {PATTERNS}, not {pattern}")
+        if not 0 <= drop_rate < 1:
+            raise Exception(f"drop_rate must be at least 0 and less than 1, not {drop_rate}")
+
         self._idx = idx
         self._last_frame = None
-        self._last_time = 0
         self._fps = 30
         self._width = None
         self._height = None
+        self._pattern = pattern
+        self._source = source
+        self._bank_size = bank_size
+        self._loop = loop
+        self._jitter = jitter
+        self._drop_rate = drop_rate
+        self._rng = np.random.default_rng(idx if seed is None else seed)
+
+        self._bank = None
+        self._t0 = None
+        # index of the next frame
+        self._n = 0
+        self.dropped = 0
+        # time at which the last frame was due
+        self.timestamp = None
 
 
     def set(self, prop, value):
 
         if prop == cv2.CAP_PROP_FRAME_WIDTH:
-            self._width = value
+            self._width = int(value)
+            self._bank = None
         elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
-            self._height = value
+            self._height = int(value)
+            self._bank = None
 
         elif prop == cv2.CAP_PROP_FPS:
             self._fps = value
@@ -39,35 +132,229 @@ class VideoCapture:
             logging.warning("This is a simulated camera")
 
     def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self._width
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self._height
+        elif prop == cv2.CAP_PROP_FPS:
+            return self._fps
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            return self._n
+        elif prop == cv2.CAP_PROP_FRAME_COUNT and self._source is not None:
+            return len(self._get_bank())
+
         logging.warning("This is a simulated camera")
         return None
 
+    def _get_bank(self):
+        if self._bank is None:
+            if self._source is not None:
+                self._bank = load_bank(self._source, self._height, self._width)
+                self._height, self._width = self._bank.shape[1:3]
+            else:
+                assert self._height is not None
+                assert self._width is not None
+                if self._pattern == "noise":
+                    self._bank = noise_bank(self._bank_size, self._height, self._width, self._rng)
+                else:
+                    self._bank = blobs_bank(self._bank_size, self._height, self._width, self._rng)
+                # the same arrays are returned again and again
+                self._bank.flags.writeable = False
+        return self._bank
+
+    def _wait(self, due):
+        remaining = due - time.time()
+        if remaining > SPIN_TIME:
+            time.sleep(remaining - SPIN_TIME)
+        while time.time() < due:
+            time.sleep(0)
+
     @timeit
     def read(self):
 
-        assert self._height is not None
-        assert self._width is not None
         assert self._fps is not None
-        
-        ret = True
-        now = time.time()
-        
-        while not (now - self._last_time) > (1 / self._fps):
-            time.sleep(0.001)
-            now = time.time()
-
-        try:
-
-            self._last_frame = np.random.randint(0, 256, (self._height, self._width), np.uint8)
-            self._last_time = now
-            ret = True
-        except:
-            frame = None
-            ret = False
-            
-        return ret, self._last_frame
+        bank = self._get_bank()
+
+        if self._t0 is None:
+            self._t0 = time.time()
+
+        while self._drop_rate and self._rng.random() < self._drop_rate:
+            self._n += 1
+            self.dropped += 1
+
+        if not self._loop and self._n >= len(bank):
+            return False, None
+
+        due = self._t0 + self._n / self._fps
+        if self._jitter:
+            self._wait(due + self._rng.uniform(-self._jitter, self._jitter))
+        else:
+            self._wait(due)
+
+        self._last_frame = bank[self._n % len(bank)]
+        self.timestamp = due
+        self._n += 1
+        return True, self._last_frame
 
     def release(self):
+        self._bank = None
         return
 
 
+class FFMPEGVideoCapture:
+    """
+    A cv2.VideoCapture of a video file decoded by an ffmpeg subprocess, which pipes raw frames to Python.
+    Frames are read straight into preallocated buffers, and gray videos stay gray:
+    there is no conversion to BGR unless pix_fmt asks for it
+
+    A frame returned by read is overwritten buffers reads later, copy it to keep it for longer,
+    or pass your own image to read
+
+    Arguments:
+        * filename (str): Path to the video
+        * pix_fmt (str): Pixel format of the decoded frames, one of cv2cuda.ffmpeg_process.PIX_FMT_CHANNELS
+        * hwaccel (str): ffmpeg hardware decoder, like cuda. By default, decoding runs on the cpu
+        * crop (tuple): x, y, width, height of the region of the frames to keep, cropped by ffmpeg
+        * size (tuple): width, height the (cropped) frames are scaled to by ffmpeg
+        * buffers (int): Number of preallocated frames read cycles through
+        * index (bool): If True, seeking uses the keyframe index of the video (cv2cuda.index),
+        which is built and saved the first time if the video has none
+    """
+
+    def __init__(self, filename, pix_fmt="gray", hwaccel=None, crop=None, size=None, buffers=2, index=True):
+        self._filename = filename
+        self._use_index = index
+        self._index = None
+        self._pix_fmt = pix_fmt
+        self._hwaccel = hwaccel
+        self._info = probe.video_info(filename)
+        self._fps = self._info["fps"]
+
+        vf = []
+        width, height = self._info["width"], self._info["height"]
+        if crop is not None:
+            x, y, width, height = crop
+            vf.append(f"crop={width}:{height}:{x}:{y}")
+        if size is not None:
+            width, height = size
+            vf.append(f"scale={width}:{height}")
+        self._vf = vf
+        self._width = width
+        self._height = height
+
+        channels = PIX_FMT_CHANNELS[pix_fmt]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        self._buffers = [np.empty(shape, np.uint8) for _ in range(buffers)]
+        # index of the next frame
+        self._n = 0
+        self._ffmpeg = None
+        self._open(0)
+
+    def _open(self, frame, start=None, start_pts=None):
+        if self._ffmpeg is not None:
+            self._ffmpeg.kill()
+            self._ffmpeg.wait()
+
+        if start is None:
+            start = frame / self._fps
+
+        self._ffmpeg = FFMPEG(
+            self._width, self._height, self._fps, self._filename, encode=False, pix_fmt=self._pix_fmt,
+            hwaccel=self._hwaccel, vf=self._vf, start=start, start_pts=start_pts, progress=False
+        )
+        self._n = frame
+
+    def _get_index(self):
+        if self._index is None and self._use_index:
+            try:
+                self._index = load_index(self._filename)
+            except Exception as error:
+                logging.warning(f"Could not index {self._filename}, seeking by time: {error}")
+                self._use_index = False
+        return self._index
+
+    def _seek(self, frame):
+        """
+        Make frame the next frame returned by read
+        """
+        index = self._get_index()
+        if index is None or frame >= len(index):
+            self._open(frame)
+            return
+
+        keyframe = nearest_keyframe(index, frame)
+        if self._ffmpeg is not None and keyframe <= self._n <= frame:
+            # no keyframe in between, decoding the frames in between is as fast as a seek
+            while self._n < frame and self.read(self._buffers[0])[0]:
+                pass
+            return
+
+        if frame == 0:
+            self._open(0)
+            return
+
+        pts = index["pts"]
+        # ffmpeg jumps to the keyframe nearest to start (rounded up to the microsecond it is passed with)
+        start = math.ceil((pts[keyframe] - pts[0]) * 1e6) / 1e6
+        # and the frames before this one are dropped by timestamp
+        self._open(frame, start=start, start_pts=(pts[frame - 1] + pts[frame]) / 2)
+
+    def isOpened(self):
+        return self._ffmpeg is not None
+
+    def read(self, image=None):
+        """
+        Return True and the next frame, or False and None at the end of the video
+        """
+        if self._ffmpeg is None:
+            return False, None
+
+        if image is None:
+            image = self._buffers[self._n % len(self._buffers)]
+
+        if not self._ffmpeg.read_into(image):
+            return False, None
+
+        self._n += 1
+        return True, image
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self._width
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self._height
+        elif prop == cv2.CAP_PROP_FPS:
+            return self._fps
+        elif prop == cv2.CAP_PROP_FRAME_COUNT:
+            if self._index is not None:
+                return len(self._index)
+            return self._info["frame_count"]
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            return self._n
+        elif prop == cv2.CAP_PROP_POS_MSEC:
+            return 1000 * self._n / self._fps
+
+        logging.warning(f"Property {prop} is not supported by FFMPEGVideoCapture")
+        return None
+
+    def set(self, prop, value):
+        """
+        Only CAP_PROP_POS_FRAMES and CAP_PROP_POS_MSEC can be set.
+        ffmpeg is restarted at the frame, unless it can be reached by reading forward within the current GOP
+        """
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            frame = int(value)
+        elif prop == cv2.CAP_PROP_POS_MSEC:
+            frame = int(round(value * self._fps / 1000))
+        else:
+            logging.warning(f"Property {prop} cannot be set in FFMPEGVideoCapture")
+            return False
+
+        self._seek(frame)
+        return True
+
+    def release(self):
+        if self._ffmpeg is not None:
+            self._ffmpeg.kill()
+            self._ffmpeg.wait()
+            self._ffmpeg = None
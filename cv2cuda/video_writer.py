@@ -3,47 +3,120 @@ import math
 import time
 import logging
 
-import psutil
 import cv2
+import numpy as np
 import multiprocessing
-import subprocess
-import signal
-
-from cv2cuda.ffmpeg_process import FFMPEG
+import threading
+import concurrent.futures
+
+from cv2cuda.ffmpeg_process import FFMPEG, Output, FFMPEG_BINARY, PIX_FMT_CHANNELS, CHANNELS_PIX_FMT
+from cv2cuda import probe
+from cv2cuda.rate_control import build_rate_control
+from cv2cuda.frame_ring import FrameRing, SpillRing
+from cv2cuda.index import save_index
+from cv2cuda.timestamps import TimestampLog
+from cv2cuda.watchdog import EncoderWatchdog
 from cv2cuda.decorator import timeit
 
 
 logger = logging.getLogger(__name__)
 check_log = logging.getLogger(__name__ + ".check")
 
-def is_process_running(self, process_name):
-    p = subprocess.Popen(['ps', '-A'], stdout=subprocess.PIPE)
-    out, err = p.communicate()    
-
-    for line in out.splitlines():
-        if bytes(process_name, 'utf-8') in line:
-            pid = line.split()[0]
-            return pid
-    return False
-
-def kill_process(self):
-    logger.info('Stopping FFMPEG')
-    proc = is_process_running('ffmpeg')
-    if proc:
-        os.kill(proc, signal.SIGINT)
-        
+# cv2 conversions used when a frame does not match the pixel format ffmpeg was started with
+# (number of channels of the frame, pixel format piped to ffmpeg)
+PYTHON_CONVERSIONS = {
+    (3, "gray"): cv2.COLOR_BGR2GRAY,
+    (4, "gray"): cv2.COLOR_BGRA2GRAY,
+    (1, "bgr24"): cv2.COLOR_GRAY2BGR,
+    (4, "bgr24"): cv2.COLOR_BGRA2BGR,
+    (1, "rgb24"): cv2.COLOR_GRAY2RGB,
+    (4, "rgb24"): cv2.COLOR_BGRA2RGB,
+    (1, "bgra"): cv2.COLOR_GRAY2BGRA,
+    (3, "bgra"): cv2.COLOR_BGR2BGRA,
+    (1, "rgba"): cv2.COLOR_GRAY2RGBA,
+    (3, "rgba"): cv2.COLOR_BGR2RGBA,
+}
+
+
+class Segment:
+    """
+    One output file of a video writer,
+    with the range of frame indices (first_frame to last_frame, both included) it holds.
+    error is why its ffmpeg process failed, if it did (the file may be truncated)
+    """
+
+    def __init__(self, index, filename, first_frame):
+        self.index = index
+        self.filename = filename
+        self.first_frame = first_frame
+        self.last_frame = None
+        self.error = None
+
+    @property
+    def nframes(self):
+        if self.last_frame is None:
+            return None
+        return self.last_frame - self.first_frame + 1
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"Segment({self.index}, {self.filename}, frames {self.first_frame}-{self.last_frame}, failed: {self.error})"
+        return f"Segment({self.index}, {self.filename}, frames {self.first_frame}-{self.last_frame})"
+
+
 class FFMPEGVideoWriter:
     """
     A cv2.VideoWriter-like interface that supports FFMPEG+CUDA
     for faster and efficient encoding of videos
+
+    If async_write is True, write() copies the frame into a FrameRing of queue_size slots
+    and returns right away, while a feeder thread drains the ring into ffmpeg.
+    overflow decides what happens when the ring is full (block, drop-oldest, drop-newest)
+    and the frames_queued, frames_written and frames_dropped attributes
+    report how close the writer is to its limit.
+    With overflow spill, frames that do not fit in the ring are written to a file in spill_dir
+    and passed to ffmpeg in order when it catches up (see cv2cuda.frame_ring.SpillRing and spill_stats)
+
+    Color frames are piped as they are, with pix_fmt (bgr24 by default if isColor, gray otherwise)
+    and ffmpeg converts them to the pixel format of the encoder.
+    If the first frame does not match pix_fmt, ffmpeg is restarted with the pixel format of the frame,
+    so color frames passed to a gray writer are turned gray by ffmpeg, not in Python
+
+    If segment_frames (or segment_duration, in seconds) is passed, the output is split into
+    files of that many frames, named like filename with a _000000, _000001 ... suffix.
+    The ffmpeg process of the next segment is started in the background while the current one is written,
+    so switching files at the frame boundary does not stall write().
+    The segments attribute lists the Segment of every file with its range of frames
+
+    If a FFMPEGPool is passed, the ffmpeg processes are taken from it
+    instead of being spawned when the writer (or the segment) starts
+
+    outputs is a list of extra Output encodings (other codecs, sizes or frame ranges) of the same frames.
+    They are made by the same ffmpeg process, so write() still pipes each frame once.
+    When the recording is segmented, every segment gets its own extra outputs, with the same suffix
+
+    If index is True, the keyframe index of every file (see cv2cuda.index) is saved next to it
+    as soon as the file is closed, so it can be read back at any frame quickly
+
+    min_bitrate and max_bitrate (bits/s), and the preset, gop_duration or rate_control (a cv2cuda.rate_control.RateControl)
+    passed as extra arguments, set the rate control of the encoder. preset auto picks the best preset that keeps up on this host
+
+    If timestamps is True, the capture time of every frame (passed to write, or the time write was called)
+    and the time it took to reach ffmpeg are saved in a memory mapped sidecar next to filename (see cv2cuda.timestamps)
+
+    If watchdog is True (or a cv2cuda.watchdog.EncoderWatchdog, to share one thread between writers)
+    the ffmpeg process is checked in the background. If it exits, stops reading frames or stops encoding them,
+    it is stopped and the next frames (the ones queued included) go to a new segment
+    (named like the segments above, also when segment_frames is not passed).
+    After max_restarts failures, write raises an Exception
     """
 
     _TIMEOUT=3
     _CODEC_BURNIN_PERIOD=0 # seconds
 
-    def __init__(self, filename, apiPreference, fourcc, fps, frameSize, isColor=False, maxframes=math.inf, min_bitrate=None, max_bitrate=None, yes=True, device="gpu", **kwargs):
+    def __init__(self, filename, apiPreference, fourcc, fps, frameSize, isColor=False, maxframes=math.inf, min_bitrate=None, max_bitrate=None, yes=True, device="gpu", async_write=False, queue_size=16, overflow="block", spill_dir=None, pix_fmt=None, segment_frames=None, segment_duration=None, pool=None, outputs=None, index=False, timestamps=False, watchdog=None, max_restarts=3, **kwargs):
 
-        self._isColor = isColor # color not supported for now
+        self._isColor = isColor
         self._fourcc = fourcc
         self._apiPreference = apiPreference
         if " " in filename:
@@ -59,21 +132,40 @@ class FFMPEGVideoWriter:
         self._is_released = False
         self._max_bitrate = max_bitrate
         self._min_bitrate = min_bitrate
+        self._device = device
+        self._outputs = list(outputs or [])
+        self._index = index
+        root, extension = os.path.splitext(filename)
+        if extension == ".mp4" and fourcc == "h264_nvenc" and self._CODEC_BURNIN_PERIOD > 0:
+            # high quality copy of the first frames, while the codec warms up
+            self._outputs.append(Output(
+                f"{root}.avi", codec="mpeg4", flags="-vtag DIVX -q:v 1",
+                last_frame=int(self._CODEC_BURNIN_PERIOD * fps) - 1
+            ))
+
+        if pool is not None and self._outputs:
+            logger.warning("Prestarted ffmpeg processes cannot write extra outputs. The pool will not be used")
+            pool = None
+        self._pool = pool
+        if pix_fmt is None:
+            pix_fmt = "bgr24" if isColor else "gray"
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise Exception(f"pix_fmt must be one of {list(PIX_FMT_CHANNELS)}, not {pix_fmt}")
+        self._pix_fmt = pix_fmt
         self.must_terminate = multiprocessing.Event()
+        # an auto preset is tuned once, here, and every ffmpeg of the recording uses it
+        self._rate_control = build_rate_control(
+            fps, device=device, rate_control=kwargs.pop("rate_control", None), preset=kwargs.pop("preset", "default"),
+            min_bitrate=min_bitrate, max_bitrate=max_bitrate, gop_duration=kwargs.pop("gop_duration", None)
+        ).resolve(fourcc, width, height, fps)
         self._kwargs = kwargs
         
         self._old_processes = []
 
         self._check_deps()
 
-        ODD_WRONG=1
-
-        if width % 2 == ODD_WRONG:
-            width-=1
-
-        if height % 2 == ODD_WRONG:
-            height-=1
-
+        # odd widths and heights are cropped to even by ffmpeg,
+        # so frames reach the pipe whole and contiguous
         self._width = width
         self._height = height
 
@@ -89,14 +181,6 @@ class FFMPEGVideoWriter:
                 logger.warning(f"{filename} exists already. Overwriting.")
 
 
-        if isColor:
-            raise Exception(
-                f"""User supplied isColor={isColor}.
-                cv2cuda.VideoWriter does not support color.
-                Terminating ...
-                """
-            )
-                
         if maxframes is not math.inf:
             logger.warning(
                 f"""
@@ -112,61 +196,429 @@ class FFMPEGVideoWriter:
                 """
             )
 
-        self._ffmpeg = FFMPEG(
-            width=width, height=height, fps=fps, output=filename, device=device,
-            min_bitrate=min_bitrate, max_bitrate=max_bitrate, maxframes=self._maxframes,
-            codec=fourcc, encode=True, **self._kwargs
+        if segment_frames is None and segment_duration is not None:
+            segment_frames = int(round(segment_duration * fps))
+        self._segment_frames = segment_frames
+        self.segments = []
+        self._next_ffmpeg = None
+        self._next_filename = None
+        self._prestart_thread = None
+        self._closing = []
+        # first frame of the recording each segment starts with (or is expected to, if its ffmpeg is pre-started)
+        self._first_frames = {0: 0}
+
+        if segment_frames:
+            output = self._segment_filename(0)
+        else:
+            output = filename
+
+        if timestamps:
+            self._timestamps = TimestampLog(filename)
+        else:
+            self._timestamps = None
+
+        # only a writer that opens more than one ffmpeg (segments, restarts) keeps the pool filled
+        self._refill_pool = bool(segment_frames) or bool(watchdog)
+        self._ffmpeg = self._open_ffmpeg(output)
+        self.segments.append(Segment(0, output, first_frame=0))
+        self._prestart_next()
+
+        # (ffmpeg, reason) of a failure found by the watchdog, handled by the thread that encodes
+        self._failure = None
+        # set when release runs out of time, the frames still queued are discarded
+        self._abandoned = False
+        self._max_restarts = max_restarts
+        self._own_watchdog = watchdog is True
+        if watchdog is True:
+            watchdog = EncoderWatchdog()
+        self._watchdog = watchdog or None
+        if self._watchdog is not None:
+            self._watchdog.watch(self)
+
+        if async_write:
+            if overflow == "spill":
+                self._ring = SpillRing(queue_size, directory=spill_dir)
+            else:
+                self._ring = FrameRing(queue_size, overflow=overflow)
+            self._feeder = threading.Thread(target=self._feed, name=f"cv2cuda-feeder-{filename}", daemon=True)
+            self._feeder.start()
+        else:
+            self._ring = None
+            self._feeder = None
+
+    @staticmethod
+    def ffmpeg_kwargs(frameSize, fps, fourcc, isColor=False, pix_fmt=None, device="gpu", min_bitrate=None, max_bitrate=None, maxframes=math.inf, preset="default", gop_duration=None, rate_control=None, **kwargs):
+        """
+        Arguments (all but the output) passed to FFMPEG by a writer with these settings.
+        Useful to prewarm a FFMPEGPool for a writer that does not exist yet.
+        The rate control is passed as a RateControl, with an auto preset already tuned
+        """
+        width, height = frameSize
+        if pix_fmt is None:
+            pix_fmt = "bgr24" if isColor else "gray"
+        rate_control = build_rate_control(
+            fps, device=device, rate_control=rate_control, preset=preset,
+            min_bitrate=min_bitrate, max_bitrate=max_bitrate, gop_duration=gop_duration
+        ).resolve(fourcc, width, height, fps)
+
+        return dict(
+            width=width, height=height, fps=fps, device=device,
+            rate_control=rate_control, maxframes=maxframes,
+            codec=fourcc, encode=True, pix_fmt=pix_fmt,
+            output_pix_fmt=None if isColor else "gray",
+            **kwargs
         )
 
-        _filename, extension = os.path.splitext(filename)
-        if extension == ".mp4" and fourcc == "h264_nvenc":
-            self._hq_video_writer = cv2.VideoWriter(
-                f"{_filename}.avi",
-                cv2.VideoWriter_fourcc(*"DIVX"),
-                frameSize=(width, height),
-                fps=fps,
-                isColor=False,
+    def _extra_outputs(self, index):
+        """
+        Extra outputs of the ffmpeg of segment index. Their frame ranges refer to the whole recording,
+        so they are made relative to the first frame of the segment, and outputs whose range is not in the segment are left out
+        """
+        if index == 0 and not self._segment_frames:
+            return tuple(self._outputs)
+
+        # segments that were not started yet begin where the previous ones end
+        first_frame = self._first_frames.get(index, index * (self._segment_frames or 0))
+        if self._segment_frames:
+            last_frame = first_frame + self._segment_frames - 1
+        else:
+            last_frame = None
+
+        outputs = []
+        for extra in self._outputs:
+            root, extension = os.path.splitext(extra.filename)
+            clipped = extra.clipped(f"{root}_{str(index).zfill(6)}{extension}", first_frame, last_frame)
+            if clipped is not None:
+                outputs.append(clipped)
+        return tuple(outputs)
+
+    def _open_ffmpeg(self, output, index=0):
+        ffmpeg_kwargs = self.ffmpeg_kwargs(
+            self._frameSize, self._fps, self._fourcc, isColor=self._isColor, pix_fmt=self._pix_fmt,
+            device=self._device, rate_control=self._rate_control, maxframes=self._maxframes, **self._kwargs
+        )
+        if self._outputs:
+            ffmpeg_kwargs["outputs"] = self._extra_outputs(index)
+        if self._pool is None:
+            return FFMPEG(output=output, **ffmpeg_kwargs)
+        else:
+            return self._pool.acquire(output, refill=self._refill_pool, **ffmpeg_kwargs)
+
+    def _match_pix_fmt(self, image):
+        """
+        Make sure the frame can be piped to ffmpeg with the pixel format ffmpeg expects
+        """
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        if channels == PIX_FMT_CHANNELS[self._pix_fmt]:
+            return image
+
+        nothing_written = self._count == 0 and (self._ring is None or self._ring.enqueued == 0)
+        if nothing_written and channels in CHANNELS_PIX_FMT:
+            # declare the format of the frames to ffmpeg and let it do the conversion
+            logger.warning(
+                f"Frames with {channels} channels passed to a writer expecting {self._pix_fmt}."
+                f" Restarting ffmpeg with pix_fmt {CHANNELS_PIX_FMT[channels]}"
             )
-            self._hq_video_writer_open = True
+            self._ffmpeg.kill()
+            self._ffmpeg.wait()
+            self._discard_next()
+            self._pix_fmt = CHANNELS_PIX_FMT[channels]
+            self._ffmpeg = self._open_ffmpeg(self.segments[-1].filename, self.segments[-1].index)
+            self._prestart_next()
+            return image
+
+        if not self._already_warned:
+            logger.warning(
+                f"""
+                Frames with {channels} channels do not match the pixel format of the video ({self._pix_fmt})
+                I will convert them in Python now, which may add computational time which could be spared
+                """
+            )
+            self._already_warned = True
 
-        else:
-            self._hq_video_writer = None
-            self._hq_video_writer_open = False
+        code = PYTHON_CONVERSIONS.get((channels, self._pix_fmt))
+        if code is None:
+            raise Exception(f"Cannot convert frames with {channels} channels to {self._pix_fmt}")
+        return cv2.cvtColor(image, code)
 
     def ensure_size(self, img):
+        # a no-op view for frames of the declared frameSize
         return img[:self._height, :self._width]
 
 
     def __str__(self):
         return self._filename
 
+    @property
+    def frames_written(self):
+        """
+        Number of frames passed to ffmpeg
+        """
+        return self._count
+
+    @property
+    def frames_copied(self):
+        """
+        Number of frames that had to be copied before reaching the ffmpeg pipe
+        (only non contiguous frames whose rows are not contiguous either)
+        """
+        return self._ffmpeg.copies
+
+    @property
+    def frames_queued(self):
+        """
+        Number of frames waiting in the ring to be passed to ffmpeg
+        """
+        if self._ring is None:
+            return 0
+        return self._ring.queued
+
+    @property
+    def spill_stats(self):
+        """
+        Frames in memory and on disk, bytes spilled and the last catch up time of a spill ring
+        (None with other overflow policies)
+        """
+        if not isinstance(self._ring, SpillRing):
+            return None
+        return self._ring.stats()
+
+    @property
+    def frames_dropped(self):
+        """
+        Number of frames discarded because the ring was full
+        """
+        if self._ring is None:
+            return 0
+        return self._ring.dropped
+
+    @property
+    def stats(self):
+        """
+        Live cv2cuda.progress.EncoderStats of the ffmpeg encoding the current segment,
+        or None if ffmpeg does not report its progress
+        """
+        return getattr(self._ffmpeg, "stats", None)
+
+    @property
+    def encoder_lag(self):
+        """
+        Frames piped to the current ffmpeg but not encoded yet, as of the last progress report.
+        If it keeps growing, the encoder is falling behind and the pipe will eventually fill up
+        """
+        stats = self.stats
+        if stats is None:
+            return None
+        return self._ffmpeg.frames_written - stats.frame
+
+    @property
+    def restarts(self):
+        """
+        Number of times ffmpeg failed and the recording went on in a new segment
+        """
+        return sum(segment.error is not None for segment in self.segments)
+
+    def _segment_filename(self, index):
+        root, extension = os.path.splitext(self._filename)
+        return f"{root}_{str(index).zfill(6)}{extension}"
+
+    def _prestart_next(self):
+        """
+        Start the ffmpeg process of the next segment in the background
+        """
+        if not self._segment_frames:
+            return
 
-    @timeit
-    def write(self, image):
-            
-        if len(image.shape) == 3:
-            if not self._already_warned:
-                logger.warning(
-                    """
-                    Color frames are not supported, please provide gray images to remove this warning
-                    I will force the frames gray now, which may add computational time which could be spared
-                    """
-                )
-                self._already_warned = True
+        index = len(self.segments)
+        self._next_filename = self._segment_filename(index)
+        self._first_frames[index] = self.segments[-1].first_frame + self._segment_frames
 
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        def prestart():
+            self._next_ffmpeg = self._open_ffmpeg(self._next_filename, index)
 
+        self._prestart_thread = threading.Thread(target=prestart, name=f"cv2cuda-prestart-{self._next_filename}", daemon=True)
+        self._prestart_thread.start()
+
+    def _discard_next(self):
+        """
+        Stop the pre-started ffmpeg process, if any, and remove its output
+        """
+        if self._prestart_thread is None:
+            return
+        self._prestart_thread.join()
+        self._prestart_thread = None
+        if self._next_ffmpeg is not None:
+            self._next_ffmpeg.kill()
+            self._next_ffmpeg.wait()
+            self._next_ffmpeg = None
+            if os.path.exists(self._next_filename):
+                os.remove(self._next_filename)
+
+    def _rotate(self):
+        """
+        Switch to the next segment. The old ffmpeg process is closed in the background
+        """
+        old_ffmpeg = self._ffmpeg
+        self.segments[-1].last_frame = self._count - 1
+        logger.info(f"Closing {self.segments[-1]}")
+
+        index = len(self.segments)
+        if self._prestart_thread is not None:
+            self._prestart_thread.join()
+            self._prestart_thread = None
+        ranged = any(extra.first_frame is not None or extra.last_frame is not None for extra in self._outputs)
+        if self._next_ffmpeg is not None and ranged and self._first_frames.get(index) != self._count:
+            # pre-started for a segment starting at another frame (this is a restart),
+            # so its extra outputs would keep the wrong frames
+            self._next_ffmpeg.kill()
+            self._next_ffmpeg.wait()
+            self._next_ffmpeg = None
+        elif self._next_ffmpeg is None and self._segment_frames:
+            logger.warning(f"ffmpeg for {self._next_filename} was not ready. Starting it now")
+        if self._next_ffmpeg is None:
+            self._first_frames[index] = self._count
+            self._next_ffmpeg = self._open_ffmpeg(self._next_filename, index)
+
+        self._ffmpeg = self._next_ffmpeg
+        self._next_ffmpeg = None
+        self.segments.append(Segment(len(self.segments), self._next_filename, first_frame=self._count))
+        self._next_filename = None
+
+        closer = threading.Thread(
+            target=self._finish, args=(old_ffmpeg, self.segments[-2]),
+            name=f"cv2cuda-close-{self.segments[-2].filename}", daemon=True
+        )
+        closer.start()
+        self._closing.append((closer, old_ffmpeg))
+        self._prestart_next()
+
+    def _finish(self, ffmpeg, segment, timeout=None):
+        """
+        Wait for ffmpeg to close the file of the segment, and index it
+        """
+        ffmpeg.close(timeout=timeout)
+        if self._index:
+            try:
+                save_index(segment.filename)
+            except Exception as error:
+                logger.warning(f"Could not index {segment.filename}: {error}")
+
+    def _on_failure(self, ffmpeg, reason):
+        """
+        Called by the watchdog when ffmpeg fails. ffmpeg is stopped in the background,
+        and the thread that encodes switches to a new segment before its next write
+        """
+        if ffmpeg is not self._ffmpeg or (self._failure is not None and self._failure[0] is ffmpeg):
+            return
+        logger.warning(f"{self.segments[-1]} failed: {reason}")
+        self._failure = (ffmpeg, reason)
+        threading.Thread(target=ffmpeg.stop, name=f"cv2cuda-stop-{self.segments[-1].filename}", daemon=True).start()
+
+    def _recover(self, broken=False):
+        """
+        Restart if the watchdog found ffmpeg failed, or if broken (ffmpeg closed the pipe)
+        """
+        failure, self._failure = self._failure, None
+        if failure is not None and failure[0] is self._ffmpeg:
+            self._restart(failure[1])
+        elif broken:
+            self._restart("ffmpeg closed the pipe")
+
+    def _restart(self, reason):
+        """
+        Close the segment of the failed ffmpeg and go on in a new one
+        """
+        self.segments[-1].error = reason
+        if self.restarts > self._max_restarts:
+            raise Exception(f"ffmpeg failed {self.restarts} times recording {self._filename}. Last error: {reason}")
+
+        logger.warning(f"Recording {self._filename} from frame {self._count} in a new segment")
+        if self._next_filename is None:
+            self._next_filename = self._segment_filename(len(self.segments))
+        self._rotate()
+
+    def _encode(self, image, stamp=None):
+        if self._watchdog is not None:
+            self._recover()
+        if self._segment_frames and self._count - self.segments[-1].first_frame >= self._segment_frames:
+            self._rotate()
+        written = self._ffmpeg.write(image)
+        while not written and self._watchdog is not None and not self._abandoned:
+            self._recover(broken=True)
+            written = self._ffmpeg.write(image)
+        if not written:
+            # ffmpeg is gone, the frame is lost
+            return
+        if self._timestamps is not None and stamp is not None:
+            timestamp, write_time = stamp
+            self._timestamps.record(self._count, timestamp, 1000 * (time.time() - write_time))
+        self._count += 1
+
+    def _encode_many(self, frames, stamp=None):
+        """
+        Pipe a stack of frames, in one block per segment
+        """
+        if self._watchdog is not None:
+            self._recover()
+        start = 0
+        while start < len(frames):
+            if self._segment_frames:
+                room = self._segment_frames - (self._count - self.segments[-1].first_frame)
+                if room <= 0:
+                    self._rotate()
+                    room = self._segment_frames
+            else:
+                room = len(frames)
+
+            block = frames[start:start+room]
+            if not self._ffmpeg.write_many(block):
+                if self._watchdog is None or self._abandoned:
+                    # ffmpeg is gone, the frames are lost
+                    return
+                # the frames of the block go to the next segment
+                self._recover(broken=True)
+                continue
+            if self._timestamps is not None and stamp is not None:
+                timestamps, write_time = stamp
+                latency = 1000 * (time.time() - write_time)
+                for i in range(len(block)):
+                    self._timestamps.record(self._count + i, timestamps[start + i], latency)
+            self._count += len(block)
+            start += len(block)
+
+    def _feed(self):
+        while True:
+            index = self._ring.get()
+            if index is None:
+                break
+            try:
+                if not self._abandoned:
+                    self._encode(self._ring.slot(index), self._ring.stamp(index))
+            finally:
+                self._ring.release(index)
+
+
+    @timeit
+    def write(self, image, timestamp=None):
+        """
+        Pipe a frame to ffmpeg (or queue it, if async_write is True)
+
+        Arguments:
+            * image (np.ndarray): The frame
+            * timestamp (float): Capture time of the frame, saved in the timestamps sidecar.
+            By default, the time write is called
+        """
+        write_time = time.time()
+        if timestamp is None:
+            timestamp = write_time
+
+        image = self._match_pix_fmt(image)
         image = self.ensure_size(image)
         # image=cv2.putText(image, str(self._count), (image.shape[0] // 2, image.shape[1] // 2), cv2.FONT_HERSHEY_SIMPLEX, 20, 0, 10)
-        self._ffmpeg.write(image)
-        if self._hq_video_writer and self._count < (self._CODEC_BURNIN_PERIOD * self._fps):
-            self._hq_video_writer.write(image)
-        elif self._hq_video_writer_open:
-            self._hq_video_writer.release()
-            self._hq_video_writer_open = False
+        if self._ring is None:
+            self._encode(image, (timestamp, write_time))
         else:
-            pass
-            # print(f"maxframes {self._maxframes} not reached. current {self._count}")
+            self._ring.put(image, stamp=(timestamp, write_time))
 
         # for i in range(len(self._old_processes)):
         #     ffmpeg, stop_time = self._old_processes[i]
@@ -178,73 +630,169 @@ class FFMPEGVideoWriter:
         #             self._is_released = True
         #             print(f"cv2cuda wrote {self._count} frames")
 
+    @timeit
+    def write_many(self, frames, timestamps=None):
+        """
+        Write a stack of frames, an array of shape (n, height, width[, channels]).
+        Shape and pixel format are checked once, and the frames are piped to ffmpeg
+        in as few writes as possible (one, if the array is contiguous and of frameSize)
+
+        Frames and segments are counted like with write. In async mode, the frames go through the ring one by one.
+        timestamps has the capture time of every frame, by default they all take the time write_many is called
+        """
+        write_time = time.time()
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return
+        if frames.dtype != np.uint8:
+            raise Exception(f"Frames must be uint8, not {frames.dtype}")
+        if frames.ndim not in (3, 4):
+            raise Exception(f"frames must have shape (n, height, width[, channels]), not {frames.shape}")
+        if frames.shape[1] < self._height or frames.shape[2] < self._width:
+            raise Exception(
+                f"Frames of {frames.shape[2]}x{frames.shape[1]} are smaller than the frameSize of the video ({self._width}x{self._height})"
+            )
+        if timestamps is None:
+            timestamps = [write_time] * len(frames)
+        elif len(timestamps) != len(frames):
+            raise Exception(f"{len(timestamps)} timestamps passed for {len(frames)} frames")
+
+        first = frames[0]
+        if self._match_pix_fmt(first) is not first:
+            # the frames are converted by cv2, one by one
+            for image, timestamp in zip(frames, timestamps):
+                self.write.unwrapped(self, image, timestamp)
+            return
+
+        frames = frames[:, :self._height, :self._width]
+        if self._ring is None:
+            self._encode_many(frames, (timestamps, write_time))
+        else:
+            for image, timestamp in zip(frames, timestamps):
+                self._ring.put(image, stamp=(timestamp, write_time))
+
     def _check_cuda(self):
-        logger.warning("CUDA checks not implemented yet")
-        return
-    
+        """
+        Make sure ffmpeg can use CUDA
+        """
+        if self._device != "gpu":
+            return
+
+        if "cuda" not in probe.probe()["hwaccels"]:
+            raise Exception(
+                f"""{FFMPEG_BINARY} does not support CUDA hardware acceleration.
+                Pass device=cpu or set CV2CUDA_FFMPEG_BINARY to an ffmpeg built with CUDA support
+                """
+            )
 
     def _check_ffmpeg(self):
-        logger.warning("FFMPEG checks not implemented yet")
-        return
+        """
+        Make sure the encoder exists and a short test encode with it works,
+        instead of finding out from an empty output file
+        """
+        preset = self._rate_control.preset
 
+        if not probe.encoder_works(self._fourcc, preset=preset):
+            raise Exception(
+                f"""{FFMPEG_BINARY} cannot encode with {self._fourcc} (preset {preset}).
+                Run cv2cuda.probe.select_encoder() to find an encoder that works on this host
+                """
+            )
 
     def _check_deps(self):
-        # TODO
-        # Write some code that
-        # 1. Checks ffmpeg is installed and can be called with the syntax
-        # ffmpeg -y -loglevel warning -r 40.0 -f rawvideo -pix_fmt gray -vsync 0 -extra_hw_frames 2 -s NxM \ 
-        #   -i - -an -c:v h264_nvenc video.mp4
-        # 2. Checks that the right CUDA drivers are installed (so ffmpeg can use them)
-
-        # For now, the user really checks if this is fine just by running the program
-        # and checking if an error immediately pops up
-        
-        pass
-        # self._check_ffmpeg()
-        # self._check_cuda()
+        # the results are cached on disk, so this only calls ffmpeg
+        # the first time a binary and encoder are used
+        self._check_ffmpeg()
+        self._check_cuda()
 
-
-    
     def _check_terminated(self):
+        """
+        True if the ffmpeg process of the current segment (looked up by its PID) has exited
+        """
         check_log.debug(self._ffmpeg._command)
         check_log.debug(self._count)
 
-        for process in psutil.process_iter():
-            process_line = " ".join(process.cmdline())            
-            if self._ffmpeg._command == process_line:
-                msg = f"{self._ffmpeg._command} is stuck"
-                # assert False, msg
-                check_log.warning(msg)
-                return False
-        
+        if self._ffmpeg.poll() is None:
+            msg = f"{self._ffmpeg._command} (pid {self._ffmpeg.pid}) is stuck"
+            check_log.warning(msg)
+            return False
+
         return True
 
-    def release(self, force=True):
+    def release(self, force=True, block=True, timeout=None):
+        """
+        Pipe the frames still queued, close ffmpeg and wait for every file of the recording to be finalized
+
+        Arguments:
+            * block (bool): If False, the files are finalized by a background thread
+            and a concurrent.futures.Future, which resolves to the list of segments, is returned right away
+            * timeout (float): Seconds the release can take, the frames still queued included.
+            Then ffmpeg is sent SIGTERM (and later SIGKILL) and what was not piped yet is discarded.
+            By default it is given all the time it needs
+
+        Returns the list of segments (or the Future, if block is False)
+        """
         self.must_terminate.set()
-        if force and not self._is_released:
-            print("Executing video writer release()")
-            # self._old_processes.append((self._ffmpeg, time.time()))
-            print(self._ffmpeg._process.communicate())
-            before=time.time()
-            self._ffmpeg._process.wait()
-            after=time.time()
-            print(f"Waited {after-before} seconds")
-            return
-            # while True:
-            #     print(self._ffmpeg._process.communicate())
-            #     # print(dir(self._ffmpeg._process.stdin))
-            #     print(self._ffmpeg._process.stdin)
-            #     print(self._ffmpeg._process.stdout)
-                
-            #     # print(dir(self._ffmpeg._process.stdout))
-            #     time.sleep(1)
-            
-            
-            # self._ffmpeg.terminate()
-            # del self._ffmpeg._process
-            # del self._ffmpeg
-            # self._is_released = True
-            # print(f"cv2cuda wrote {self._count} frames")
+        if not force or self._is_released:
+            if block:
+                return self.segments
+            future = concurrent.futures.Future()
+            future.set_result(self.segments)
+            return future
+
+        self._is_released = True
+        if block:
+            return self._release(timeout)
+
+        future = concurrent.futures.Future()
+        def release():
+            try:
+                future.set_result(self._release(timeout))
+            except Exception as error:
+                future.set_exception(error)
+
+        threading.Thread(target=release, name=f"cv2cuda-release-{self._filename}", daemon=True).start()
+        return future
+
+    def _release(self, timeout):
+        # the timeout covers the whole release, draining the ring included
+        deadline = None if timeout is None else time.time() + timeout
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.time())
+
+        if self._ring is not None:
+            # let the feeder drain the frames still queued
+            self._ring.close()
+            self._feeder.join(remaining())
+            if self._feeder.is_alive():
+                logger.warning(
+                    f"ffmpeg did not take the frames queued for {self._filename} in {timeout} seconds."
+                    f" Stopping it and discarding {self._ring.queued} frames"
+                )
+                self._abandoned = True
+                # the write the feeder is blocked in fails with a broken pipe once ffmpeg is gone
+                self._ffmpeg.stop()
+                self._feeder.join()
+        if self._watchdog is not None:
+            # closing ffmpeg is not a failure
+            self._watchdog.unwatch(self)
+            if self._own_watchdog:
+                self._watchdog.close()
+        self._discard_next()
+        self.segments[-1].last_frame = self._count - 1
+
+        before = time.time()
+        if self._timestamps is not None:
+            self._timestamps.close()
+        self._finish(self._ffmpeg, self.segments[-1], timeout=remaining())
+        for closer, ffmpeg in self._closing:
+            closer.join(remaining())
+            if closer.is_alive():
+                logger.warning(f"{closer.name} did not finish in {timeout} seconds")
+                ffmpeg.stop()
+                closer.join()
+        logger.info(f"Waited {time.time() - before} seconds for ffmpeg to finish {self._filename}")
+        return self.segments
 
     def is_released(self):
         return self._is_released
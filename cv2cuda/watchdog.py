@@ -0,0 +1,126 @@
+"""
+Watch the ffmpeg processes of video writers and restart the ones that fail.
+
+Every process is followed through its own PID (the Popen of the writer), never by looking up its name
+or command line among the processes of the host, so the encoders of other writers are left alone.
+A process fails when:
+
+    it exits before the writer closes it
+    a write to its pipe has been blocked for longer than stall_timeout (ffmpeg stopped reading)
+    it was sent frames for progress_timeout seconds without reporting any progress (see cv2cuda.progress)
+
+The failed process is stopped, and the writer goes on in a new segment (see FFMPEGVideoWriter watchdog)
+"""
+
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+STALL_TIMEOUT = 5 # seconds
+PROGRESS_TIMEOUT = 10 # seconds
+
+
+def diagnose(ffmpeg, stall_timeout=STALL_TIMEOUT, progress_timeout=PROGRESS_TIMEOUT, now=None):
+    """
+    Return why a cv2cuda.ffmpeg_process.FFMPEG encoding frames has failed, or None if it is healthy
+    """
+    if now is None:
+        now = time.time()
+
+    returncode = ffmpeg.poll()
+    if returncode is not None:
+        return f"ffmpeg (pid {ffmpeg.pid}) exited with code {returncode}"
+
+    write_started = ffmpeg.write_started
+    if write_started is not None and now - write_started > stall_timeout:
+        return f"a write to ffmpeg (pid {ffmpeg.pid}) has been blocked for {round(now - write_started, 1)} seconds"
+
+    stats = ffmpeg.stats
+    if stats is None or ffmpeg.last_write is None or stats.ended:
+        return None
+    # ffmpeg keeps reporting while it is stuck, so the clock runs from the last report with more frames encoded,
+    # or from the first write if it has not encoded any (a process started by a FFMPEGPool reports nothing until it gets frames)
+    advanced = stats.advanced_at or ffmpeg.first_write
+    if ffmpeg.frames_written > stats.frame and ffmpeg.last_write - advanced > progress_timeout:
+        return f"ffmpeg (pid {ffmpeg.pid}) has been sent frames for {round(ffmpeg.last_write - advanced, 1)} seconds without encoding any"
+
+    return None
+
+
+class EncoderWatchdog:
+    """
+    A thread that checks the ffmpeg process of every video writer it watches each interval seconds.
+    A single watchdog can be shared by all the writers of a program
+
+    Arguments:
+        * interval (float): Seconds between checks
+        * stall_timeout (float): Seconds a write to the pipe of ffmpeg can be blocked
+        * progress_timeout (float): Seconds ffmpeg can be sent frames without reporting progress
+    """
+
+    def __init__(self, interval=0.5, stall_timeout=STALL_TIMEOUT, progress_timeout=PROGRESS_TIMEOUT):
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.progress_timeout = progress_timeout
+        self._writers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def watch(self, writer):
+        """
+        Check the ffmpeg process of writer, which must have an _ffmpeg attribute
+        and an _on_failure(ffmpeg, reason) method, like FFMPEGVideoWriter
+        """
+        with self._lock:
+            if writer not in self._writers:
+                self._writers.append(writer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cv2cuda-watchdog", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, writer):
+        with self._lock:
+            if writer in self._writers:
+                self._writers.remove(writer)
+
+    @property
+    def writers(self):
+        with self._lock:
+            return list(self._writers)
+
+    def check(self, writer):
+        """
+        Check the ffmpeg process of writer once. Returns the reason of the failure, if it failed
+        """
+        ffmpeg = writer._ffmpeg
+        try:
+            reason = diagnose(ffmpeg, self.stall_timeout, self.progress_timeout)
+        except Exception as error:
+            logger.warning(f"Could not check the ffmpeg of {writer}: {error}")
+            return None
+
+        if reason is not None:
+            writer._on_failure(ffmpeg, reason)
+        return reason
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            # unwatch waits for the check to end, so a writer is not checked while it closes ffmpeg
+            with self._lock:
+                for writer in self._writers:
+                    self.check(writer)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
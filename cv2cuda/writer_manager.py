@@ -0,0 +1,268 @@
+"""
+One I/O thread feeding many ffmpeg processes.
+
+The stdin pipes of the processes are non-blocking and watched by a single selector loop,
+which writes whatever each pipe takes when it becomes writable and picks up the rest later.
+The frames of every stream wait in their own FrameRing, so a slow encoder only fills its own ring
+and does not hold back the others
+"""
+
+import os
+import logging
+import selectors
+import threading
+
+import cv2
+
+from cv2cuda.ffmpeg_process import FFMPEG, PIX_FMT_CHANNELS
+from cv2cuda.frame_ring import FrameRing
+from cv2cuda.video_writer import FFMPEGVideoWriter, PYTHON_CONVERSIONS
+
+logger = logging.getLogger(__name__)
+
+
+class ManagedStream:
+    """
+    A video written by a WriterManager, with the interface of a video writer.
+    Returned by WriterManager.open
+    """
+
+    def __init__(self, manager, filename, ffmpeg, ring, frameSize, pix_fmt):
+        self._manager = manager
+        self._filename = filename
+        self._ffmpeg = ffmpeg
+        self._ring = ring
+        self._width, self._height = frameSize
+        self._pix_fmt = pix_fmt
+        self._fd = ffmpeg._process.stdin.fileno()
+        # slot being piped and the bytes of it ffmpeg did not take yet
+        self._slot = None
+        self._pending = None
+        self._registered = False
+        self._defunct = False
+        self._drained = threading.Event()
+        self._returncode = None
+
+    def __str__(self):
+        return self._filename
+
+    @property
+    def frames_written(self):
+        """
+        Number of frames passed to ffmpeg
+        """
+        return self._ffmpeg.frames_written
+
+    @property
+    def frames_queued(self):
+        return self._ring.queued
+
+    @property
+    def frames_dropped(self):
+        return self._ring.dropped
+
+    @property
+    def stats(self):
+        return self._ffmpeg.stats
+
+    def write(self, image, timeout=None):
+        """
+        Copy the frame into the queue of this stream and return.
+        Returns False if the frame was dropped (queue full or ffmpeg defunct)
+        """
+        if self._defunct:
+            return False
+
+        image = image[:self._height, :self._width]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        if channels != PIX_FMT_CHANNELS[self._pix_fmt]:
+            code = PYTHON_CONVERSIONS.get((channels, self._pix_fmt))
+            if code is None:
+                raise Exception(f"Cannot convert frames with {channels} channels to {self._pix_fmt}")
+            image = cv2.cvtColor(image, code)
+
+        queued = self._ring.put(image, timeout=timeout)
+        self._manager._wakeup()
+        return queued
+
+    def release(self):
+        return self._manager.close(self)
+
+
+class WriterManager:
+    """
+    Own several ffmpeg processes and pipe frames to all of them from one thread
+
+        with WriterManager() as manager:
+            streams = [manager.open(f"camera_{i}.mp4", "h264_nvenc", 30, (1280, 1024)) for i in range(8)]
+            ...
+            streams[i].write(frame)
+
+    write copies the frame into the ring of the stream (see cv2cuda.frame_ring.FrameRing)
+    and returns, the I/O thread does the rest
+
+    Arguments:
+        * queue_size (int): Frames queued per stream
+        * overflow (str): What write does when the queue of its stream is full,
+        one of cv2cuda.frame_ring.OVERFLOW_POLICIES
+    """
+
+    def __init__(self, queue_size=16, overflow="block"):
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._streams = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._selector = selectors.DefaultSelector()
+        # written to by write and open to wake up the loop
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+
+        self._thread = threading.Thread(target=self._run, name="WriterManager", daemon=True)
+        self._thread.start()
+
+    def open(self, filename, fourcc, fps, frameSize, isColor=False, device="gpu", pix_fmt=None, **kwargs):
+        """
+        Start ffmpeg for a new video and return its ManagedStream.
+        Arguments are those of cv2cuda.VideoWriter
+        """
+        if self._stopped:
+            raise Exception("The WriterManager is released")
+
+        ffmpeg_kwargs = FFMPEGVideoWriter.ffmpeg_kwargs(
+            frameSize, fps, fourcc, isColor=isColor, pix_fmt=pix_fmt, device=device, **kwargs
+        )
+        ffmpeg = FFMPEG(output=filename, **ffmpeg_kwargs)
+        os.set_blocking(ffmpeg._process.stdin.fileno(), False)
+
+        stream = ManagedStream(
+            self, filename, ffmpeg, FrameRing(self._queue_size, self._overflow), frameSize, ffmpeg_kwargs["pix_fmt"]
+        )
+        with self._lock:
+            self._streams.append(stream)
+        self._wakeup()
+        return stream
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            # the loop has plenty of wake ups pending
+            pass
+
+    def _next_frame(self, stream):
+        index = stream._ring.get(timeout=0)
+        if index is None:
+            return False
+        stream._slot = index
+        stream._pending = memoryview(stream._ring.slot(index)).cast("B")
+        return True
+
+    def _done(self, stream):
+        stream._ring.release(stream._slot)
+        stream._slot = None
+        stream._pending = None
+
+    def _service(self, stream):
+        """
+        Pipe as many queued bytes of the stream as ffmpeg takes without blocking
+        """
+        if stream._defunct:
+            # nobody reads these frames anymore, free their slots
+            while self._next_frame(stream):
+                self._done(stream)
+
+        while not stream._defunct:
+            if stream._pending is None and not self._next_frame(stream):
+                break
+            try:
+                written = os.write(stream._fd, stream._pending)
+            except BlockingIOError:
+                break
+            except (BrokenPipeError, ConnectionResetError):
+                logger.warning(f"The FFMPEG process\n{stream._ffmpeg._command}\nis defunct")
+                stream._defunct = True
+                self._done(stream)
+                break
+
+            stream._pending = stream._pending[written:]
+            if not stream._pending:
+                self._done(stream)
+                stream._ffmpeg.frames_written += 1
+
+        # only wait for the pipe when there is something to write to it
+        wants_write = stream._pending is not None
+        if wants_write and not stream._registered:
+            self._selector.register(stream._fd, selectors.EVENT_WRITE, stream)
+        elif not wants_write and stream._registered:
+            self._selector.unregister(stream._fd)
+        stream._registered = wants_write
+
+        if stream._pending is None and stream._ring.closed and stream._ring.queued == 0:
+            with self._lock:
+                self._streams.remove(stream)
+            stream._drained.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                streams = list(self._streams)
+                stopped = self._stopped
+            if stopped and not streams:
+                break
+
+            # streams waiting for a pipe are serviced when it is writable, the rest may have new frames
+            for stream in streams:
+                if not stream._registered:
+                    self._service(stream)
+
+            for key, events in self._selector.select():
+                if key.fd == self._wakeup_read:
+                    try:
+                        while os.read(self._wakeup_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._service(key.data)
+
+    def close(self, stream):
+        """
+        Pipe the frames queued in the stream, close its ffmpeg and return its exit code
+        """
+        if stream._drained.is_set():
+            return stream._returncode
+
+        stream._ring.close()
+        self._wakeup()
+        stream._drained.wait()
+        stream._returncode = stream._ffmpeg.close()
+        return stream._returncode
+
+    def release(self):
+        """
+        Close all streams and stop the I/O thread
+        """
+        if self._stopped:
+            return
+
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            self.close(stream)
+
+        self._stopped = True
+        self._wakeup()
+        self._thread.join()
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
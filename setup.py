@@ -15,5 +15,5 @@ setup(
 
         ]
     },
-    python_requires=">=3.7.0"
+    python_requires=">=3.8.0"
 )